@@ -0,0 +1,217 @@
+from Data import Generation
+import Disease
+import numpy
+
+# The Batch module runs MANY population models at once. Rather than creating one Model.PopulationModel per set of
+# options and looping through each in turn, we hold the counts for every scenario in NumPy arrays - one element
+# per scenario - and update all of them with a handful of array operations per generation.
+#
+# The arithmetic mirrors Model.Population exactly: each calculation multiplies in the same order and then
+# truncates towards zero (just like int() does), so for counts below 2 ** 53 (the largest whole number a float64
+# can hold exactly) a batch run produces the same numbers as the scalar model.
+#
+# The counts are 64 bit whole numbers, which (unlike Python's) have a largest value. NumPy would silently wrap
+# round to a negative number if a count went past it, so we check every calculation: by default an OverflowError
+# is raised, or with overflow="saturate" the count is held at the largest value (like Numerics.CheckedInt64Arithmetic).
+
+INT64_MAX = numpy.iinfo(numpy.int64).max
+INT64_MIN = numpy.iinfo(numpy.int64).min
+
+
+class BatchPopulation(object):
+
+    def __init__(self, juveniles, adults, seniles, overflow: str = "raise"):
+        # Initialisation of the batch population - each parameter is a sequence with one count per scenario
+        # overflow says what to do when a count doesn't fit in 64 bits - "raise" or "saturate"
+        if overflow not in ("raise", "saturate"):
+            raise ValueError("overflow must be 'raise' or 'saturate'")
+        self.__juveniles = numpy.array(juveniles, dtype=numpy.int64)
+        self.__adults = numpy.array(adults, dtype=numpy.int64)
+        self.__seniles = numpy.array(seniles, dtype=numpy.int64)
+        self.__overflow = overflow
+
+    def get_counts(self):
+        # gets the current juvenile, adult and senile arrays as a tuple
+        return self.__juveniles, self.__adults, self.__seniles
+
+    def set_counts(self, juveniles, adults, seniles):
+        # replaces the current counts (e.g. after moving some of the population between patches)
+        self.__juveniles = juveniles
+        self.__adults = adults
+        self.__seniles = seniles
+
+    def update_to_next_generation(self, options, disease_rates):
+        # the vectorised equivalent of Model.Population.update_to_next_generation - options is a
+        # BatchOptions instance and disease_rates is an array with one disease rate per scenario
+        juveniles_born = self.calculate_born_juveniles(options.adult_birth_rate)
+        surviving_juveniles = self.calculate_surviving_juveniles(options.juvenile_survival_rate, disease_rates)
+        surviving_adults = self.calculate_surviving_adults(options.adult_survival_rate)
+        surviving_seniles = self.calculate_surviving_seniles(options.senile_survival_rate, disease_rates)
+
+        self.__seniles = self.add(surviving_seniles, surviving_adults)
+        self.__adults = surviving_juveniles
+        self.__juveniles = juveniles_born
+
+    def calculate_born_juveniles(self, adult_birth_rate):
+        return self.truncate(self.__adults * adult_birth_rate)
+
+    def calculate_surviving_juveniles(self, juvenile_survival_rate, disease_rates):
+        return self.truncate(self.__juveniles * juvenile_survival_rate * (100 - disease_rates) / 100)
+
+    def calculate_surviving_adults(self, adult_survival_rate):
+        return self.truncate(self.__adults * adult_survival_rate)
+
+    def calculate_surviving_seniles(self, senile_survival_rate, disease_rates):
+        return self.truncate(self.__seniles * senile_survival_rate * (100 - disease_rates) / 100)
+
+    def get_total_population(self):
+        # the total population of every scenario as an array
+        return self.__juveniles + self.__adults + self.__seniles
+
+    def truncate(self, values):
+        # the array version of int() - numpy.trunc rounds towards zero, then we convert back to whole numbers
+        # (2.0 ** 63 is the first float too big to fit in a 64 bit whole number)
+        values = numpy.trunc(values)
+        too_big = numpy.abs(values) >= 2.0 ** 63
+        if not too_big.any():
+            return values.astype(numpy.int64)
+        return self.__overflowed(numpy.where(too_big, 0, values).astype(numpy.int64), too_big, values > 0)
+
+    def add(self, first, second):
+        # adds two arrays of counts, checking for any that went past the 64 bit limit
+        total = first + second
+        too_big = ((second > 0) & (first > INT64_MAX - second)) | ((second < 0) & (first < INT64_MIN - second))
+        if not too_big.any():
+            return total
+        return self.__overflowed(total, too_big, second > 0)
+
+    def __overflowed(self, values, too_big, positive):
+        # some values didn't fit - either raise an error or replace them with the largest (or smallest) value
+        if self.__overflow == "raise":
+            raise OverflowError("Population count does not fit in 64 bits")
+        values[too_big & positive] = INT64_MAX
+        values[too_big & ~positive] = INT64_MIN
+        return values
+
+
+class BatchOptions(object):
+    # A column-wise view of a list of Data.ModelRunOptions - each field becomes an array with one value per
+    # scenario, so the rates can be applied to every scenario in one operation.
+    def __init__(self, options: []):
+        self.starting_juveniles = numpy.array([o.starting_juveniles for o in options], dtype=numpy.int64)
+        self.starting_adults = numpy.array([o.starting_adults for o in options], dtype=numpy.int64)
+        self.starting_seniles = numpy.array([o.starting_seniles for o in options], dtype=numpy.int64)
+        self.generations = numpy.array([o.generations for o in options], dtype=numpy.int64)
+        self.juvenile_survival_rate = numpy.array([o.juvenile_survival_rate for o in options], dtype=numpy.float64)
+        self.adult_survival_rate = numpy.array([o.adult_survival_rate for o in options], dtype=numpy.float64)
+        self.senile_survival_rate = numpy.array([o.senile_survival_rate for o in options], dtype=numpy.float64)
+        self.adult_birth_rate = numpy.array([o.adult_birth_rate for o in options], dtype=numpy.float64)
+        self.disease_trigger = numpy.array([o.disease_trigger for o in options], dtype=numpy.float64)
+
+    def get_scenario_count(self):
+        return len(self.generations)
+
+
+class BatchPopulationModel(object):
+    def __init__(self, options: [], random_generator=None, overflow: str = "raise", disease_model=None,
+                 common_random_numbers: bool = False):
+        # Initialising a new batch model - we take a list of Data.ModelRunOptions (one per scenario) and
+        # optionally a numpy random Generator used to draw disease rates. If we aren't given one we create
+        # a new one seeded from the operating system. overflow says what to do with counts that don't fit
+        # in 64 bits (see BatchPopulation). disease_model is one of the strategies in the Disease module
+        # (ThresholdDisease if we aren't given one). common_random_numbers True gives every scenario the same
+        # random disease rate each generation, rather than one of its own (see the Disease module)
+        self.__disease_model = disease_model if disease_model is not None else Disease.ThresholdDisease()
+        self.__common_random_numbers = common_random_numbers
+        self.__options = BatchOptions(options)
+        self.__random = random_generator if random_generator is not None else numpy.random.default_rng()
+        self.__population = BatchPopulation(self.__options.starting_juveniles, self.__options.starting_adults,
+                                            self.__options.starting_seniles, overflow)
+        # we run every scenario for the longest number of generations requested - shorter scenarios are
+        # trimmed back to their own length when their generations are read
+        self.__generations = int(self.__options.generations.max()) if len(options) > 0 else 0
+        # the history is stored as four 2D arrays - one row per generation, one column per scenario
+        shape = (self.__generations + 1, self.__options.get_scenario_count())
+        self.__juveniles = numpy.zeros(shape, dtype=numpy.int64)
+        self.__adults = numpy.zeros(shape, dtype=numpy.int64)
+        self.__seniles = numpy.zeros(shape, dtype=numpy.int64)
+        self.__disease_rates = numpy.zeros(shape, dtype=numpy.int64)
+        self.__count = 0
+        self.__record(numpy.zeros(self.__options.get_scenario_count(), dtype=numpy.int64))
+
+    def __record(self, disease_rates):
+        # copies the current state of the population into the next row of the history
+        juveniles, adults, seniles = self.__population.get_counts()
+        self.__juveniles[self.__count] = juveniles
+        self.__adults[self.__count] = adults
+        self.__seniles[self.__count] = seniles
+        self.__disease_rates[self.__count] = disease_rates
+        self.__count += 1
+
+    def get_scenario_count(self):
+        return self.__options.get_scenario_count()
+
+    def get_generations_count(self):
+        # the number of generations recorded so far (shared by all scenarios)
+        return self.__count
+
+    def run_all_generations(self, detect_convergence: bool = False):
+        # runs every scenario for the longest number of generations requested
+        # with detect_convergence we stop as soon as every scenario has settled (see __converged) and fill in the
+        # rest of the history - the results are exactly the same, we just skip the work
+        for generation in range(0, self.__generations):
+            if detect_convergence and self.__converged():
+                self.__fill_remaining()
+                return
+            disease_rates = self.calculate_disease_rates()
+            self.__population.update_to_next_generation(self.__options, disease_rates)
+            self.__record(disease_rates)
+
+    def __converged(self):
+        # True when no scenario will ever change again: each one either stopped changing last generation while
+        # its disease rate is deterministic (e.g. below the trigger for the threshold model - no randomness, so it
+        # stays the same forever, this includes dying out) or has already run all of its own generations
+        if self.__count < 2:
+            return False
+        last = self.__count - 1
+        unchanged = ((self.__juveniles[last] == self.__juveniles[last - 1]) &
+                     (self.__adults[last] == self.__adults[last - 1]) &
+                     (self.__seniles[last] == self.__seniles[last - 1]) &
+                     self.__disease_model.are_deterministic(self.__population.get_total_population(),
+                                                            self.__options.disease_trigger))
+        return bool((unchanged | (self.__options.generations < self.__count)).all())
+
+    def __fill_remaining(self):
+        # copies the last generation (and the disease rate that kept it the same) into every remaining row of the
+        # history
+        last = self.__count - 1
+        for column in (self.__juveniles, self.__adults, self.__seniles, self.__disease_rates):
+            column[self.__count:] = column[last]
+        self.__count = self.__generations + 1
+
+    def calculate_disease_rates(self):
+        # the vectorised equivalent of Model.PopulationModel.calculate_disease_rate - the disease model works out
+        # the rates for every scenario in one go
+        return self.__disease_model.rates(self.__population.get_total_population(), self.__options.disease_trigger,
+                                          self.__count - 1, self.__random, self.__common_random_numbers)
+
+    def get_history(self):
+        # gets the recorded juvenile, adult, senile and disease rate arrays - one row per generation
+        # and one column per scenario
+        return (self.__juveniles[:self.__count], self.__adults[:self.__count],
+                self.__seniles[:self.__count], self.__disease_rates[:self.__count])
+
+    def get_generations(self, scenario: int):
+        # builds a list of Data.Generation objects for a single scenario - the same as you'd get by calling
+        # get_generations on a Model.PopulationModel run with that scenario's options
+        count = min(self.__count, int(self.__options.generations[scenario]) + 1)
+        return [Generation(int(self.__juveniles[g, scenario]), int(self.__adults[g, scenario]),
+                           int(self.__seniles[g, scenario]), int(self.__disease_rates[g, scenario]))
+                for g in range(0, count)]
+
+
+def run_batch(options: [], random_generator=None, overflow: str = "raise", disease_model=None):
+    # helper to create a batch model for the options, run it and return it
+    model = BatchPopulationModel(options, random_generator, overflow, disease_model)
+    model.run_all_generations()
+    return model
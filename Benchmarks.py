@@ -0,0 +1,171 @@
+from Data import ModelRunOptions
+from Model import ModelRunOptionsValidation
+from Model import Population
+from Model import PopulationModel
+from IO import CsvGenerator
+import argparse
+import io
+import json
+import platform
+import subprocess
+import sys
+import time
+
+# The benchmark suite - times the hot paths of the program so we can tell if a change makes them slower.
+# UnitTests.py checks the program gives the right answers, this checks how quickly it gives them.
+#
+# Each benchmark is run a few times and we keep the fastest time (the slower runs are the ones where something
+# else on the machine got in the way). Results are written to a JSON file, and can be compared to a baseline
+# file from an earlier run:
+# python Benchmarks.py --save-baseline benchmark_baseline.json     (before a change)
+# python Benchmarks.py --baseline benchmark_baseline.json          (after it - exits with 1 if anything got slower)
+
+
+def time_function(function, repeats: int):
+    # runs function repeats times and returns the fastest time in seconds
+    best = None
+    for repeat in range(0, repeats):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def benchmark_update_to_next_generation(calls: int):
+    population = Population(1000, 1000, 1000)
+    options = ModelRunOptions(1000, 1000, 1000, calls, 1, 1, 0, 1, 10 ** 9)
+
+    def run():
+        for call in range(0, calls):
+            population.update_to_next_generation(options, 0)
+    return run
+
+
+def benchmark_run_all_generations(generations: int):
+    # the disease trigger keeps the population from growing into huge numbers on long runs
+    options = ModelRunOptions(1000, 1000, 1000, generations, 0.9, 0.9, 0.0, 1.2, 5000)
+
+    def run():
+        PopulationModel(options, 1).run_all_generations()
+    return run
+
+
+def benchmark_csv_export(generations: int):
+    model = PopulationModel(ModelRunOptions(1000, 1000, 1000, generations, 0.9, 0.9, 0.0, 1.2, 5000), 1)
+    model.run_all_generations()
+
+    def run():
+        CsvGenerator.write_generations(model.get_generations(), io.StringIO())
+    return run
+
+
+def benchmark_validation(rows: int):
+    validation = ModelRunOptionsValidation(5, 25)
+    options = [ModelRunOptions(i, i, i, 5 + i % 30, 0.5, 0.5, 0.5, 2, i) for i in range(0, rows)]
+
+    def run():
+        for o in options:
+            validation.validate_starting_juveniles(o.starting_juveniles)
+            validation.validate_starting_adults(o.starting_adults)
+            validation.validate_starting_seniles(o.starting_seniles)
+            validation.validate_generations(o.generations)
+            validation.validate_disease_trigger(o.disease_trigger)
+            validation.validate_adult_birth_rate(o.adult_birth_rate)
+            validation.validate_juvenile_survival_rate(o.juvenile_survival_rate)
+            validation.validate_adult_survival_rate(o.adult_survival_rate)
+            validation.validate_senile_survival_rate(o.senile_survival_rate)
+    return run
+
+
+def benchmark_validate_columns(rows: int):
+    validation = ModelRunOptionsValidation(5, 25)
+    columns = {"starting_juveniles": list(range(0, rows)), "generations": [5 + i % 30 for i in range(0, rows)],
+               "adult_birth_rate": [2] * rows, "juvenile_survival_rate": [0.5] * rows, "disease_trigger": [1] * rows}
+
+    def run():
+        validation.validate_columns(columns)
+    return run
+
+
+def benchmark_import():
+    # starts a new interpreter that imports the library modules - anything slow (like curses) creeping back
+    # into the imports shows up here
+    def run():
+        subprocess.check_call([sys.executable, "-c", "import Data, Model, IO"])
+    return run
+
+
+def get_benchmarks(scale: float):
+    # the benchmarks to run - scale shrinks (or grows) the amount of work, so the tests can run a quick version
+    def scaled(value):
+        return max(1, int(value * scale))
+    return [
+        ("update_to_next_generation x{}".format(scaled(100000)),
+         benchmark_update_to_next_generation(scaled(100000))),
+        ("run_all_generations 25", benchmark_run_all_generations(25)),
+        ("run_all_generations {}".format(scaled(10000)), benchmark_run_all_generations(scaled(10000))),
+        ("run_all_generations {}".format(scaled(1000000)), benchmark_run_all_generations(scaled(1000000))),
+        ("csv_export {}".format(scaled(100000)), benchmark_csv_export(scaled(100000))),
+        ("validation {}".format(scaled(1000)), benchmark_validation(scaled(1000))),
+        ("validation {}".format(scaled(100000)), benchmark_validation(scaled(100000))),
+        ("validate_columns {}".format(scaled(100000)), benchmark_validate_columns(scaled(100000))),
+        ("import Data, Model, IO", benchmark_import())
+    ]
+
+
+def run_benchmarks(scale: float = 1, repeats: int = 3):
+    # runs every benchmark and returns a dictionary of name to fastest time in seconds
+    return {name: time_function(function, repeats) for name, function in get_benchmarks(scale)}
+
+
+def compare(results: {}, baseline: {}, tolerance: float):
+    # compares results to a baseline - returns a list of (name, baseline seconds, seconds) for every benchmark
+    # more than tolerance (e.g. 0.25 = 25%) slower than the baseline
+    regressions = []
+    for name in sorted(results):
+        if name in baseline and results[name] > baseline[name] * (1 + tolerance):
+            regressions.append((name, baseline[name], results[name]))
+    return regressions
+
+
+def write_results(results: {}, file_path: str):
+    with open(file_path, "w") as file:
+        json.dump({"python": platform.python_version(), "machine": platform.machine(), "results": results},
+                  file, indent=2, sort_keys=True)
+
+
+def read_results(file_path: str):
+    with open(file_path) as file:
+        return json.load(file)["results"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the Greenfly Population Model benchmarks")
+    parser.add_argument("--output", default="benchmark_results.json", help="file to write the results to")
+    parser.add_argument("--baseline", default=None, help="baseline results file to compare against")
+    parser.add_argument("--save-baseline", default=None, help="also write the results to this baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slow down (0.25 = 25%%)")
+    parser.add_argument("--scale", type=float, default=1, help="multiplies the amount of work in each benchmark")
+    parser.add_argument("--repeats", type=int, default=3)
+    arguments = parser.parse_args()
+
+    results = run_benchmarks(arguments.scale, arguments.repeats)
+    for name in sorted(results):
+        print("{:<40} {:>12.6f}s".format(name, results[name]))
+    write_results(results, arguments.output)
+    if arguments.save_baseline is not None:
+        write_results(results, arguments.save_baseline)
+
+    if arguments.baseline is not None:
+        regressions = compare(results, read_results(arguments.baseline), arguments.tolerance)
+        for name, baseline, seconds in regressions:
+            print("REGRESSION: {} took {:.6f}s (baseline {:.6f}s)".format(name, seconds, baseline))
+        return 1 if len(regressions) > 0 else 0
+    return 0
+
+
+# points the interpreter at our entry point main()
+if __name__ == "__main__":
+    sys.exit(main())
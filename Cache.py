@@ -0,0 +1,132 @@
+from Data import ModelRunOptions
+from Data import GenerationHistory
+from Model import PopulationModel
+from collections import OrderedDict
+from pathlib import Path
+import hashlib
+import json
+import os
+import pickle
+
+# A cache of model results. Running the model with the same options and the same seed always gives the same
+# generations, so once we've done it we can remember the result and hand it back next time instead of running
+# the model again. The same goes for options that never trigger disease - then the seed doesn't matter at all.
+#
+# Results are kept in memory up to a size limit. When we go over it the least recently used results are thrown
+# away (an "LRU" cache). If we're given a directory, results are also written there, so they survive the
+# memory limit (and the program being restarted).
+
+
+class CacheEntry(object):
+    def __init__(self, history: GenerationHistory, random_state, size: int):
+        self.history = history
+        # the state of the model's random number generator after the run
+        self.random_state = random_state
+        # roughly how many bytes the history takes up
+        self.size = size
+
+
+class ModelRunCache(object):
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, directory: Path = None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__entries = OrderedDict()
+        self.__bytes = 0
+        if directory is not None:
+            directory.mkdir(parents=True, exist_ok=True)
+
+    def run(self, options: ModelRunOptions, seed: int = None):
+        # returns a model that has run all the generations for the options - from the cache if we can
+        entry = self.__find(ModelRunCache.key(options, seed)) if seed is not None else None
+        if entry is None:
+            # results that never had disease are stored without a seed, as they're the same for every seed
+            entry = self.__find(ModelRunCache.key(options, None))
+        if entry is not None:
+            self.hits += 1
+            # we hand out a copy of the history so nothing the caller does to the model can change the cache
+            return PopulationModel.from_history(options, entry.history.copy(), seed, entry.random_state)
+
+        self.misses += 1
+        model = PopulationModel(options, seed)
+        model.run_all_generations()
+        history = model.get_generations()
+        if not any(history.get_columns()[3]):
+            self.__store(ModelRunCache.key(options, None), CacheEntry(history.copy(), None,
+                                                                       ModelRunCache.size_of(history)))
+        elif seed is not None:
+            self.__store(ModelRunCache.key(options, seed),
+                         CacheEntry(history.copy(), model.get_random_source().getstate(),
+                                    ModelRunCache.size_of(history)))
+        return model
+
+    def get_statistics(self):
+        # the counters and current size of the cache as a dictionary
+        return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                "evictions": self.evictions, "entries": len(self.__entries), "bytes": self.__bytes}
+
+    def clear(self):
+        # empties the in memory part of the cache (anything written to the directory stays there)
+        self.__entries = OrderedDict()
+        self.__bytes = 0
+
+    def __find(self, key: str):
+        if key in self.__entries:
+            # move it to the end of the ordered dictionary - the end holds the most recently used entries
+            self.__entries.move_to_end(key)
+            return self.__entries[key]
+        if self.directory is not None:
+            file_path = self.directory / (key + ".pickle")
+            if file_path.exists():
+                with file_path.open('rb') as file:
+                    entry = pickle.load(file)
+                self.disk_hits += 1
+                self.__remember(key, entry)
+                return entry
+        return None
+
+    def __store(self, key: str, entry: CacheEntry):
+        if self.directory is not None:
+            # write to a temporary file and then rename it - so another process never sees half a file
+            file_path = self.directory / (key + ".pickle")
+            temporary_path = self.directory / (key + ".{}.tmp".format(os.getpid()))
+            with temporary_path.open('wb') as file:
+                pickle.dump(entry, file)
+            os.replace(str(temporary_path), str(file_path))
+        self.__remember(key, entry)
+
+    def __remember(self, key: str, entry: CacheEntry):
+        # adds the entry to memory, then throws out the least recently used entries until we're within the limit
+        if entry.size > self.max_bytes:
+            return
+        self.__entries[key] = entry
+        self.__bytes += entry.size
+        while self.__bytes > self.max_bytes:
+            evicted_key, evicted = self.__entries.popitem(last=False)
+            self.__bytes -= evicted.size
+            self.evictions += 1
+
+    @classmethod
+    def key(cls, options: ModelRunOptions, seed: int = None):
+        # a canonical hash of the options and seed - the fields are written as JSON with the keys in a fixed order
+        # so the same options always give the same key (even in a different process). Each field is converted to
+        # its type first (see Data.ModelRunOptions.FIELDS), so a rate of 1 and a rate of 1.0 (or a count of 10.0
+        # and a count of 10) are the same run - but only when that doesn't change the value
+        values = {}
+        for field, field_type in ModelRunOptions.FIELDS:
+            value = getattr(options, field)
+            values[field] = field_type(value) if field_type(value) == value else value
+        text = json.dumps({"options": values, "seed": seed}, sort_keys=True)
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def size_of(cls, history: GenerationHistory):
+        # estimates the number of bytes taken by the history - typed arrays use their item size, lists of big
+        # numbers are estimated at 36 bytes a number (an 8 byte reference plus a ~28 byte integer object)
+        size = 0
+        for column in history.get_columns():
+            size += len(column) * (column.itemsize if hasattr(column, "itemsize") else 36)
+        return size
@@ -0,0 +1,157 @@
+from Data import ModelRunOptions
+from Batch import BatchPopulationModel
+from Sensitivity import check_ranges
+from Sensitivity import options_for_points
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import csv
+import numpy
+import os
+
+# Calibration - finding the rates that make the model match counts we've observed (e.g. greenfly counted in a
+# field each generation). The observed counts are read from a CSV file in the same layout IO.CsvGenerator writes:
+# Generation,Juveniles,Adults,Seniles   (the counts in thousands)
+# Not every generation has to be there - only the generations in the file are compared.
+#
+# We fit the rates with the "cross-entropy method": guess a range for each rate, try lots of random rates from it,
+# keep the best few (the "elite") and narrow the guess down around them - over and over until it settles. It only
+# needs the error of each set of rates (no derivatives), copes with the randomness of disease, and each round is
+# one big batch of runs, so it's done with Batch.BatchPopulationModel - spread over several processes.
+#
+# The error of a set of rates is the mean squared difference between the logs of the modelled and observed
+# counts (log so a generation of millions doesn't drown out one of hundreds). Every candidate gets the same disease
+# rates ("common random numbers" - see the Disease module): every batch starts from the same random seed and each
+# generation's draw is shared by the whole batch. So the disease rates don't change from one candidate (or round)
+# to the next - the differences in error come from the rates, not the luck of the draw.
+
+
+class ObservedSeries(object):
+    # observed counts - generations is the generation number of each row, and each count array lines up with it
+    def __init__(self, generations, juveniles, adults, seniles):
+        self.generations = numpy.asarray(generations, dtype=numpy.int64)
+        self.juveniles = numpy.asarray(juveniles, dtype=numpy.float64)
+        self.adults = numpy.asarray(adults, dtype=numpy.float64)
+        self.seniles = numpy.asarray(seniles, dtype=numpy.float64)
+
+    @classmethod
+    def read_csv(cls, file_path: Path):
+        # reads a file in the IO.CsvGenerator layout - the counts are in thousands, so we multiply them back up
+        generations, juveniles, adults, seniles = [], [], [], []
+        with Path(file_path).open(newline="") as file:
+            for row in csv.DictReader(file):
+                generations.append(int(row["Generation"]))
+                juveniles.append(round(float(row["Juveniles"]) * 1000))
+                adults.append(round(float(row["Adults"]) * 1000))
+                seniles.append(round(float(row["Seniles"]) * 1000))
+        return ObservedSeries(generations, juveniles, adults, seniles)
+
+    def get_starting_counts(self):
+        # the counts in generation 0 - None if it wasn't observed
+        rows = (self.generations == 0).nonzero()[0]
+        if len(rows) == 0:
+            return None
+        return int(self.juveniles[rows[0]]), int(self.adults[rows[0]]), int(self.seniles[rows[0]])
+
+    def get_last_generation(self):
+        return int(self.generations.max())
+
+
+def evaluate_chunk(base_options: ModelRunOptions, fields: [], ranges: {}, points, observed: ObservedSeries,
+                   seed: int, disease_model=None):
+    # runs a chunk of candidate rates (points in the unit hypercube - see Sensitivity.options_for_points) and
+    # returns the error of each one. This is the function the worker processes call
+    options = options_for_points(base_options, fields, ranges, points)
+    model = BatchPopulationModel(options, numpy.random.default_rng(seed), overflow="saturate",
+                                 disease_model=disease_model, common_random_numbers=True)
+    model.run_all_generations()
+    juveniles, adults, seniles, disease_rates = model.get_history()
+    errors = numpy.zeros(len(options))
+    for modelled, counts in ((juveniles, observed.juveniles), (adults, observed.adults),
+                             (seniles, observed.seniles)):
+        # the rows of the history for the observed generations - one column per candidate
+        difference = numpy.log1p(numpy.maximum(modelled[observed.generations], 0)) - \
+            numpy.log1p(counts)[:, numpy.newaxis]
+        errors += (difference ** 2).sum(axis=0)
+    return errors / (3 * len(observed.generations))
+
+
+class CalibrationResult(object):
+    # options - the best options found, error - their error, and best_errors - the best error of each round
+    def __init__(self, options: ModelRunOptions, error: float, best_errors: []):
+        self.options = options
+        self.error = error
+        self.best_errors = best_errors
+
+
+class Calibrator(object):
+    def __init__(self, observed: ObservedSeries, base_options: ModelRunOptions, ranges: {}, seed: int = 0,
+                 processes: int = 1, chunk_size: int = 2000, disease_model=None):
+        # base_options supplies every field that isn't being fitted - ranges maps each field to fit to a
+        # (low, high) tuple (any of Sensitivity.RATE_FIELDS). The starting counts come from the observed
+        # generation 0 (if there is one) and the number of generations from the last observed generation.
+        # processes is the number of worker processes (1 to run in this process, None for one per CPU)
+        self.observed = observed
+        self.fields = check_ranges(ranges)
+        self.ranges = ranges
+        self.seed = seed
+        self.processes = processes
+        self.chunk_size = chunk_size
+        self.disease_model = disease_model
+        values = dict(vars(base_options))
+        starting_counts = observed.get_starting_counts()
+        if starting_counts is not None:
+            values["starting_juveniles"], values["starting_adults"], values["starting_seniles"] = starting_counts
+        values["generations"] = observed.get_last_generation()
+        self.base_options = ModelRunOptions(**values)
+
+    def errors(self, points, executor=None):
+        # the error of each candidate - in chunks, spread over the executor's processes if we're given one. Every
+        # chunk uses the same seed (see the top of this file)
+        starts = range(0, len(points), self.chunk_size)
+        arguments = [(self.base_options, self.fields, self.ranges, points[start:start + self.chunk_size],
+                      self.observed, self.seed, self.disease_model) for start in starts]
+        if executor is None:
+            return numpy.concatenate([evaluate_chunk(*a) for a in arguments])
+        return numpy.concatenate(list(executor.map(evaluate_chunk, *zip(*arguments))))
+
+    def fit(self, iterations: int = 50, candidates: int = 1000, elite_fraction: float = 0.1,
+            smoothing: float = 0.7, tolerance: float = 1e-4):
+        # runs the cross-entropy method and returns a CalibrationResult. The guess for each field is a normal
+        # distribution (a mean and standard deviation) in the unit range 0 to 1 - samples outside it are clipped
+        # back in. smoothing is how much of the new guess replaces the old one each round, and we stop early once
+        # every standard deviation is below tolerance
+        if iterations < 1:
+            raise ValueError("iterations must be 1 or more")
+        generator = numpy.random.default_rng(self.seed)
+        count = len(self.fields)
+        mean = numpy.full(count, 0.5)
+        deviation = numpy.full(count, 0.5)
+        elite_count = max(1, int(candidates * elite_fraction))
+        best_point = None
+        best_error = numpy.inf
+        best_errors = []
+        executor = None
+        if self.processes != 1:
+            executor = ProcessPoolExecutor(self.processes if self.processes is not None else (os.cpu_count() or 1))
+        try:
+            for iteration in range(0, iterations):
+                points = numpy.clip(generator.normal(mean, deviation, size=(candidates, count)), 0, 1)
+                errors = self.errors(points, executor)
+                elite = points[numpy.argsort(errors, kind="stable")[:elite_count]]
+                # candidates whose error isn't a number (e.g. the counts overflowed) can never be the best
+                finite_errors = numpy.where(numpy.isfinite(errors), errors, numpy.inf)
+                if finite_errors.min() < best_error:
+                    best_error = float(finite_errors.min())
+                    best_point = points[int(finite_errors.argmin())]
+                best_errors.append(best_error)
+                mean = smoothing * elite.mean(axis=0) + (1 - smoothing) * mean
+                deviation = smoothing * elite.std(axis=0) + (1 - smoothing) * deviation
+                if (deviation < tolerance).all():
+                    break
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        if best_point is None:
+            raise ValueError("None of the candidates had a finite error - check the ranges and observed counts")
+        options = options_for_points(self.base_options, self.fields, self.ranges, [best_point])[0]
+        return CalibrationResult(options, best_error, best_errors)
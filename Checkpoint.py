@@ -0,0 +1,55 @@
+from Model import PopulationModel
+from pathlib import Path
+import os
+import pickle
+import time
+
+# Checkpointing for long model runs. A checkpoint is a snapshot of a model (see PopulationModel.get_state) saved
+# to a file. If the program is stopped part way through a run (it crashes, or the machine it's on is taken away)
+# we can load the last checkpoint and carry on from there instead of starting again - and because the snapshot
+# includes the random number generator, the rest of the run comes out exactly as it would have.
+#
+# checkpointer = Checkpointer(Path("run.checkpoint"), every_generations=1000)
+# model.run_all_generations(checkpointer)
+# ...and after a crash:
+# model = Checkpointer.resume(Path("run.checkpoint"))
+# model.run_all_generations(checkpointer)
+
+
+class Checkpointer(object):
+    def __init__(self, file_path: Path, every_generations: int = None, every_seconds: float = None,
+                 clock=time.monotonic):
+        # saves to file_path every every_generations generations and/or every every_seconds seconds
+        # (whichever comes first). clock is the function used to read the time - it can be swapped out in tests
+        self.file_path = file_path
+        self.every_generations = every_generations
+        self.every_seconds = every_seconds
+        self.clock = clock
+        self.saves = 0
+        self.__last_save_time = clock()
+
+    def after_generation(self, model: PopulationModel):
+        # called by the model after each generation - saves a checkpoint if one is due
+        generation = model.get_generations_count() - 1
+        if self.every_generations is not None and generation % self.every_generations == 0:
+            self.save(model)
+        elif self.every_seconds is not None and self.clock() - self.__last_save_time >= self.every_seconds:
+            self.save(model)
+
+    def save(self, model: PopulationModel):
+        # writes the model's state to a temporary file and then renames it over the checkpoint - renaming is
+        # atomic, so if we're stopped half way through saving the previous checkpoint is still there intact
+        temporary_path = self.file_path.with_name(self.file_path.name + ".tmp")
+        with temporary_path.open('wb') as file:
+            pickle.dump(model.get_state(), file, pickle.HIGHEST_PROTOCOL)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(str(temporary_path), str(self.file_path))
+        self.saves += 1
+        self.__last_save_time = self.clock()
+
+    @classmethod
+    def resume(cls, file_path: Path):
+        # loads the model saved in a checkpoint file
+        with file_path.open('rb') as file:
+            return PopulationModel.from_state(pickle.load(file))
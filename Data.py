@@ -1,5 +1,6 @@
 # Contains classes used as data objects. That is they represent sets of discrete data in the system
 # These classes do not depend onto any other classes in the system
+from array import array
 
 
 class Generation(object):
@@ -12,15 +13,33 @@ class Generation(object):
     # and then access each value as:
     # juveniles = g.juveniles
     # juveniles_in_thousands = g.juveniles_in_thousands
+    # __slots__ tells Python exactly which fields instances have - so it doesn't need a dictionary per instance,
+    # which makes each generation much smaller in memory
+    __slots__ = ("juveniles", "adults", "seniles", "disease_rate")
+
     def __init__(self, juveniles: int, adults: int, seniles: int, disease_rate: int):
         self.juveniles = juveniles
         self.adults = adults
         self.seniles = seniles
         self.disease_rate = disease_rate
-        self.juveniles_in_thousands = Generation.format_in_thousands(juveniles)
-        self.adults_in_thousands = Generation.format_in_thousands(adults)
-        self.seniles_in_thousands = Generation.format_in_thousands(seniles)
-        self.total_population_in_thousands = Generation.format_in_thousands(juveniles + adults + seniles)
+
+    # the values in thousands are properties - they look like fields when we use them (g.juveniles_in_thousands)
+    # but they're only calculated when someone actually reads them
+    @property
+    def juveniles_in_thousands(self):
+        return Generation.format_in_thousands(self.juveniles)
+
+    @property
+    def adults_in_thousands(self):
+        return Generation.format_in_thousands(self.adults)
+
+    @property
+    def seniles_in_thousands(self):
+        return Generation.format_in_thousands(self.seniles)
+
+    @property
+    def total_population_in_thousands(self):
+        return Generation.format_in_thousands(self.juveniles + self.adults + self.seniles)
 
     # this method doesn't require any of the state of an instance of the class - so it's defined as a class method
     # we access this method through the class name - so if we wanted to use it in code external to this class, we
@@ -32,6 +51,137 @@ class Generation(object):
         return value / 1000
 
 
+class GenerationHistory(object):
+    # Stores a run of generations as columns - one typed array each for juveniles, adults, seniles and disease
+    # rate - rather than as a list of Generation objects. A typed array stores each number in 8 bytes, where a list
+    # of objects costs many times that. Generation objects are only created when a generation is read, so this
+    # class can be used anywhere a list of generations was: len(history), history[0], for g in history...
+    #
+    # The arrays only hold numbers that fit in 64 bits - if a population grows past that we switch to plain lists
+    # (which can hold Python's unlimited size integers) so nothing is ever lost.
+    #
+    # A history can also be told to keep only the most recent generations (its window) - older generations are
+    # dropped, but generations keep their original index (so history[1000] is still generation 1000) and len()
+    # still counts every generation ever appended.
+    def __init__(self, window: int = None):
+        self.__juveniles = array("q")
+        self.__adults = array("q")
+        self.__seniles = array("q")
+        self.__disease_rates = array("q")
+        self.__window = window
+        # the index of the first generation we're still holding
+        self.__first_index = 0
+
+    def set_window(self, window: int):
+        # sets how many of the most recent generations to keep (None keeps them all, 0 keeps none)
+        self.__window = window
+        self.__trim(window)
+
+    def get_window(self):
+        return self.__window
+
+    def get_first_index(self):
+        # gets the index of the oldest generation still held
+        return self.__first_index
+
+    def __trim(self, keep: int):
+        # drops all but the most recent keep generations
+        if keep is None:
+            return
+        drop = len(self.__disease_rates) - keep
+        if drop > 0:
+            for column in self.get_columns():
+                del column[:drop]
+            self.__first_index += drop
+
+    def append(self, juveniles: int, adults: int, seniles: int, disease_rate: int):
+        # with a window we let the columns grow to twice the window before trimming - so we aren't moving
+        # every value along on every append
+        if self.__window is not None and len(self.__disease_rates) > 2 * self.__window:
+            self.__trim(self.__window)
+        count = len(self.__disease_rates)
+        try:
+            self.__juveniles.append(juveniles)
+            self.__adults.append(adults)
+            self.__seniles.append(seniles)
+            self.__disease_rates.append(disease_rate)
+        except (OverflowError, TypeError):
+            # a value didn't fit - throw away any part of this generation we did append, switch to lists
+            # and try again
+            self.__juveniles = list(self.__juveniles[:count])
+            self.__adults = list(self.__adults[:count])
+            self.__seniles = list(self.__seniles[:count])
+            self.__disease_rates = list(self.__disease_rates[:count])
+            self.append(juveniles, adults, seniles, disease_rate)
+
+    def skip(self, generations: int, juveniles: int, adults: int, seniles: int, disease_rate: int):
+        # adds generations generations of which we only know the last (e.g. after Model.Population.fast_forward) -
+        # only allowed when the history keeps no generations (a window of 0), as the others are never held
+        if self.__window != 0:
+            raise ValueError("generations can only be skipped in a history with a window of 0")
+        count = len(self)
+        self.__trim(0)
+        self.__first_index = count + generations - 1
+        self.append(juveniles, adults, seniles, disease_rate)
+
+    def truncate(self, length: int):
+        # throws away every generation from index length onwards
+        if length < self.__first_index:
+            raise IndexError("generation {} is not held in the history".format(length))
+        for column in self.get_columns():
+            del column[length - self.__first_index:]
+
+    def append_generation(self, generation: Generation):
+        self.append(generation.juveniles, generation.adults, generation.seniles, generation.disease_rate)
+
+    def get_columns(self):
+        # gets the juvenile, adult, senile and disease rate columns (of the generations still held)
+        return self.__juveniles, self.__adults, self.__seniles, self.__disease_rates
+
+    def copy(self):
+        history = GenerationHistory(self.__window)
+        history.__juveniles = self.__juveniles[:]
+        history.__adults = self.__adults[:]
+        history.__seniles = self.__seniles[:]
+        history.__disease_rates = self.__disease_rates[:]
+        history.__first_index = self.__first_index
+        return history
+
+    def __len__(self):
+        return self.__first_index + len(self.__disease_rates)
+
+    def __getitem__(self, index):
+        # builds Generation objects on demand - for a slice we return a list of them
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        position = index - self.__first_index
+        if position < 0 or index >= len(self):
+            raise IndexError("generation {} is not held in the history".format(index))
+        return Generation(self.__juveniles[position], self.__adults[position], self.__seniles[position],
+                          self.__disease_rates[position])
+
+    def __iter__(self):
+        # iterates over the generations still held
+        for index in range(self.__first_index, len(self)):
+            yield self[index]
+
+
+class Convergence(object):
+    # describes how a model run settled down - see Model.PopulationModel.run_all_generations
+    # kind is one of the values below, generation is the generation at which we spotted it and period is the
+    # number of generations in the repeating cycle (1 for a population that stopped changing)
+    EXTINCT = "extinct"
+    FIXED_POINT = "fixed_point"
+    CYCLE = "cycle"
+
+    def __init__(self, kind: str, generation: int, period: int):
+        self.kind = kind
+        self.generation = generation
+        self.period = period
+
+
 class ModelRunOptions(object):
 
     # this class is holding the configuration information that we use to run the model
@@ -39,6 +189,13 @@ class ModelRunOptions(object):
     # data objects - these are (typically) called DTOs (Data Transportation Objects) or (dependent on language):
     # POPOs (Plain Old Python Objects) / POCO (Plain Old CLR Objects) / POJO (Plain Old Java Object). That is something
     # with no particular behaviour.
+
+    # the fields, in the order __init__ takes them, along with the type of each one - the other modules that need to
+    # know the fields (to read them from a file, sweep them and so on) use this list, so there's only one to update
+    FIELDS = [("starting_juveniles", int), ("starting_adults", int), ("starting_seniles", int), ("generations", int),
+              ("juvenile_survival_rate", float), ("adult_survival_rate", float), ("senile_survival_rate", float),
+              ("adult_birth_rate", float), ("disease_trigger", int)]
+
     def __init__(self, starting_juveniles: int, starting_adults: int, starting_seniles: int,
                  generations: int, juvenile_survival_rate: float, adult_survival_rate: float,
                  senile_survival_rate: float, adult_birth_rate: float, disease_trigger: int):
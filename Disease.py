@@ -0,0 +1,141 @@
+import math
+import random
+
+# The disease part of the model. Originally the disease rate was hard-wired: once the total population reached the
+# trigger in the options, a random rate between 20 and 49 percent. The classes here let the user pick how disease
+# behaves instead - each one is a "strategy" the model asks for a rate each generation:
+# - ThresholdDisease - the original behaviour (and the default)
+# - DensityDependentDisease - the more crowded the population, the more disease
+# - LogisticDisease - disease ramps up smoothly (an S shaped curve) around the trigger
+# - SeasonalDisease - wraps another strategy and makes its rates rise and fall with the seasons
+#
+# Each strategy has two ways of asking for rates:
+# - rate - one rate for one population, used by Model.PopulationModel
+# - rates - a whole NumPy array of rates at once (one per scenario, or one per generation), used by
+#   Batch.BatchPopulationModel so it can keep doing everything as array operations
+# The trigger is the disease_trigger from the options. NumPy is only imported when rates is used, so the
+# single model doesn't need it. rates can also be asked for shared random numbers - one random draw per generation
+# used by every scenario, rather than one each ("common random numbers"). Then scenarios that only differ in their
+# rates see exactly the same luck, so comparing them shows the effect of the rates alone (see Sensitivity and
+# Calibration).
+#
+# is_deterministic tells the model whether the rate for a population depends on nothing but its size (no random
+# numbers and no generation number). While that's true a run can only repeat itself, which is what
+# Model.PopulationModel's convergence detection relies on.
+
+
+class ThresholdDisease(object):
+    def __init__(self, minimum: int = 20, maximum: int = 50):
+        # rates are picked between minimum and maximum - 1 (the same as random.randrange)
+        self.minimum = minimum
+        self.maximum = maximum
+
+    def rate(self, total: int, trigger: int, generation: int, random_source: random.Random):
+        if total >= trigger:
+            return random_source.randrange(self.minimum, self.maximum)
+        return 0
+
+    def rates(self, totals, triggers, generation, random_generator, shared: bool = False):
+        # we draw a random rate for every scenario (even those below their trigger) so each scenario's random
+        # numbers don't depend on what the others are doing - or with shared, a single rate every scenario uses
+        import numpy
+        random_rates = random_generator.integers(self.minimum, self.maximum,
+                                                 size=None if shared else numpy.shape(totals))
+        return numpy.where(numpy.asarray(totals) >= triggers, random_rates, 0)
+
+    def is_deterministic(self, total: int, trigger: int):
+        # below the trigger there's never any disease
+        return total < trigger
+
+    def are_deterministic(self, totals, triggers):
+        import numpy
+        return numpy.asarray(totals) < triggers
+
+
+class DensityDependentDisease(object):
+    def __init__(self, rate_at_trigger: float = 35, maximum: int = 90):
+        # the rate grows in proportion to the total population - rate_at_trigger percent when the total is the
+        # trigger, twice that at twice the trigger and so on, up to maximum percent
+        self.rate_at_trigger = rate_at_trigger
+        self.maximum = maximum
+
+    def rate(self, total: int, trigger: int, generation: int, random_source: random.Random):
+        if trigger <= 0:
+            return self.maximum
+        return min(self.maximum, int(self.rate_at_trigger * total / trigger))
+
+    def rates(self, totals, triggers, generation, random_generator, shared: bool = False):
+        import numpy
+        triggers = numpy.asarray(triggers, dtype=numpy.float64)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            proportional = numpy.trunc(self.rate_at_trigger * numpy.asarray(totals) / triggers)
+        return numpy.where(triggers <= 0, self.maximum,
+                           numpy.minimum(self.maximum, numpy.nan_to_num(proportional))).astype(numpy.int64)
+
+    def is_deterministic(self, total: int, trigger: int):
+        return True
+
+    def are_deterministic(self, totals, triggers):
+        import numpy
+        return numpy.ones(numpy.shape(totals), dtype=bool)
+
+
+class LogisticDisease(object):
+    def __init__(self, maximum: float = 50, steepness: float = 5):
+        # the rate follows the logistic (S shaped) curve maximum / (1 + e ^ (-steepness * (total - trigger) / trigger))
+        # - half of maximum at the trigger, close to 0 well below it and close to maximum well above it.
+        # steepness says how sharply it changes
+        self.maximum = maximum
+        self.steepness = steepness
+
+    def rate(self, total: int, trigger: int, generation: int, random_source: random.Random):
+        exponent = -self.steepness * (total - trigger) / max(trigger, 1)
+        # e ^ exponent is too big for a float past about 709 - the rate is 0 long before then
+        if exponent > 700:
+            return 0
+        return int(self.maximum / (1 + math.exp(exponent)))
+
+    def rates(self, totals, triggers, generation, random_generator, shared: bool = False):
+        import numpy
+        exponent = -self.steepness * (numpy.asarray(totals) - triggers) / numpy.maximum(triggers, 1)
+        return numpy.trunc(self.maximum / (1 + numpy.exp(numpy.minimum(exponent, 700)))).astype(numpy.int64)
+
+    def is_deterministic(self, total: int, trigger: int):
+        return True
+
+    def are_deterministic(self, totals, triggers):
+        import numpy
+        return numpy.ones(numpy.shape(totals), dtype=bool)
+
+
+class SeasonalDisease(object):
+    def __init__(self, base=None, period: int = 12, amplitude: float = 0.5, phase: int = 0):
+        # multiplies the rates of another strategy (ThresholdDisease if we aren't given one) by
+        # 1 + amplitude * sin(2 * pi * (generation + phase) / period) - so they go up and down over period
+        # generations. Rates are kept between 0 and 100
+        self.base = base if base is not None else ThresholdDisease()
+        self.period = period
+        self.amplitude = amplitude
+        self.phase = phase
+
+    def forcing(self, generation: int):
+        return 1 + self.amplitude * math.sin(2 * math.pi * (generation + self.phase) / self.period)
+
+    def rate(self, total: int, trigger: int, generation: int, random_source: random.Random):
+        base_rate = self.base.rate(total, trigger, generation, random_source)
+        return max(0, min(100, int(base_rate * self.forcing(generation))))
+
+    def rates(self, totals, triggers, generation, random_generator, shared: bool = False):
+        # generation can be a single number or an array (e.g. to get the rates for many generations at once)
+        import numpy
+        base_rates = self.base.rates(totals, triggers, generation, random_generator, shared)
+        forcing = 1 + self.amplitude * numpy.sin(2 * numpy.pi * (numpy.asarray(generation) + self.phase) / self.period)
+        return numpy.clip(numpy.trunc(base_rates * forcing), 0, 100).astype(numpy.int64)
+
+    def is_deterministic(self, total: int, trigger: int):
+        # the rate depends on the generation number - so the same population later on can get a different rate
+        return False
+
+    def are_deterministic(self, totals, triggers):
+        import numpy
+        return numpy.zeros(numpy.shape(totals), dtype=bool)
@@ -0,0 +1,159 @@
+import Data
+import Model
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import csv
+import json
+import os
+import sys
+
+# A non-interactive entry point for running lots of models - e.g. from a batch pipeline on a server without a
+# terminal. It reads ModelRunOptions (one per line of JSON, or one per row of a CSV file with a header row naming
+# the fields), validates them, runs the valid ones across several processes and writes one line of JSON per run.
+#
+# Nothing here needs a terminal - IO only loads the curses library when the console asks for input, so the file
+# writers in IO are fine to use without one (we just don't need them here).
+#
+# Example:
+# python Headless.py options.jsonl --processes 4 > results.jsonl
+
+# the fields of Data.ModelRunOptions, in the order its __init__ takes them, along with the type of each one
+FIELDS = Data.ModelRunOptions.FIELDS
+
+
+def parse_arguments(arguments: []):
+    parser = argparse.ArgumentParser(description="Runs Greenfly Population Models without the menu")
+    parser.add_argument("input", nargs="?", default="-", help="file of options to run (- or missing for stdin)")
+    parser.add_argument("--format", choices=["jsonl", "csv"], default=None,
+                        help="input format (worked out from the file extension if not given, jsonl for stdin)")
+    parser.add_argument("--processes", type=int, default=None, help="number of worker processes (default: CPUs)")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="base seed - each run uses seed + its line number unless the line has its own seed")
+    parser.add_argument("--min-generations", type=int, default=5)
+    parser.add_argument("--max-generations", type=int, default=25)
+    return parser.parse_args(arguments)
+
+
+def read_rows(file, input_format: str):
+    # reads the rows of options from an open file - each row is a dictionary of field name to value. We hand back
+    # (row, error) pairs - error is a message (and row is None) for a line that isn't a JSON object, so one bad line
+    # is reported on its own rather than stopping everything
+    if input_format == "csv":
+        for row in csv.DictReader(file):
+            yield row, None
+    else:
+        for line in file:
+            if line.strip() == "":
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield None, "Line is not valid JSON"
+                continue
+            if not isinstance(row, dict):
+                yield None, "Line is not a JSON object"
+                continue
+            yield row, None
+
+
+def parse_integer(value):
+    # int() - but only for whole numbers, so 10.9 (or True) is rejected rather than quietly becoming 10 (or 1),
+    # just like the console only accepts whole numbers
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError("{} is not a whole number".format(value))
+    return int(value)
+
+
+def parse_options(row: {}, validation: Model.ModelRunOptionsValidation):
+    # turns a row into a Data.ModelRunOptions - returns a tuple of (options, errors) where errors is a dictionary
+    # of field name to message (and options is None if there were any errors)
+    values = []
+    errors = {}
+    for field, parser in FIELDS:
+        if row.get(field) is None or row.get(field) == "":
+            errors[field] = "Missing value"
+            continue
+        try:
+            value = parse_integer(row[field]) if parser is int else parser(row[field])
+        except (TypeError, ValueError):
+            errors[field] = "Please enter a valid {}".format("integer" if parser is int else "number")
+            continue
+        # every field has a validate_ method on the validation object with a matching name
+        validation_error = getattr(validation, "validate_" + field)(value)
+        if validation_error is not None:
+            errors[field] = validation_error
+        values.append(value)
+    if len(errors) > 0:
+        return None, errors
+    return Data.ModelRunOptions(*values), errors
+
+
+def run_options(index: int, options: Data.ModelRunOptions, seed: int):
+    # runs a single model (in a worker process) and returns the line of JSON to write for it
+    model = Model.PopulationModel(options, seed)
+    model.run_all_generations()
+    juveniles, adults, seniles, disease_rates = model.get_generations().get_columns()
+    return json.dumps({"index": index, "seed": model.get_seed(),
+                       "generations": [list(g) for g in zip(juveniles, adults, seniles, disease_rates)]})
+
+
+def parse_seed(row: {}, base_seed: int, index: int):
+    # the seed for a row - its own seed if it has one, otherwise base_seed + its line number (or None without a
+    # base seed). Returns a tuple of (seed, error)
+    seed = row.get("seed")
+    if seed is None or seed == "":
+        return (base_seed + index if base_seed is not None else None), None
+    try:
+        return parse_integer(seed), None
+    except (TypeError, ValueError):
+        return None, "Please enter a valid integer"
+
+
+def run(arguments: [], input_file, output_file):
+    # runs everything - returns the exit code (0 if every line was valid, 1 if any were rejected)
+    arguments = parse_arguments(arguments)
+    input_format = arguments.format
+    if input_format is None:
+        input_format = "csv" if arguments.input.lower().endswith(".csv") else "jsonl"
+    validation = Model.ModelRunOptionsValidation(arguments.min_generations, arguments.max_generations)
+    workers = arguments.processes if arguments.processes is not None else (os.cpu_count() or 1)
+    exit_code = 0
+
+    with ProcessPoolExecutor(workers) as executor:
+        # only keep a few runs per worker in flight - so we stream through the input rather than reading it all
+        window = 4 * workers
+        pending = []
+        for index, (row, row_error) in enumerate(read_rows(input_file, input_format)):
+            if row_error is not None:
+                options, errors = None, {"row": row_error}
+            else:
+                options, errors = parse_options(row, validation)
+                seed, seed_error = parse_seed(row, arguments.seed, index)
+                if seed_error is not None:
+                    options = None
+                    errors["seed"] = seed_error
+            if options is None:
+                exit_code = 1
+                output_file.write(json.dumps({"index": index, "errors": errors}) + "\n")
+                continue
+            pending.append(executor.submit(run_options, index, options, seed))
+            if len(pending) >= window:
+                output_file.write(pending.pop(0).result() + "\n")
+        for future in pending:
+            output_file.write(future.result() + "\n")
+    output_file.flush()
+    return exit_code
+
+
+def main():
+    arguments = sys.argv[1:]
+    input_path = parse_arguments(arguments).input
+    if input_path == "-":
+        return run(arguments, sys.stdin, sys.stdout)
+    with open(input_path, newline="") as input_file:
+        return run(arguments, input_file, sys.stdout)
+
+
+# points the interpreter at our entry point main()
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,36 @@
-import _curses
 import Data
 import Model
 from pathlib import Path
+import array
+import importlib
+import itertools
+import json
+import mmap
+import struct
+import sys
 
 # note the imports above:
-# we're bringing in access to all the classes defined in _curses (an external library responsible for
-# console input output), all the classes defined in our own modules Data & Model, and finally a single
-# class from pathlib (the Path class)
+# we're bringing in access to all the classes defined in our own modules Data & Model, and finally a single
+# class from pathlib (the Path class) and a few standard library modules used for writing files
+
+
+class LazyModule(object):
+    # Stands in for a module that isn't imported until one of its attributes is first used. We use it for _curses:
+    # only the terminal UI (Menu, MenuOption and Console) needs it, and importing it is slow and needs a terminal.
+    # This way the rest of this module (e.g. CsvGenerator) can be used by programs that never draw a menu.
+    def __init__(self, name: str):
+        self.__name = name
+        self.__module = None
+
+    def __getattr__(self, attribute):
+        # __getattr__ is only called for attributes the object doesn't have itself - so _curses.COLOR_RED ends up
+        # here, where we import the real module (the first time) and hand back its attribute
+        if self.__module is None:
+            self.__module = importlib.import_module(self.__name)
+        return getattr(self.__module, attribute)
+
+
+_curses = LazyModule("_curses")
 
 
 class Menu(object):
@@ -136,16 +160,184 @@ class CsvGenerator(object):
 
     @classmethod
     def write_generations_file(cls, model: Model.PopulationModel, file_path: Path):
-        # get the CSV lines using the method above
-        csv = CsvGenerator.generate_csv_for_generations(model.get_generations())
-        # open the file for writing (note there's no error handling in here!)
-        file = file_path.open('w')
-        for i in range(0, len(csv)):
-            # iterate over each line we got passed and write it the file we just opened
-            file.write(csv[i] + "\n")
-        # CLOSE the file (this is v. important - otherwise we're holding onto a file handle AFTER we've finished
-        # which is very, very bad)
-        file.close()
+        # writes all the generations held by the model to a CSV file - this uses the streaming writer below
+        generations = model.get_generations()
+        CsvGenerator.stream_generations_file(generations, file_path, generations.get_first_index())
+
+    @classmethod
+    def stream_model_file(cls, model: Model.PopulationModel, file_path: Path):
+        # runs the model while writing it to a CSV file - each generation is written as soon as it's calculated
+        # and the model is told to keep none of them, so even a very long run uses a fixed amount of memory
+        held = model.get_generations()
+        CsvGenerator.stream_generations_file(itertools.chain(held, model.iterate_generations(0)), file_path,
+                                             held.get_first_index())
+
+    @classmethod
+    def stream_generations_file(cls, generations, file_path: Path, first_index: int = None,
+                                buffer_size: int = 1024 * 1024):
+        # writes any iterable of generations (a list, a Data.GenerationHistory, a model's iterate_generations...)
+        # to a CSV file - we open the file with a large buffer so the operating system sees a few big writes
+        # rather than one small write per line. The "with" block closes the file for us - even if there's an error.
+        with file_path.open('w', buffering=buffer_size) as file:
+            CsvGenerator.write_generations(generations, file, first_index)
+
+    @classmethod
+    def write_generations(cls, generations, file, first_index: int = None, chunk_size: int = 10000):
+        # writes the header and a line per generation to an open file. The lines are exactly the same as the ones
+        # from generate_csv_for_generations, but rather than formatting and writing one line at a time we build
+        # chunk_size lines into a single string and write that in one go.
+        # first_index is the number of the first generation - if it isn't given, a Data.GenerationHistory starts
+        # from the first generation it holds (which isn't 0 if it has a window) and anything else from 0
+        file.write("Generation,Juveniles,Adults,Seniles\n")
+        if first_index is None:
+            first_index = generations.get_first_index() if isinstance(generations, Data.GenerationHistory) else 0
+        if isinstance(generations, Data.GenerationHistory):
+            # the fast path - read straight from the history's columns, without creating Generation objects
+            juveniles, adults, seniles, disease_rates = generations.get_columns()
+            rows = zip(itertools.count(first_index), juveniles, adults, seniles)
+        else:
+            rows = ((index, g.juveniles, g.adults, g.seniles)
+                    for index, g in zip(itertools.count(first_index), generations))
+        # a "preformatted template" - looking up the format method once saves doing it for every line
+        row = "{},{},{},{}\n".format
+        chunk = []
+        for index, juvenile_count, adult_count, senile_count in rows:
+            chunk.append(row(index, juvenile_count / 1000, adult_count / 1000, senile_count / 1000))
+            if len(chunk) == chunk_size:
+                file.write("".join(chunk))
+                chunk = []
+        if len(chunk) > 0:
+            file.write("".join(chunk))
+
+
+class BinaryGenerator(object):
+    # Writes generations to a binary file - much smaller and faster to write and read than CSV. The layout is:
+    # - 8 bytes:  the "magic" marker b"GFPMCOL1" - so we can tell the file is one of ours (and which version)
+    # - 4 bytes:  the length of the header (a little endian whole number)
+    # - a header: JSON text describing the file - the ModelRunOptions, the number of generations, the index of the
+    #             first generation, the names of the columns and the byte order the numbers were written in
+    # - padding:  zero bytes up to a multiple of 8, so each column starts on an 8 byte boundary
+    # - columns:  juveniles, then adults, then seniles, then disease rates - each one an 8 byte whole number
+    #             per generation, one after the other
+    # As the columns are simple blocks of numbers, BinaryGenerationsFile can read them straight out of a memory
+    # mapped file - the operating system only loads the parts that are actually read.
+    MAGIC = b"GFPMCOL1"
+    COLUMNS = ["juveniles", "adults", "seniles", "disease_rate"]
+
+    @classmethod
+    def write_generations_file(cls, model: Model.PopulationModel, file_path: Path):
+        # writes the generations held by the model, along with its options
+        BinaryGenerator.write_history(model.get_generations(), model.get_options(), file_path)
+
+    @classmethod
+    def write_history(cls, history: Data.GenerationHistory, options: Data.ModelRunOptions, file_path: Path):
+        columns = []
+        for column in history.get_columns():
+            try:
+                columns.append(column if isinstance(column, array.array) else array.array("q", column))
+            except OverflowError:
+                raise ValueError("Population too large to be written in the binary format")
+        header = json.dumps({
+            "options": vars(options),
+            "count": len(columns[0]),
+            "first_index": history.get_first_index(),
+            "columns": BinaryGenerator.COLUMNS,
+            "type": "q",
+            "byte_order": sys.byteorder
+        }).encode("utf-8")
+        with file_path.open('wb') as file:
+            file.write(BinaryGenerator.MAGIC)
+            file.write(struct.pack("<I", len(header)))
+            file.write(header)
+            file.write(b"\0" * BinaryGenerator.padding(len(BinaryGenerator.MAGIC) + 4 + len(header)))
+            for column in columns:
+                column.tofile(file)
+
+    @classmethod
+    def open_generations_file(cls, file_path: Path):
+        # opens a binary generations file for reading - see BinaryGenerationsFile
+        return BinaryGenerationsFile(file_path)
+
+    @classmethod
+    def padding(cls, length: int):
+        # the number of bytes needed to take length up to the next multiple of 8
+        return (8 - length % 8) % 8
+
+
+class BinaryGenerationsFile(object):
+    # Reads a file written by BinaryGenerator through a memory map. Use it in a "with" block so it gets closed:
+    # with BinaryGenerator.open_generations_file(path) as generations:
+    #     adults = generations.get_column("adults")
+    # The columns are memoryviews onto the file - they work like read only lists of numbers (and can be handed
+    # to numpy.frombuffer) - and they can't be used once the file is closed.
+    def __init__(self, file_path: Path):
+        self.__file = file_path.open('rb')
+        self.__views = []
+        self.__columns = {}
+        try:
+            # mapping an empty file raises a ValueError - we mustn't leave the file open when it does
+            self.__map = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self.__file.close()
+            raise
+        try:
+            if self.__map[0:len(BinaryGenerator.MAGIC)] != BinaryGenerator.MAGIC:
+                raise ValueError("{} is not a binary generations file".format(file_path))
+            header_start = len(BinaryGenerator.MAGIC) + 4
+            header_length = struct.unpack("<I", self.__map[len(BinaryGenerator.MAGIC):header_start])[0]
+            self.__header = json.loads(self.__map[header_start:header_start + header_length].decode("utf-8"))
+            self.__data_start = header_start + header_length + BinaryGenerator.padding(header_start + header_length)
+        except Exception:
+            self.close()
+            raise
+
+    def get_options(self):
+        return Data.ModelRunOptions(**self.__header["options"])
+
+    def get_first_index(self):
+        return self.__header["first_index"]
+
+    def get_column(self, name: str):
+        # gets one of the columns (juveniles, adults, seniles or disease_rate)
+        if name not in self.__columns:
+            count = self.__header["count"]
+            size = array.array(self.__header["type"]).itemsize
+            start = self.__data_start + self.__header["columns"].index(name) * count * size
+            if self.__header["byte_order"] == sys.byteorder:
+                view = memoryview(self.__map)[start:start + count * size].cast(self.__header["type"])
+                self.__views.append(view)
+            else:
+                # written on a machine with the opposite byte order - we have to read and swap this column
+                view = array.array(self.__header["type"], self.__map[start:start + count * size])
+                view.byteswap()
+            self.__columns[name] = view
+        return self.__columns[name]
+
+    def __len__(self):
+        return self.__header["count"]
+
+    def __getitem__(self, index: int):
+        # builds the Data.Generation at the specified position in the file
+        return Data.Generation(*[self.get_column(name)[index] for name in BinaryGenerator.COLUMNS])
+
+    def __iter__(self):
+        for index in range(0, len(self)):
+            yield self[index]
+
+    def close(self):
+        # the memoryviews have to be released before the memory map can be closed
+        for view in self.__views:
+            view.release()
+        self.__views = []
+        self.__columns = {}
+        self.__map.close()
+        self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
 
 class Console(object):
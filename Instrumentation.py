@@ -0,0 +1,45 @@
+import time
+
+# Optional timing instrumentation for the model. When a sweep is slow this tells us where the time goes - each
+# "phase" (a named piece of work, e.g. calculating the disease rate) gets a count of how many times it ran and the
+# total number of seconds it took.
+#
+# Instrumentation is opt-in: pass an Instrumentation to Model.PopulationModel (or Model.Population) and it records
+# into it. Without one the model runs exactly the code it always has, so there's no cost when it's switched off.
+
+# the names of the phases the model records
+CALCULATE_DISEASE_RATE = "calculate_disease_rate"
+UPDATE_TO_NEXT_GENERATION = "update_to_next_generation"
+CREATE_GENERATION = "create_generation_from_current_state"
+HISTORY_APPEND = "history_append"
+
+
+class Instrumentation(object):
+    def __init__(self, clock=time.perf_counter):
+        # clock is the function used to read the time - it can be swapped out in tests
+        self.clock = clock
+        self.__counts = {}
+        self.__seconds = {}
+
+    def record(self, phase: str, seconds: float):
+        # adds one run of a phase taking the specified number of seconds
+        self.__counts[phase] = self.__counts.get(phase, 0) + 1
+        self.__seconds[phase] = self.__seconds.get(phase, 0.0) + seconds
+
+    def get_count(self, phase: str):
+        return self.__counts.get(phase, 0)
+
+    def get_seconds(self, phase: str):
+        return self.__seconds.get(phase, 0.0)
+
+    def get_stats(self):
+        # a simple dictionary of the results - phase name to a dictionary of count, total seconds and the average
+        # seconds per run - easy to print, or to write out with the json module
+        return {phase: {"count": self.__counts[phase],
+                        "seconds": self.__seconds[phase],
+                        "seconds_per_call": self.__seconds[phase] / self.__counts[phase]}
+                for phase in self.__counts}
+
+    def reset(self):
+        self.__counts = {}
+        self.__seconds = {}
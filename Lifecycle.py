@@ -0,0 +1,143 @@
+from Data import ModelRunOptions
+from Model import PopulationModel
+import Disease
+import numpy
+import random
+
+# A generalised version of the population model, with any number of lifecycle stages (eggs, nymph instars, winged
+# adults...) rather than just juveniles, adults and seniles.
+#
+# Every stage contributes to the stages of the next generation at some rate - those rates go in a "transition
+# matrix" where transitions[i][j] is the rate at which stage j becomes (or gives birth to) stage i. So for the
+# original model (stages juvenile, adult, senile):
+# | 0                       adult birth rate      0                    |
+# | juvenile survival rate  0                     0                    |
+# | 0                       adult survival rate   senile survival rate |
+# Each stage also has a disease susceptibility between 0 and 1 - the fraction of the disease rate it suffers (in the
+# original model juveniles and seniles suffer the full rate and adults none of it).
+#
+# Each generation is a single matrix operation: we multiply every count by every rate at once, apply disease,
+# truncate each contribution (just like int() does in Model.Population) and add up the rows. Truncating each
+# contribution separately, rather than the totals, is what makes the three stage version give exactly the same
+# numbers as Model.Population.
+
+
+class StageDefinition(object):
+    # describes one lifecycle stage
+    def __init__(self, name: str, disease_susceptibility: float = 0.0):
+        self.name = name
+        self.disease_susceptibility = disease_susceptibility
+
+
+class LifecycleOptions(object):
+    # the lifecycle equivalent of Data.ModelRunOptions
+    def __init__(self, stages: [], transitions: [], starting_counts: [], generations: int, disease_trigger: int):
+        self.stages = stages
+        self.transitions = transitions
+        self.starting_counts = starting_counts
+        self.generations = generations
+        self.disease_trigger = disease_trigger
+
+    @classmethod
+    def from_model_run_options(cls, options: ModelRunOptions):
+        # the three stage lifecycle that matches the original model
+        return LifecycleOptions([StageDefinition("Juvenile", 1), StageDefinition("Adult", 0),
+                                 StageDefinition("Senile", 1)],
+                                [[0, options.adult_birth_rate, 0],
+                                 [options.juvenile_survival_rate, 0, 0],
+                                 [0, options.adult_survival_rate, options.senile_survival_rate]],
+                                [options.starting_juveniles, options.starting_adults, options.starting_seniles],
+                                options.generations, options.disease_trigger)
+
+
+class StagedPopulation(object):
+    # the lifecycle equivalent of Model.Population - holds one count per stage
+    def __init__(self, options: LifecycleOptions, counts: []):
+        stage_count = len(options.stages)
+        self.__transitions = numpy.array(options.transitions, dtype=numpy.float64)
+        if self.__transitions.shape != (stage_count, stage_count):
+            raise ValueError("transitions must be a {0} x {0} matrix".format(stage_count))
+        if len(counts) != stage_count:
+            raise ValueError("there must be a count for each of the {} stages".format(stage_count))
+        self.__susceptibility = numpy.array([s.disease_susceptibility for s in options.stages], dtype=numpy.float64)
+        self.__susceptible = self.__susceptibility > 0
+        self.__counts = numpy.array(counts, dtype=numpy.int64)
+
+    def get_counts(self):
+        return self.__counts.copy()
+
+    def get_total_population(self):
+        return int(self.__counts.sum())
+
+    def update_to_next_generation(self, disease_rate: int):
+        # contributions[i][j] is how many of stage j's count go to stage i - numpy multiplies each column of the
+        # transition matrix by the count of its stage
+        contributions = self.__counts * self.__transitions
+        if disease_rate != 0:
+            # stages susceptible to disease lose their share of the disease rate
+            contributions = numpy.where(self.__susceptible,
+                                        contributions * (100 - disease_rate * self.__susceptibility) / 100,
+                                        contributions)
+        contributions = numpy.trunc(contributions)
+        if (numpy.abs(contributions) >= 2.0 ** 63).any():
+            raise OverflowError("Population count does not fit in 64 bits")
+        contributions = contributions.astype(numpy.int64)
+        # adding up the contributions to a stage can go past the limit too - a float total is close enough to tell
+        # if we're anywhere near it, and only then do we add them up exactly (as Python whole numbers) to check
+        if (numpy.abs(contributions.sum(axis=1, dtype=numpy.float64)) >= 2.0 ** 62).any():
+            totals = contributions.astype(object).sum(axis=1)
+            limits = numpy.iinfo(numpy.int64)
+            if any(total > limits.max or total < limits.min for total in totals):
+                raise OverflowError("Population count does not fit in 64 bits")
+            self.__counts = totals.astype(numpy.int64)
+        else:
+            self.__counts = contributions.sum(axis=1)
+
+
+class StagedPopulationModel(object):
+    # the lifecycle equivalent of Model.PopulationModel - runs the generations and records a history with one row
+    # per generation and one column per stage
+    def __init__(self, options: LifecycleOptions, seed: int = None, random_source: random.Random = None,
+                 disease_model=None):
+        # disease_model is one of the strategies in the Disease module (ThresholdDisease if we aren't given one)
+        if random_source is None:
+            if seed is None:
+                seed = PopulationModel.new_seed()
+            random_source = random.Random(seed)
+        self.__seed = seed
+        self.__random = random_source
+        self.__disease_model = disease_model if disease_model is not None else Disease.ThresholdDisease()
+        self.__options = options
+        self.__population = StagedPopulation(options, options.starting_counts)
+        self.__counts = numpy.zeros((options.generations + 1, len(options.stages)), dtype=numpy.int64)
+        self.__disease_rates = numpy.zeros(options.generations + 1, dtype=numpy.int64)
+        self.__counts[0] = self.__population.get_counts()
+        self.__count = 1
+
+    def get_seed(self):
+        return self.__seed
+
+    def get_generations_count(self):
+        return self.__count
+
+    def get_history(self):
+        # the counts (one row per generation, one column per stage) and the disease rate of each generation
+        return self.__counts[:self.__count], self.__disease_rates[:self.__count]
+
+    def get_stage_counts(self, stage_name: str):
+        # the count of one stage in every generation
+        names = [stage.name for stage in self.__options.stages]
+        return self.__counts[:self.__count, names.index(stage_name)]
+
+    def run_all_generations(self):
+        for generation in range(self.__count - 1, self.__options.generations):
+            disease_rate = self.calculate_disease_rate()
+            self.__population.update_to_next_generation(disease_rate)
+            self.__counts[self.__count] = self.__population.get_counts()
+            self.__disease_rates[self.__count] = disease_rate
+            self.__count += 1
+
+    def calculate_disease_rate(self):
+        # exactly as Model.PopulationModel does it - so the same seed and disease model give the same disease rates
+        return self.__disease_model.rate(self.__population.get_total_population(), self.__options.disease_trigger,
+                                         self.__count - 1, self.__random)
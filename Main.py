@@ -63,10 +63,15 @@ def run_model():
     # has provided options
     global __model
     if assert_has_options():
-        # create the model instance
-        __model = Model.PopulationModel(__options)
-        # run it
-        __model.run_all_generations()
+        if __model is not None and __model.get_options() is not __options:
+            # the options have changed since the last run - re-run the model with the new ones, which only
+            # calculates the generations the change affects
+            __model.rerun(__options)
+        else:
+            # create the model instance
+            __model = Model.PopulationModel(__options)
+            # run it
+            __model.run_all_generations()
         # print the results
         IO.Console.print_generations(__model)
 
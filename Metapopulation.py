@@ -0,0 +1,131 @@
+from Batch import BatchOptions
+from Batch import BatchPopulation
+import Disease
+import numpy
+
+# A metapopulation is many separate populations (patches - e.g. greenhouse compartments) with some of each
+# population moving (migrating) between neighbouring patches every generation.
+#
+# Every patch has its own Data.ModelRunOptions (so its own rates and disease trigger) and is updated exactly like a
+# scenario in Batch.BatchPopulationModel - all the patches at once with array operations. Then migration is applied.
+#
+# Migration is described by a sparse matrix: rather than a patch x patch table (which would need 10 billion entries
+# for 100,000 patches, almost all of them 0) we only store the links that exist - three arrays holding the source
+# patch, the destination patch and the fraction of the source's population that moves along each link.
+
+
+class MigrationMatrix(object):
+    def __init__(self, patch_count: int, sources: [], destinations: [], rates: []):
+        self.patch_count = patch_count
+        self.sources = numpy.array(sources, dtype=numpy.int64)
+        self.destinations = numpy.array(destinations, dtype=numpy.int64)
+        self.rates = numpy.array(rates, dtype=numpy.float64)
+        if not (len(self.sources) == len(self.destinations) == len(self.rates)):
+            raise ValueError("sources, destinations and rates must be the same length")
+        if len(self.sources) > 0 and (min(self.sources.min(), self.destinations.min()) < 0 or
+                                      max(self.sources.max(), self.destinations.max()) >= patch_count):
+            raise ValueError("patch numbers must be between 0 and {}".format(patch_count - 1))
+        if (self.rates < 0).any():
+            raise ValueError("migration rates must be 0 or greater")
+        # a patch can't send away more than all of its population
+        outgoing = numpy.bincount(self.sources, weights=self.rates, minlength=patch_count)
+        if (outgoing > 1).any():
+            raise ValueError("the migration rates out of a patch must add up to 1 or less")
+        # the links split into layers where no two links in a layer go to the same patch - so each layer's migrants
+        # can be added on with one (overflow checked) array addition, see apply. There are as many layers as the
+        # most links into any one patch (4 for a grid)
+        order = numpy.argsort(self.destinations, kind="stable")
+        sorted_destinations = self.destinations[order]
+        ranks = numpy.zeros(len(order), dtype=numpy.int64)
+        ranks[order] = numpy.arange(len(order)) - numpy.searchsorted(sorted_destinations, sorted_destinations)
+        layer_count = int(ranks.max()) + 1 if len(ranks) > 0 else 0
+        self.__layers = [(ranks == rank).nonzero()[0] for rank in range(0, layer_count)]
+
+    @classmethod
+    def from_neighbours(cls, patch_count: int, neighbours: [], rate: float):
+        # builds a matrix where rate of each patch's population moves to each of its neighbours - neighbours is a
+        # list of (patch, patch) pairs, and migration goes both ways along each pair
+        sources = [a for a, b in neighbours] + [b for a, b in neighbours]
+        destinations = [b for a, b in neighbours] + [a for a, b in neighbours]
+        return MigrationMatrix(patch_count, sources, destinations, [rate] * len(sources))
+
+    @classmethod
+    def grid(cls, width: int, height: int, rate: float):
+        # patches laid out in a grid, each linked to the patches above, below, left and right of it
+        index = numpy.arange(width * height).reshape(height, width)
+        pairs = numpy.concatenate([numpy.stack([index[:, :-1].ravel(), index[:, 1:].ravel()], axis=1),
+                                   numpy.stack([index[:-1, :].ravel(), index[1:, :].ravel()], axis=1)])
+        return MigrationMatrix.from_neighbours(width * height, [tuple(p) for p in pairs.tolist()], rate)
+
+    def apply(self, counts, add):
+        # moves population along every link - the number moving is truncated like every other count in the model
+        # (and worked out from the counts before anything moves, so the order of the links doesn't matter).
+        # add is the function used to add the arrivals on - Batch.BatchPopulation.add, so a patch going past the
+        # 64 bit limit raises an OverflowError or is saturated just like any other count. Leaving can't overflow:
+        # a patch never sends away more than it has
+        migrants = numpy.trunc(counts[self.sources] * self.rates).astype(numpy.int64)
+        moved = counts.copy()
+        numpy.subtract.at(moved, self.sources, migrants)
+        for layer in self.__layers:
+            arriving = numpy.zeros_like(moved)
+            arriving[self.destinations[layer]] = migrants[layer]
+            moved = add(moved, arriving)
+        return moved
+
+
+class MetapopulationModel(object):
+    def __init__(self, options: [], migration: MigrationMatrix, random_generator=None, overflow: str = "raise",
+                 record_history: bool = True, disease_model=None):
+        # options is a list of Data.ModelRunOptions - one per patch. The number of generations run is the first
+        # patch's. record_history False keeps only the current counts (for very large numbers of patches).
+        # disease_model is one of the strategies in the Disease module (ThresholdDisease if we aren't given one)
+        if migration.patch_count != len(options):
+            raise ValueError("the migration matrix is for {} patches but there are options for {}"
+                             .format(migration.patch_count, len(options)))
+        self.__options = BatchOptions(options)
+        self.__migration = migration
+        self.__random = random_generator if random_generator is not None else numpy.random.default_rng()
+        self.__disease_model = disease_model if disease_model is not None else Disease.ThresholdDisease()
+        self.__population = BatchPopulation(self.__options.starting_juveniles, self.__options.starting_adults,
+                                            self.__options.starting_seniles, overflow)
+        self.__generations = int(options[0].generations) if len(options) > 0 else 0
+        self.__record_history = record_history
+        self.__history = []
+        self.__count = 0
+        self.__record(numpy.zeros(len(options), dtype=numpy.int64))
+
+    def __record(self, disease_rates):
+        if self.__record_history:
+            juveniles, adults, seniles = self.__population.get_counts()
+            self.__history.append((juveniles.copy(), adults.copy(), seniles.copy(), disease_rates))
+        self.__count += 1
+
+    def get_generations_count(self):
+        return self.__count
+
+    def get_counts(self):
+        # the current juvenile, adult and senile count of every patch
+        return self.__population.get_counts()
+
+    def get_history(self):
+        # a list with one (juveniles, adults, seniles, disease rates) tuple of arrays per generation
+        return self.__history
+
+    def run_all_generations(self):
+        for generation in range(self.__count - 1, self.__generations):
+            self.run_generation()
+
+    def run_generation(self):
+        # every patch is updated on its own, then some of each patch's population migrates
+        disease_rates = self.calculate_disease_rates()
+        self.__population.update_to_next_generation(self.__options, disease_rates)
+        juveniles, adults, seniles = self.__population.get_counts()
+        add = self.__population.add
+        self.__population.set_counts(self.__migration.apply(juveniles, add), self.__migration.apply(adults, add),
+                                     self.__migration.apply(seniles, add))
+        self.__record(disease_rates)
+
+    def calculate_disease_rates(self):
+        # each patch's rate comes from its own total and its own trigger
+        return self.__disease_model.rates(self.__population.get_total_population(), self.__options.disease_trigger,
+                                          self.__count - 1, self.__random)
@@ -1,6 +1,11 @@
 from Data import ModelRunOptions
 from Data import Generation
+from Data import GenerationHistory
+from Data import Convergence
 from enum import Enum
+import Disease
+import Instrumentation
+import copy
 import random
 
 
@@ -16,11 +21,17 @@ class LifecycleStage(Enum):
 
 class Population(object):
 
-    def __init__(self, juveniles: int, adults: int, seniles: int):
+    def __init__(self, juveniles: int, adults: int, seniles: int,
+                 instrumentation: Instrumentation.Instrumentation = None, arithmetic=None):
         # Initialisation of the population - we take the starting populations and set them as field values
         self.__juveniles = juveniles
         self.__adults = adults
         self.__seniles = seniles
+        # optional choice of how the calculations are done - one of the classes in the Numerics module. Without one
+        # we use plain int(count * rate) (the same as Numerics.FloatArithmetic)
+        self.__arithmetic = arithmetic
+        # optional timing of update_to_next_generation - see the Instrumentation module
+        self.__instrumentation = instrumentation
 
     def create_generation_from_current_state(self, disease_rate: int):
         # creates a new Data.Generation object from the current values of the population
@@ -36,9 +47,36 @@ class Population(object):
         if stage == LifecycleStage.Senile.value:
             return self.__seniles
 
+    def get_counts(self):
+        # gets all three counts at once as a tuple of (juveniles, adults, seniles)
+        return self.__juveniles, self.__adults, self.__seniles
+
     def update_to_next_generation(self, options: ModelRunOptions, disease_rate: int):
+        # update the population to the next generation (see advance below) and return a Data.Generation
+        # representing the new state
+        if self.__instrumentation is not None:
+            return self.__timed_update_to_next_generation(options, disease_rate)
+        self.advance(options, disease_rate)
+        # create and return a new generation instance representing the current state
+        return self.create_generation_from_current_state(disease_rate)
+
+    def __timed_update_to_next_generation(self, options: ModelRunOptions, disease_rate: int):
+        # the same as update_to_next_generation - but recording how long each part takes
+        clock = self.__instrumentation.clock
+        start = clock()
+        self.advance(options, disease_rate)
+        advanced = clock()
+        generation = self.create_generation_from_current_state(disease_rate)
+        created = clock()
+        self.__instrumentation.record(Instrumentation.UPDATE_TO_NEXT_GENERATION, advanced - start)
+        self.__instrumentation.record(Instrumentation.CREATE_GENERATION, created - advanced)
+        return generation
+
+    def advance(self, options: ModelRunOptions, disease_rate: int):
         # perform an update of the current population values based on our models options (contained in the
         # options parameter) - by passing it as a parameter we can control the inputs when performing testing
+        # unlike update_to_next_generation this doesn't create a Generation object - which the model doesn't need
+        # as it records its history in columns
 
         # calculate the number of juveniles born
         juveniles_born = self.calculate_born_juveniles(options.adult_birth_rate)
@@ -50,56 +88,210 @@ class Population(object):
         surviving_seniles = self.calculate_surviving_seniles(options.senile_survival_rate, disease_rate)
 
         # set the new senile population
-        self.__seniles = surviving_seniles + surviving_adults
+        if self.__arithmetic is None:
+            self.__seniles = surviving_seniles + surviving_adults
+        else:
+            self.__seniles = self.__arithmetic.add(surviving_seniles, surviving_adults)
         # set the new adult population
         self.__adults = surviving_juveniles
         # set the new juveniles
         self.__juveniles = juveniles_born
 
-        # create and return a new generation instance representing the current state
-        return self.create_generation_from_current_state(disease_rate)
-
     def calculate_born_juveniles(self, adult_birth_rate: float):
         # calculate how many juveniles are born based on the number of adults and the adult birth rate
+        if self.__arithmetic is not None:
+            return self.__arithmetic.scale(self.__adults, adult_birth_rate)
         return int(self.__adults * adult_birth_rate)
 
     def calculate_surviving_juveniles(self, juvenile_survival_rate: float, disease_rate: float):
         # calculate how many juveniles survive based on the number of juveniles, their survival rate
         # and the disease rate
+        if self.__arithmetic is not None:
+            return self.__arithmetic.scale_with_disease(self.__juveniles, juvenile_survival_rate, disease_rate)
         return int(self.__juveniles * juvenile_survival_rate * (100 - disease_rate) / 100)
 
     def calculate_surviving_adults(self, adult_survival_rate: float):
         # calculate how many adults survive based on the number of adults and their survival rate
+        if self.__arithmetic is not None:
+            return self.__arithmetic.scale(self.__adults, adult_survival_rate)
         return int(self.__adults * adult_survival_rate)
 
     def calculate_surviving_seniles(self, senile_survival_rate: float, disease_rate: float):
         # calculate how many seniles survive based on the number of seniles, their survival rate
         # and the disease rate
+        if self.__arithmetic is not None:
+            return self.__arithmetic.scale_with_disease(self.__seniles, senile_survival_rate, disease_rate)
         return int(self.__seniles * senile_survival_rate * (100 - disease_rate) / 100)
 
     def get_total_population(self):
         # helper method to get the total population (used in testing)
         return self.__juveniles + self.__adults + self.__seniles
 
+    def fast_forward(self, options: ModelRunOptions, generations: int):
+        # advances the population by up to the specified number of generations without disease, stopping early at
+        # the first generation whose total population reaches the disease trigger (from there disease applies, so
+        # the caller has to go back to stepping one generation at a time). Returns the number of generations
+        # advanced. The result is always exactly the same as calling advance(options, 0) that many times.
+        steps = 0
+        if self.__arithmetic is None and Population.has_exact_transition(options):
+            steps = self.__fast_forward_by_matrix(options, generations)
+        # step one generation at a time for whatever's left (everything - if we couldn't use the matrix)
+        while steps < generations and self.get_total_population() < options.disease_trigger:
+            self.advance(options, 0)
+            steps += 1
+        return steps
+
+    def __fast_forward_by_matrix(self, options: ModelRunOptions, generations: int):
+        # Without disease a generation is just a matrix (known as a Leslie matrix) multiplied by the counts:
+        # | juveniles |     | 0                      birth rate           0                    |   | juveniles |
+        # | adults    |  =  | juvenile survival rate 0                    0                    | x | adults    |
+        # | seniles   |     | 0                      adult survival rate  senile survival rate |   | seniles   |
+        # so jumping n generations is multiplying by the matrix to the power of n. We keep the matrix to the power
+        # of 1, 2, 4, 8... and make the biggest jump that keeps the total below the limit, over and over.
+        # Because the total never goes down (see has_exact_transition) if the total after a jump is below the
+        # limit, so was every generation in between.
+        limit = min(options.disease_trigger, Population.EXACT_TOTAL_LIMIT)
+        counts = list(self.get_counts())
+        powers = [Population.transition_matrix(options)]
+        steps = 0
+        while steps < generations and sum(counts) < limit:
+            best = None
+            power = 0
+            while (1 << power) <= generations - steps:
+                if power == len(powers):
+                    # stop squaring once the numbers in the matrix are bigger than the limit
+                    if max(max(row) for row in powers[-1]) >= limit:
+                        break
+                    powers.append(Population.multiply_matrices(powers[-1], powers[-1]))
+                candidate = Population.multiply_matrix_vector(powers[power], counts)
+                if sum(candidate) >= limit:
+                    break
+                best = (power, candidate)
+                power += 1
+            if best is None:
+                break
+            steps += 1 << best[0]
+            counts = best[1]
+        self.__juveniles, self.__adults, self.__seniles = counts
+        return steps
+
+    # The matrix jump uses exact whole number arithmetic, but advance() calculates with floats - which are only
+    # exact for whole numbers below 2 ** 53. The juvenile and senile calculations multiply by 100 before dividing,
+    # so we only jump while the total population is below 2 ** 53 / 100.
+    EXACT_TOTAL_LIMIT = 2 ** 53 // 100
+
+    @classmethod
+    def has_exact_transition(cls, options: ModelRunOptions):
+        # the matrix jump gives exactly the same results as stepping when:
+        # - the birth rate is a whole number and every survival rate is 0 or 1 - so int() never truncates
+        # - the juvenile and senile survival rates are 1 and birth rate + adult survival rate is at least 1 - so
+        #   the total population never goes down (which lets us spot the disease trigger from a jump)
+        birth_rate = options.adult_birth_rate
+        return (float(birth_rate).is_integer() and birth_rate >= 0
+                and options.juvenile_survival_rate == 1
+                and options.senile_survival_rate == 1
+                and options.adult_survival_rate in (0, 1)
+                and birth_rate + options.adult_survival_rate >= 1)
+
+    @classmethod
+    def transition_matrix(cls, options: ModelRunOptions):
+        # the Leslie matrix for a generation without disease (only valid when has_exact_transition is True)
+        return [[0, int(options.adult_birth_rate), 0],
+                [int(options.juvenile_survival_rate), 0, 0],
+                [0, int(options.adult_survival_rate), int(options.senile_survival_rate)]]
+
+    @classmethod
+    def multiply_matrices(cls, left: [], right: []):
+        return [[sum(left[row][k] * right[k][col] for k in range(0, 3)) for col in range(0, 3)]
+                for row in range(0, 3)]
+
+    @classmethod
+    def multiply_matrix_vector(cls, matrix: [], vector: []):
+        return [sum(matrix[row][k] * vector[k] for k in range(0, 3)) for row in range(0, 3)]
+
 
 class PopulationModel(object):
-    def __init__(self, options: ModelRunOptions):
+    def __init__(self, options: ModelRunOptions, seed: int = None, random_source: random.Random = None,
+                 instrumentation: Instrumentation.Instrumentation = None, arithmetic=None, disease_model=None):
         # Initialising a new population model - all we need is an instance of the ModelRunOptions class
         # this contains all the information we need to run the model
 
-        # the disease rate is calculated at random - using the pseudo random number generator
+        # the disease rate is calculated at random - using a pseudo random number generator
         # pseudo random number generators AREN'T really random - they're (like all things in a computer)
         # deterministic - which means they're predictable. That predictability is based on a "seed" value
         # Given the same seed value they will produce the same sequence of random numbers.
-        # By calling random.seed() as we do below a seed value is calculated based on the current
-        # date / time.
-        random.seed()
+        # Each model owns its own generator (rather than sharing the one in the random module) so models
+        # running at the same time can't interfere with each other. We can be given:
+        # - a seed - to reproduce a previous run exactly
+        # - a random_source - any random.Random instance (e.g. a RandomStreams.CounterRandom substream)
+        # - neither - in which case we pick a seed from the operating system, and remember it so the run can
+        #   be reproduced later (see get_seed)
+        if random_source is None:
+            if seed is None:
+                seed = PopulationModel.new_seed()
+            random_source = random.Random(seed)
+        self.__seed = seed
+        self.__random = random_source
+        # the state the random number generator started in - so we can replay its draws when we re-run part of
+        # the model with new options (see update_options)
+        self.__initial_random_state = random_source.getstate()
         # stash away the options in a field
         self.__options = options
+        # the arithmetic the population uses - None for the usual float calculations, or one of the classes in the
+        # Numerics module to keep counts within 64 bits (CheckedInt64Arithmetic) or for exactness (ExactArithmetic)
+        self.__arithmetic = arithmetic
+        # the disease model - one of the strategies in the Disease module (ThresholdDisease, the original
+        # behaviour, if we aren't given one)
+        self.__disease_model = disease_model if disease_model is not None else Disease.ThresholdDisease()
         # create a new population object using the starting populations on the options
-        self.__population = Population(options.starting_juveniles, options.starting_adults, options.starting_seniles)
-        # create list of generations populated with the first generation from the __population object.
-        self.__generations = [self.__population.create_generation_from_current_state(0)]
+        self.__population = Population(options.starting_juveniles, options.starting_adults, options.starting_seniles,
+                                       arithmetic=arithmetic)
+        # create the history of generations (stored as columns of numbers - see Data.GenerationHistory)
+        # populated with the first generation from the __population object.
+        self.__generations = GenerationHistory()
+        juveniles, adults, seniles = self.__population.get_counts()
+        self.__generations.append(juveniles, adults, seniles, 0)
+        # if we're given an Instrumentation we record how long each phase of a generation takes. We pick which
+        # version of the generation step to use once, here - so when there's no instrumentation the model runs
+        # exactly the same code as it would without this feature
+        self.__instrumentation = instrumentation
+        self.__convergence = None
+        if instrumentation is None:
+            self.__step = self.__run_next_generation
+        else:
+            self.__step = self.__timed_run_next_generation
+
+    def get_options(self):
+        # gets the options the model is running with
+        return self.__options
+
+    def get_seed(self):
+        # gets the seed the model's random numbers came from (None if we were given a random_source without one)
+        return self.__seed
+
+    def get_random_source(self):
+        # gets the random number generator used for disease rates
+        return self.__random
+
+    def get_disease_model(self):
+        return self.__disease_model
+
+    @classmethod
+    def from_history(cls, options: ModelRunOptions, history: GenerationHistory, seed: int = None, random_state=None,
+                     arithmetic=None, disease_model=None):
+        # creates a model that carries on from a history of generations we already have (e.g. from a cache) -
+        # the population is set to the last generation and, if we're given one, the random number generator
+        # is put back into the state it was in at the end of that history
+        model = PopulationModel(options, seed, arithmetic=arithmetic, disease_model=disease_model)
+        if random_state is not None:
+            model.__random.setstate(random_state)
+        if seed is None:
+            # we don't know where the random numbers that made the history started
+            model.__initial_random_state = None
+        last = history[-1]
+        model.__population = Population(last.juveniles, last.adults, last.seniles, arithmetic=arithmetic)
+        model.__generations = history
+        return model
 
     def get_generations_count(self):
         # simply gets the count of generations in the model.
@@ -110,30 +302,286 @@ class PopulationModel(object):
         return self.__generations[index]
 
     def get_generations(self):
-        # gets all the generations
+        # gets all the generations - a Data.GenerationHistory, which can be used just like a list of
+        # Data.Generation objects
         return self.__generations
 
-    def run_all_generations(self):
-        # runs the model for number of generations specified in __options
-        for generation in range(0, self.__options.generations):
-            # calculate a disease rate to apply for the current generation
-            disease_rate = self.calculate_disease_rate()
-            # update the population to the next generation and get the result object
-            next_generation = self.__population.update_to_next_generation(self.__options, disease_rate)
-            # add the generation object we just got to the list of generations
-            self.__generations.append(next_generation)
+    def get_state(self):
+        # a snapshot of everything needed to carry on running the model later (see from_state) - the population,
+        # the history so far (which tells us the generation we're up to) and the random number generator. The
+        # random number generator is copied, so running the model on doesn't change the snapshot
+        return {"options": self.__options,
+                "seed": self.__seed,
+                "counts": self.__population.get_counts(),
+                "history": self.__generations.copy(),
+                "random_source": copy.deepcopy(self.__random),
+                "arithmetic": copy.deepcopy(self.__arithmetic),
+                "disease_model": copy.deepcopy(self.__disease_model),
+                "initial_random_state": self.__initial_random_state}
+
+    @classmethod
+    def from_state(cls, state: {}):
+        # creates a model from a snapshot taken by get_state - running it will produce exactly the same
+        # generations as the original model would have
+        arithmetic = copy.deepcopy(state.get("arithmetic"))
+        model = PopulationModel(state["options"], state["seed"], copy.deepcopy(state["random_source"]),
+                                arithmetic=arithmetic, disease_model=copy.deepcopy(state.get("disease_model")))
+        juveniles, adults, seniles = state["counts"]
+        model.__population = Population(juveniles, adults, seniles, arithmetic=arithmetic)
+        model.__generations = state["history"].copy()
+        model.__initial_random_state = state.get("initial_random_state")
+        return model
+
+    def update_options(self, options: ModelRunOptions):
+        # Changes the options of a model that's already been run, keeping as much of its history as is still
+        # right for the new options - so re-running only calculates the generations that change. For example:
+        # - only the number of generations changed - every generation we've got is still right (more generations
+        #   just carry on from the last one, fewer throw the extra ones away)
+        # - the disease trigger changed - the generations are right up to the first one where the population is
+        #   on different sides of the old and new triggers (e.g. a trigger raised above the highest population so
+        #   far doesn't change anything)
+        # - anything else changed - nothing is kept
+        # Other disease models than the threshold one might use the trigger in any way, so for them changing
+        # anything but the number of generations means nothing is kept.
+        # When we go back to an earlier generation the random number generator has to go back too: we put it back
+        # to its starting state and replay the disease rates of the generations we kept - so the result is the
+        # same as a new model with the same seed. Returns the number of generations kept (the history always
+        # keeps generation 0 - so 1 means nothing was kept).
+        # Call run_all_generations (or use rerun) to run the rest.
+        keep = self.__valid_generations(options)
+        self.__options = options
+        self.__convergence = None
+        if keep == len(self.__generations):
+            return keep
+        if keep > 1 and self.__replay_random_numbers(keep):
+            self.__generations.truncate(keep)
+            last = self.__generations[keep - 1]
+            self.__population = Population(last.juveniles, last.adults, last.seniles, arithmetic=self.__arithmetic)
+            return keep
+        # start again from generation 0 (with the random numbers from the start, if we know where they started)
+        if self.__initial_random_state is not None:
+            self.__random.setstate(self.__initial_random_state)
+        self.__population = Population(options.starting_juveniles, options.starting_adults, options.starting_seniles,
+                                       arithmetic=self.__arithmetic)
+        self.__generations = GenerationHistory(self.__generations.get_window())
+        juveniles, adults, seniles = self.__population.get_counts()
+        self.__generations.append(juveniles, adults, seniles, 0)
+        return 1
+
+    def rerun(self, options: ModelRunOptions):
+        # update_options and then run the generations that are needed - returns the number of generations reused
+        keep = self.update_options(options)
+        self.run_all_generations()
+        return keep
+
+    def __valid_generations(self, options: ModelRunOptions):
+        # the number of generations in the history that are still right for the new options (0 for none)
+        old = self.__options
+        for field in vars(old):
+            if field not in ("generations", "disease_trigger") and getattr(old, field) != getattr(options, field):
+                return 0
+        keep = min(len(self.__generations), options.generations + 1)
+        if old.disease_trigger == options.disease_trigger:
+            return keep
+        if type(self.__disease_model) is not Disease.ThresholdDisease or self.__generations.get_first_index() > 0:
+            return 0
+        juveniles, adults, seniles, disease_rates = self.__generations.get_columns()
+        for generation in range(0, keep - 1):
+            total = juveniles[generation] + adults[generation] + seniles[generation]
+            if (total >= old.disease_trigger) != (total >= options.disease_trigger):
+                # the next generation would have a different disease rate
+                return generation + 1
+        return keep
+
+    def __replay_random_numbers(self, keep: int):
+        # puts the random number generator back to its starting state and replays the disease rates of the first
+        # keep generations. Returns False if we can't (we don't know the starting state, or we don't hold the
+        # whole history, or the replayed rates don't match - in which case the generator is back at the start)
+        if self.__initial_random_state is None or self.__generations.get_first_index() > 0:
+            return False
+        self.__random.setstate(self.__initial_random_state)
+        juveniles, adults, seniles, disease_rates = self.__generations.get_columns()
+        for generation in range(0, keep - 1):
+            total = juveniles[generation] + adults[generation] + seniles[generation]
+            rate = self.__disease_model.rate(total, self.__options.disease_trigger, generation, self.__random)
+            if rate != disease_rates[generation + 1]:
+                self.__random.setstate(self.__initial_random_state)
+                return False
+        return True
+
+    def run_all_generations(self, checkpointer=None, detect_convergence: bool = False, fill_remaining: bool = True,
+                            max_cycle_length: int = 16):
+        # runs the model up to the number of generations specified in __options (if we've already run some
+        # generations - e.g. through iterate_generations - we only run the ones that are left)
+        # if we're given a Checkpoint.Checkpointer it gets the chance to save the model after every generation
+        # detect_convergence turns on convergence detection (see __run_detecting_convergence)
+        # when the history doesn't keep any generations (a window of 0) we can skip over stretches without disease
+        # (see __run_fast_forwarding)
+        if detect_convergence:
+            self.__run_detecting_convergence(checkpointer, fill_remaining, max_cycle_length)
+        elif checkpointer is None and self.__can_fast_forward():
+            self.__run_fast_forwarding()
+        else:
+            for generation in range(self.get_generations_count() - 1, self.__options.generations):
+                self.__step()
+                if checkpointer is not None:
+                    checkpointer.after_generation(self)
+        if checkpointer is not None:
+            checkpointer.save(self)
+
+    def __can_fast_forward(self):
+        # Population.fast_forward jumps many generations at once - but the generations it jumps over are never
+        # seen, so we only use it when the history isn't keeping them anyway, the threshold disease model is used
+        # (no disease below the trigger) and the jump is exact for the options (see Population.has_exact_transition)
+        return (self.__generations.get_window() == 0 and self.__arithmetic is None and self.__instrumentation is None
+                and type(self.__disease_model) is Disease.ThresholdDisease
+                and Population.has_exact_transition(self.__options))
+
+    def __run_fast_forwarding(self):
+        # jumps over every stretch of generations below the disease trigger, stepping normally once it's reached
+        remaining = self.__options.generations - (self.get_generations_count() - 1)
+        while remaining > 0:
+            steps = self.__population.fast_forward(self.__options, remaining)
+            if steps > 0:
+                juveniles, adults, seniles = self.__population.get_counts()
+                self.__generations.skip(steps, juveniles, adults, seniles, 0)
+                remaining -= steps
+            else:
+                self.__step()
+                remaining -= 1
+
+    def __run_detecting_convergence(self, checkpointer, fill_remaining: bool, max_cycle_length: int):
+        # Many runs settle down quickly - the population dies out, stops changing, or repeats the same few
+        # generations over and over. While the disease model is deterministic (e.g. below the trigger for the
+        # threshold model there's no randomness) the next generation depends only on the current one: if a
+        # generation is exactly the same as one we had up to max_cycle_length generations ago, every generation
+        # from then on repeats that cycle.
+        # We spot repeats by keeping a dictionary (a hash table) of recent generations. When we find one we record
+        # a Data.Convergence and either fill the rest of the history in from the cycle (fill_remaining) or stop.
+        recent = {}
+        order = []
+        disease_rate = 0
+        for generation in range(self.get_generations_count() - 1, self.__options.generations):
+            state = self.__population.get_counts()
+            if not self.__disease_model.is_deterministic(sum(state), self.__options.disease_trigger):
+                # disease is random - so a cycle can't include this generation, forget everything before it
+                recent = {}
+                order = []
+            elif state in recent:
+                period = generation - recent[state]
+                self.__converge(state, generation, order[-period:], disease_rate, fill_remaining)
+                return
+            else:
+                recent[state] = generation
+                order.append((state, disease_rate))
+                if len(order) > max_cycle_length:
+                    del recent[order.pop(0)[0]]
+            disease_rate = self.__step()
+            if checkpointer is not None:
+                checkpointer.after_generation(self)
+
+    def __converge(self, state: (), generation: int, cycle: [], disease_rate: int, fill_remaining: bool):
+        # records how the run converged and (optionally) fills in the rest of the history from the cycle - the
+        # (generation, disease rate) pairs that repeat, starting with the one that's the same as state.
+        # disease_rate is the rate that led back to state - it replaces the first rate in the cycle (which is the
+        # rate that led into the cycle the first time round)
+        period = len(cycle)
+        if sum(state) == 0:
+            kind = Convergence.EXTINCT
+        elif period == 1:
+            kind = Convergence.FIXED_POINT
+        else:
+            kind = Convergence.CYCLE
+        self.__convergence = Convergence(kind, generation, period)
+        if not fill_remaining:
+            return
+        states = [counts for counts, rate in cycle]
+        rates = [disease_rate] + [rate for counts, rate in cycle[1:]]
+        remaining = self.__options.generations - generation
+        for offset in range(0, remaining):
+            juveniles, adults, seniles = states[(offset + 1) % period]
+            self.__generations.append(juveniles, adults, seniles, rates[(offset + 1) % period])
+        juveniles, adults, seniles = states[remaining % period]
+        self.__population = Population(juveniles, adults, seniles, arithmetic=self.__arithmetic)
+
+    def get_convergence(self):
+        # gets the Data.Convergence found by run_all_generations(detect_convergence=True) - None if the run didn't
+        # converge (or convergence detection wasn't turned on)
+        return self.__convergence
+
+    def iterate_generations(self, window: int = None, checkpointer=None):
+        # a generator version of run_all_generations - each new Data.Generation is handed back (yielded) as soon as
+        # it's calculated, so it can be used (e.g. written to a file) without waiting for the whole run:
+        # for generation in model.iterate_generations(0):
+        #     ...
+        # window sets how many of the most recent generations the model keeps in its history - None keeps them all
+        # (just like run_all_generations), 0 keeps none, so a long run only ever uses a fixed amount of memory
+        # checkpointer works the same as it does for run_all_generations
+        if window is not None:
+            self.__generations.set_window(window)
+        for generation in range(self.get_generations_count() - 1, self.__options.generations):
+            disease_rate = self.__step()
+            if checkpointer is not None:
+                checkpointer.after_generation(self)
+            if self.__instrumentation is None:
+                yield self.__population.create_generation_from_current_state(disease_rate)
+            else:
+                start = self.__instrumentation.clock()
+                next_generation = self.__population.create_generation_from_current_state(disease_rate)
+                self.__instrumentation.record(Instrumentation.CREATE_GENERATION,
+                                              self.__instrumentation.clock() - start)
+                yield next_generation
+        if checkpointer is not None:
+            checkpointer.save(self)
+
+    def __run_next_generation(self):
+        # calculate a disease rate to apply for the current generation
+        disease_rate = self.calculate_disease_rate()
+        # update the population to the next generation
+        self.__population.advance(self.__options, disease_rate)
+        # add the new state of the population to the history of generations
+        juveniles, adults, seniles = self.__population.get_counts()
+        self.__generations.append(juveniles, adults, seniles, disease_rate)
+        return disease_rate
+
+    def __timed_run_next_generation(self):
+        # the same as __run_next_generation - but recording how long each phase takes
+        clock = self.__instrumentation.clock
+        start = clock()
+        disease_rate = self.calculate_disease_rate()
+        calculated = clock()
+        self.__population.advance(self.__options, disease_rate)
+        advanced = clock()
+        juveniles, adults, seniles = self.__population.get_counts()
+        self.__generations.append(juveniles, adults, seniles, disease_rate)
+        appended = clock()
+        self.__instrumentation.record(Instrumentation.CALCULATE_DISEASE_RATE, calculated - start)
+        self.__instrumentation.record(Instrumentation.UPDATE_TO_NEXT_GENERATION, advanced - calculated)
+        self.__instrumentation.record(Instrumentation.HISTORY_APPEND, appended - advanced)
+        return disease_rate
+
+    def get_instrumentation(self):
+        # gets the Instrumentation the model records into (None if it isn't instrumented)
+        return self.__instrumentation
 
     def calculate_disease_rate(self):
-        # using the total population determine if we've got disease - by comparing to the trigger
-        # value in the options
-        total_population = self.__population.get_total_population()
-        if total_population >= self.__options.disease_trigger:
-            return PopulationModel.random_disease_rate()
-        return 0
+        # asks the disease model for the rate to apply to the current generation - it gets the total population,
+        # the trigger value in the options, the number of the generation we're on and our random number generator
+        return self.__disease_model.rate(self.__population.get_total_population(), self.__options.disease_trigger,
+                                         self.get_generations_count() - 1, self.__random)
 
     @classmethod
-    def random_disease_rate(cls):
-        return random.randrange(20, 50)
+    def random_disease_rate(cls, random_source: random.Random = None):
+        # picks a disease rate between 20 and 49 - using the shared generator in the random module
+        # if we aren't given one
+        if random_source is None:
+            return random.randrange(20, 50)
+        return random_source.randrange(20, 50)
+
+    @classmethod
+    def new_seed(cls):
+        # picks a new 64 bit seed using the operating system's source of randomness
+        return random.SystemRandom().getrandbits(64)
 
 
 class ModelRunOptionsValidation(object):
@@ -196,3 +644,84 @@ class ModelRunOptionsValidation(object):
             return "Must be 0 or greater"
         if value > 1:
             return "Must be 1 or less"
+
+    def validate_columns(self, columns: {}):
+        # Validates many rows of options at once - columns maps ModelRunOptions field names to a column of values
+        # (a list or NumPy array, one value per row). Fields that aren't included aren't checked.
+        # The rules are exactly the same as the validate_* methods above - each rule is a NumPy comparison on the
+        # whole column, so millions of rows are checked in a handful of operations. Just like the methods above,
+        # a value that isn't a number (NaN) isn't less than or greater than anything - so it passes.
+        # Returns a ColumnValidationResult
+        import numpy
+        rules = self.column_rules()
+        errors = {}
+        rows = None
+        for field in columns:
+            if field not in rules:
+                raise ValueError("{} is not a ModelRunOptions field".format(field))
+            values = numpy.asarray(columns[field])
+            if rows is not None and len(values) != rows:
+                raise ValueError("every column must have the same number of rows")
+            rows = len(values)
+            # each row gets the number of the first rule it breaks (counting from 1) - or 0 if it's valid. We go
+            # through the rules backwards so earlier rules overwrite later ones
+            codes = numpy.zeros(rows, dtype=numpy.int8)
+            for number in range(len(rules[field]), 0, -1):
+                codes[rules[field][number - 1][0](values)] = number
+            errors[field] = codes
+        return ColumnValidationResult(errors, {field: [message for test, message in rules[field]]
+                                               for field in errors}, rows if rows is not None else 0)
+
+    def column_rules(self):
+        # the rules for each field as a list of (test, message) - a test takes a column and returns True for the
+        # rows that break the rule
+        not_negative = [(lambda values: values < 0, "Must be 0 or greater")]
+        rate = [(lambda values: values < 0, "Must be 0 or greater"), (lambda values: values > 1, "Must be 1 or less")]
+        return {"starting_juveniles": not_negative,
+                "starting_adults": not_negative,
+                "starting_seniles": not_negative,
+                "generations": [
+                    (lambda values: values < self.min_generations,
+                     "Must be equal to or greater than {}".format(self.min_generations)),
+                    (lambda values: values > self.max_generations,
+                     "Must be equal to or less than {}".format(self.max_generations))],
+                "disease_trigger": [(lambda values: values <= 0, "Must be greater than 0")],
+                "adult_birth_rate": not_negative,
+                "juvenile_survival_rate": rate,
+                "adult_survival_rate": rate,
+                "senile_survival_rate": rate}
+
+
+class ColumnValidationResult(object):
+    # the result of ModelRunOptionsValidation.validate_columns. For each field checked there's an array of error
+    # codes - one per row, 0 for valid, otherwise the number of the message (counting from 1) in that field's
+    # list of messages. Storing small numbers rather than a message per row keeps millions of rows small.
+    def __init__(self, errors: {}, messages: {}, rows: int):
+        self.errors = errors
+        self.messages = messages
+        self.rows = rows
+
+    def get_invalid_mask(self):
+        # True for every row with at least one invalid value
+        import numpy
+        mask = numpy.zeros(self.rows, dtype=bool)
+        for codes in self.errors.values():
+            mask |= codes != 0
+        return mask
+
+    def get_error_mask(self, field: str):
+        # True for every row where the field is invalid
+        return self.errors[field] != 0
+
+    def get_invalid_rows(self):
+        # the indexes of the invalid rows
+        return self.get_invalid_mask().nonzero()[0]
+
+    def is_valid(self):
+        return not self.get_invalid_mask().any()
+
+    def get_messages(self, row: int):
+        # the error messages for one row - a dictionary of field name to message, only including invalid fields.
+        # These are the same messages the validate_* methods return
+        return {field: self.messages[field][int(codes[row]) - 1]
+                for field, codes in self.errors.items() if codes[row] != 0}
@@ -0,0 +1,136 @@
+from Data import ModelRunOptions
+from Batch import BatchPopulationModel
+from concurrent.futures import ProcessPoolExecutor
+import numpy
+import os
+import random
+
+# A single run of the model is just one sample - whenever the disease triggers the rate is picked at random.
+# The Monte Carlo runner repeats the same options many times (each repeat is called a replicate) and reports
+# statistics for each generation across all the replicates.
+#
+# Replicates are split into chunks. Each chunk is run as one Batch.BatchPopulationModel and gets its own random
+# stream, spawned from a single seed - so the results depend only on the seed and the chunk size, not on how many
+# processes did the work or in which order the chunks finished.
+#
+# We never keep every replicate: the running sums are exact, and the percentiles are calculated from a fixed size
+# random sample of the replicates (a "reservoir"). So memory stays the same however many replicates we run.
+
+
+class MonteCarloResult(object):
+    # Holds the aggregated statistics of a Monte Carlo run - each list has one value per generation
+    def __init__(self, replicates: int, mean_juveniles: [], mean_adults: [], mean_seniles: [],
+                 mean_total_population: [], total_population_percentiles: {}, disease_probability: []):
+        self.replicates = replicates
+        self.mean_juveniles = mean_juveniles
+        self.mean_adults = mean_adults
+        self.mean_seniles = mean_seniles
+        self.mean_total_population = mean_total_population
+        # maps each requested percentile (e.g. 50) to a list of values, one per generation
+        self.total_population_percentiles = total_population_percentiles
+        # the fraction of replicates that had disease in each generation
+        self.disease_probability = disease_probability
+
+
+class MonteCarloStatistics(object):
+    # Accumulates statistics one chunk at a time. Only fixed size arrays are kept.
+    def __init__(self, generations: int, sample_size: int, seed: int):
+        self.__replicates = 0
+        self.__juveniles = numpy.zeros(generations, dtype=numpy.float64)
+        self.__adults = numpy.zeros(generations, dtype=numpy.float64)
+        self.__seniles = numpy.zeros(generations, dtype=numpy.float64)
+        self.__diseased = numpy.zeros(generations, dtype=numpy.int64)
+        self.__sample = numpy.zeros((sample_size, generations), dtype=numpy.int64)
+        self.__sample_size = sample_size
+        self.__random = random.Random(seed)
+
+    def add(self, juveniles, adults, seniles, disease_rates):
+        # each parameter is a 2D array with one row per replicate and one column per generation
+        self.__juveniles += juveniles.sum(axis=0)
+        self.__adults += adults.sum(axis=0)
+        self.__seniles += seniles.sum(axis=0)
+        self.__diseased += (disease_rates > 0).sum(axis=0)
+        totals = juveniles + adults + seniles
+        for row in totals:
+            # reservoir sampling - the first sample_size rows are always kept, after that each new row replaces
+            # a random kept row with a probability that keeps every replicate equally likely to be in the sample
+            if self.__replicates < self.__sample_size:
+                self.__sample[self.__replicates] = row
+            else:
+                slot = self.__random.randrange(0, self.__replicates + 1)
+                if slot < self.__sample_size:
+                    self.__sample[slot] = row
+            self.__replicates += 1
+
+    def result(self, percentiles: []):
+        count = max(self.__replicates, 1)
+        sample = self.__sample[:min(self.__replicates, self.__sample_size)]
+        total = self.__juveniles + self.__adults + self.__seniles
+        # tolist gives plain Python floats rather than NumPy ones
+        return MonteCarloResult(self.__replicates,
+                                (self.__juveniles / count).tolist(),
+                                (self.__adults / count).tolist(),
+                                (self.__seniles / count).tolist(),
+                                (total / count).tolist(),
+                                {p: numpy.percentile(sample, p, axis=0).tolist() for p in percentiles},
+                                (self.__diseased / count).tolist())
+
+
+def run_chunk(options: ModelRunOptions, replicates: int, seed_sequence, disease_model=None):
+    # runs a chunk of replicates as a single batch - this is the function the worker processes call
+    # (it has to live at the top level of the module so it can be sent to another process)
+    model = BatchPopulationModel([options] * replicates, numpy.random.default_rng(seed_sequence),
+                                 disease_model=disease_model)
+    model.run_all_generations()
+    # the history arrays have one row per generation - we transpose them to have one row per replicate
+    return tuple(values.T.copy() for values in model.get_history())
+
+
+class MonteCarloRunner(object):
+    def __init__(self, processes: int = None, chunk_size: int = 1000, sample_size: int = 10000,
+                 disease_model=None):
+        # processes is the number of worker processes to use (None for one per CPU, 1 to run in this process),
+        # chunk_size the number of replicates in each batch and sample_size the number of replicates kept
+        # for calculating percentiles. disease_model is one of the strategies in the Disease module
+        # (ThresholdDisease if we aren't given one)
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be 1 or more")
+        if sample_size < 1:
+            raise ValueError("sample_size must be 1 or more")
+        self.processes = processes
+        self.chunk_size = chunk_size
+        self.sample_size = sample_size
+        self.disease_model = disease_model
+
+    def run(self, options: ModelRunOptions, replicates: int, seed: int = None, percentiles: [] = (5, 50, 95)):
+        # runs the requested number of replicates of the options and returns a MonteCarloResult
+        if replicates < 1:
+            raise ValueError("replicates must be 1 or more")
+        seed_sequence = numpy.random.SeedSequence(seed)
+        chunks = self.__chunk_sizes(replicates)
+        chunk_seeds = seed_sequence.spawn(len(chunks))
+        statistics = MonteCarloStatistics(options.generations + 1, self.sample_size,
+                                          int(seed_sequence.generate_state(1)[0]))
+
+        if self.processes == 1:
+            for size, chunk_seed in zip(chunks, chunk_seeds):
+                statistics.add(*run_chunk(options, size, chunk_seed, self.disease_model))
+        else:
+            workers = self.processes if self.processes is not None else (os.cpu_count() or 1)
+            with ProcessPoolExecutor(workers) as executor:
+                # only keep a couple of chunks per worker in flight, so we aren't holding every result at once
+                window = 2 * workers
+                pending = []
+                for size, chunk_seed in zip(chunks, chunk_seeds):
+                    pending.append(executor.submit(run_chunk, options, size, chunk_seed, self.disease_model))
+                    if len(pending) >= window:
+                        statistics.add(*pending.pop(0).result())
+                for future in pending:
+                    statistics.add(*future.result())
+
+        return statistics.result(list(percentiles))
+
+    def __chunk_sizes(self, replicates: int):
+        # splits the replicates into chunks of chunk_size (the last chunk may be smaller)
+        full_chunks, remainder = divmod(replicates, self.chunk_size)
+        return [self.chunk_size] * full_chunks + ([remainder] if remainder > 0 else [])
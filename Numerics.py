@@ -0,0 +1,79 @@
+from fractions import Fraction
+
+# The arithmetic used by Model.Population. By default the population calculations are done the simplest way:
+# int(count * rate) - which multiplies using floats. Floats are fast, but they only hold about 16 significant
+# digits, so once a population grows past 2 ** 53 the results start to lose precision - and Python's whole numbers
+# have no upper limit, so a population that keeps growing turns into slower and slower huge numbers.
+#
+# These classes let the user choose explicitly:
+# - FloatArithmetic - what the model has always done (and the fastest)
+# - CheckedInt64Arithmetic - the float calculations, but every result is checked against the limits of a 64 bit whole
+#   number (what most other languages use) - counts that would go past the limit are either held at the limit
+#   ("saturated") or raise an OverflowError. Note this is a check, not a speed up: it's a little SLOWER than
+#   FloatArithmetic, because each result is compared with the limits too. It stops a growing population turning
+#   into huge numbers, and shows what a program using 64 bit counts would have done. For real fixed width (fast)
+#   arithmetic, use Batch.BatchPopulationModel - NumPy does it for whole arrays at once
+# - ExactArithmetic - uses fractions so no precision is ever lost (at the cost of speed)
+
+INT64_MAX = 2 ** 63 - 1
+
+
+class FloatArithmetic(object):
+    def scale(self, count: int, rate: float):
+        # the number of count that survive (or are born) at the specified rate
+        return int(count * rate)
+
+    def scale_with_disease(self, count: int, rate: float, disease_rate: float):
+        # as scale - but also losing disease_rate percent to disease
+        return int(count * rate * (100 - disease_rate) / 100)
+
+    def add(self, first: int, second: int):
+        return first + second
+
+
+class CheckedInt64Arithmetic(FloatArithmetic):
+    def __init__(self, saturate: bool = True):
+        # saturate - True to hold counts at the largest 64 bit number, False to raise an OverflowError instead
+        self.saturate = saturate
+        # the number of times a count had to be held at the limit
+        self.saturations = 0
+
+    def scale(self, count: int, rate: float):
+        return self.check(super().scale(count, rate))
+
+    def scale_with_disease(self, count: int, rate: float, disease_rate: float):
+        return self.check(super().scale_with_disease(count, rate, disease_rate))
+
+    def add(self, first: int, second: int):
+        return self.check(first + second)
+
+    def check(self, value: int):
+        # makes sure value fits in 64 bits
+        if value > INT64_MAX or value < -INT64_MAX - 1:
+            if not self.saturate:
+                raise OverflowError("Population count {} does not fit in 64 bits".format(value))
+            self.saturations += 1
+            return INT64_MAX if value > 0 else -INT64_MAX - 1
+        return value
+
+
+class ExactArithmetic(object):
+    def __init__(self):
+        # rates converted to fractions - we remember them, so each rate is only converted once
+        self.__fractions = {}
+
+    def fraction(self, rate):
+        # converts a rate to an exact fraction. Floats are converted from their shortest decimal form - so 0.26 is
+        # exactly 26 / 100 (what the user typed) rather than the nearest binary float, which is slightly more
+        if rate not in self.__fractions:
+            self.__fractions[rate] = Fraction(repr(rate)) if isinstance(rate, float) else Fraction(rate)
+        return self.__fractions[rate]
+
+    def scale(self, count: int, rate: float):
+        return int(count * self.fraction(rate))
+
+    def scale_with_disease(self, count: int, rate: float, disease_rate: float):
+        return int(count * self.fraction(rate) * (100 - self.fraction(disease_rate)) / 100)
+
+    def add(self, first: int, second: int):
+        return first + second
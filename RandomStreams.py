@@ -0,0 +1,103 @@
+import hashlib
+import random
+
+# Contains a counter based random number generator.
+#
+# Python's standard random.Random (a Mersenne Twister) produces each number from the one before it, so the only way
+# to get to the millionth number is to generate the 999,999 before it. A counter based generator instead works out
+# number n directly by scrambling the counter n together with a key (worked out from the seed and a stream number).
+# That gives us two useful things:
+# - jumping ahead is free - we just add to the counter
+# - every stream number gets its own key, so parallel workers given different streams never share numbers
+#
+# The scrambling function is the finaliser from SplitMix64, a well known 64 bit mixing function.
+
+MASK_64 = (1 << 64) - 1
+GOLDEN_GAMMA = 0x9E3779B97F4A7C15
+
+
+def mix_64(value: int):
+    # scrambles a 64 bit value - small changes to the input completely change the output
+    value = (value ^ (value >> 30)) * 0xBF58476D1CE4E5B9 & MASK_64
+    value = (value ^ (value >> 27)) * 0x94D049BB133111EB & MASK_64
+    return value ^ (value >> 31)
+
+
+class CounterRandom(random.Random):
+    # As we're inheriting from random.Random we get all of its methods (randrange, choice, uniform...) for free -
+    # they're all built on the random() and getrandbits() methods we override below.
+    def __init__(self, seed: int = 0, stream: int = 0):
+        self.__stream = stream
+        self.__key = 0
+        self.__counter = 0
+        super().__init__(seed)
+
+    def seed(self, a=0, version=2):
+        # works out the key for this generator from the seed and stream number, and resets the counter
+        if a is None:
+            a = random.SystemRandom().getrandbits(64)
+        self.__seed = a
+        self.__key = mix_64(CounterRandom.seed_to_64(a) ^ mix_64((self.__stream * GOLDEN_GAMMA) & MASK_64))
+        self.__counter = 0
+
+    @classmethod
+    def seed_to_64(cls, a):
+        # turns a seed into a 64 bit number - text is hashed (in the same way random.Random does), and integers
+        # bigger than 64 bits are folded down 64 bits at a time
+        if isinstance(a, (str, bytes, bytearray)):
+            if isinstance(a, str):
+                a = a.encode()
+            a = int.from_bytes(hashlib.sha512(a).digest(), "big")
+        if not isinstance(a, int):
+            raise TypeError("seed must be an int, str, bytes or bytearray")
+        value = 0
+        a = abs(a)
+        while True:
+            value = mix_64(value ^ (a & MASK_64))
+            a >>= 64
+            if a == 0:
+                return value
+
+    def next_64(self):
+        # the next 64 random bits - the number at the current counter position
+        self.__counter += 1
+        return mix_64((self.__key + self.__counter * GOLDEN_GAMMA) & MASK_64)
+
+    def random(self):
+        # a float in the range [0, 1) - a float has 53 bits of precision so we use the top 53 of our 64 bits
+        return (self.next_64() >> 11) * (1.0 / (1 << 53))
+
+    def getrandbits(self, k: int):
+        # an integer with k random bits, built from as many 64 bit values as we need
+        if k < 0:
+            raise ValueError("number of bits must be non-negative")
+        result = 0
+        bits = 0
+        while bits < k:
+            result = (result << 64) | self.next_64()
+            bits += 64
+        return result >> (bits - k)
+
+    def jump(self, count: int):
+        # skips ahead count numbers without generating them
+        self.__counter += count
+
+    def get_counter(self):
+        return self.__counter
+
+    def get_stream(self):
+        return self.__stream
+
+    def substream(self, stream: int):
+        # creates a new generator with the same seed but a different stream - use a different stream number for
+        # each parallel worker and they'll never share a random number
+        return CounterRandom(self.__seed, stream)
+
+    def getstate(self):
+        return self.__seed, self.__stream, self.__counter
+
+    def setstate(self, state):
+        seed, stream, counter = state
+        self.__stream = stream
+        self.seed(seed)
+        self.__counter = counter
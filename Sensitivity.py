@@ -0,0 +1,220 @@
+from Data import ModelRunOptions
+from Model import PopulationModel
+from Batch import BatchPopulationModel
+import numpy
+import random
+
+# Sensitivity analysis - how much does the population change when we change one of the rates?
+#
+# Local sensitivity (SensitivityModel) - the derivative of each count with respect to each rate, for one set of
+# options. Rather than running the model again with each rate nudged up and down (finite differences - two extra
+# runs per rate), we carry the derivatives along with the counts as the model runs. This is called forward-mode
+# differentiation: each count has a "tangent" (its derivative with respect to each rate) and every update equation
+# works out the new tangents from the old ones using the product rule. For example juveniles are born from adults:
+#   juveniles' = adults * adult_birth_rate
+#   d juveniles' / d rate = d adults / d rate * adult_birth_rate + adults * (1 if rate is adult_birth_rate else 0)
+# Two simplifications make the counts differentiable:
+# - the counts are whole numbers (every result is truncated, like int()) - we treat the truncation as if it
+#   weren't there, so these are the derivatives of the smooth version of the model
+# - the disease rates are held at the values this run drew - changing a rate a tiny amount doesn't change whether
+#   disease triggers (or, for the Disease module's density dependent models, the rate it picks)
+# Because of the second point the derivative with respect to disease_trigger is always 0: moving the trigger a
+# little doesn't change anything until the population crosses it, when the counts jump. Its effect is only
+# visible to the global methods below.
+#
+# Global sensitivity (morris and sobol) - how much each rate matters over a whole range of values. These run
+# thousands of option sets, all through Batch.BatchPopulationModel:
+# - morris - the Morris method. Moves one rate at a time along random paths ("trajectories") through the ranges
+#   and averages the "elementary effects" (the change in output per change in rate). mu_star (the average size
+#   of the effect) ranks how important each rate is, sigma shows whether it interacts with the others
+# - sobol - Sobol indices, estimated with Saltelli's sampling scheme and Jansen's formulas. first_order is the
+#   fraction of the variation in the output caused by each rate on its own, total also includes its interactions
+#   with the other rates
+
+# the rates we can find the sensitivity to (the fields of Data.ModelRunOptions that aren't starting counts or the
+# number of generations)
+RATE_FIELDS = [field for field, field_type in ModelRunOptions.FIELDS
+               if not field.startswith("starting_") and field != "generations"]
+
+# the outputs the global methods can measure - all from the final generation of each run
+OUTPUTS = ["total", "juveniles", "adults", "seniles"]
+
+
+class SensitivityResult(object):
+    # the result of SensitivityModel.run. derivatives maps each of the RATE_FIELDS to a tuple of the derivatives
+    # of the final (juveniles, adults, seniles) with respect to it. total_derivatives maps each field to a list of
+    # the derivative of the total population in every generation
+    def __init__(self, counts: (), derivatives: {}, total_derivatives: {}):
+        self.counts = counts
+        self.derivatives = derivatives
+        self.total_derivatives = total_derivatives
+
+    def get_total_derivative(self, field: str):
+        # the derivative of the final total population with respect to a field
+        return sum(self.derivatives[field])
+
+
+class SensitivityModel(object):
+    def __init__(self, options: ModelRunOptions, seed: int = None, random_source: random.Random = None,
+                 disease_model=None):
+        # the model that's run - the same arguments as Model.PopulationModel
+        self.__model = PopulationModel(options, seed, random_source, disease_model=disease_model)
+        self.__options = options
+
+    def get_model(self):
+        return self.__model
+
+    def run(self):
+        # runs the model and the derivatives together, one generation at a time, and returns a SensitivityResult
+        options = self.__options
+        juveniles, adults, seniles = options.starting_juveniles, options.starting_adults, options.starting_seniles
+        # the tangents - the derivatives of each count with respect to each field (the starting counts don't depend
+        # on any of the rates)
+        tangents = {field: (0.0, 0.0, 0.0) for field in RATE_FIELDS}
+        total_derivatives = {field: [0.0] for field in RATE_FIELDS}
+        for generation in self.__model.iterate_generations():
+            survival = (100 - generation.disease_rate) / 100
+            for field in RATE_FIELDS:
+                d_juveniles, d_adults, d_seniles = tangents[field]
+                # the product rule for each update equation (see the top of this file) - the second term is only
+                # there for the rate the equation uses
+                born = d_adults * options.adult_birth_rate + (adults if field == "adult_birth_rate" else 0)
+                surviving_juveniles = (d_juveniles * options.juvenile_survival_rate +
+                                       (juveniles if field == "juvenile_survival_rate" else 0)) * survival
+                surviving_adults = d_adults * options.adult_survival_rate + \
+                    (adults if field == "adult_survival_rate" else 0)
+                surviving_seniles = (d_seniles * options.senile_survival_rate +
+                                     (seniles if field == "senile_survival_rate" else 0)) * survival
+                tangents[field] = (born, surviving_juveniles, surviving_seniles + surviving_adults)
+                total_derivatives[field].append(sum(tangents[field]))
+            juveniles, adults, seniles = generation.juveniles, generation.adults, generation.seniles
+        return SensitivityResult((juveniles, adults, seniles), tangents, total_derivatives)
+
+
+def options_for_points(base_options: ModelRunOptions, fields: [], ranges: {}, points):
+    # turns points in the "unit hypercube" (each value between 0 and 1) into a list of ModelRunOptions - each
+    # column of points is scaled into the range of its field. disease_trigger is a whole number so it's rounded
+    options = []
+    base = vars(base_options)
+    for point in points:
+        values = dict(base)
+        for field, unit_value in zip(fields, point):
+            low, high = ranges[field]
+            value = low + unit_value * (high - low)
+            values[field] = int(round(value)) if field == "disease_trigger" else float(value)
+        options.append(ModelRunOptions(**values))
+    return options
+
+
+def evaluate(base_options: ModelRunOptions, fields: [], ranges: {}, points, output: str = "total",
+             seed: int = None, chunk_size: int = 10000, disease_model=None):
+    # runs the model for every point (see options_for_points) in batches of chunk_size, and returns an array of
+    # the output for each one. Every run gets the same disease rates each generation ("common random numbers" -
+    # every chunk starts its random numbers from the same seed, and each draw is shared by the whole chunk), so
+    # the differences between the outputs come from the rates, not the luck of the draw
+    if output not in OUTPUTS:
+        raise ValueError("output must be one of {}".format(", ".join(OUTPUTS)))
+    seed_sequence = numpy.random.SeedSequence(seed)
+    results = numpy.zeros(len(points), dtype=numpy.float64)
+    for start in range(0, len(points), chunk_size):
+        options = options_for_points(base_options, fields, ranges, points[start:start + chunk_size])
+        model = BatchPopulationModel(options, numpy.random.default_rng(seed_sequence), disease_model=disease_model,
+                                     common_random_numbers=True)
+        model.run_all_generations()
+        juveniles, adults, seniles, disease_rates = (values[-1] for values in model.get_history())
+        results[start:start + len(options)] = {"total": juveniles + adults + seniles, "juveniles": juveniles,
+                                               "adults": adults, "seniles": seniles}[output]
+    return results
+
+
+def check_ranges(ranges: {}):
+    # the fields to vary, in the order of RATE_FIELDS
+    for field in ranges:
+        if field not in RATE_FIELDS:
+            raise ValueError("{} is not one of {}".format(field, ", ".join(RATE_FIELDS)))
+    return [field for field in RATE_FIELDS if field in ranges]
+
+
+class MorrisResult(object):
+    # mu - the average elementary effect of each field, mu_star - the average size of it (a field whose effect is
+    # sometimes positive and sometimes negative can have a mu near 0 but still matter) and sigma - how much it varies
+    def __init__(self, mu: {}, mu_star: {}, sigma: {}):
+        self.mu = mu
+        self.mu_star = mu_star
+        self.sigma = sigma
+
+
+def morris(base_options: ModelRunOptions, ranges: {}, trajectories: int = 10, levels: int = 4,
+           output: str = "total", seed: int = None, chunk_size: int = 10000, disease_model=None):
+    # ranges maps each field to vary to a (low, high) tuple - every other field comes from base_options.
+    # Each trajectory starts at a random point on a grid of levels values per field, then moves one field at a
+    # time by delta (in random order and direction) - so a trajectory is fields + 1 runs. All the runs are
+    # done together by evaluate
+    fields = check_ranges(ranges)
+    count = len(fields)
+    generator = numpy.random.default_rng(seed)
+    delta = levels / (2 * (levels - 1))
+    points = numpy.zeros((trajectories, count + 1, count))
+    orders = numpy.zeros((trajectories, count), dtype=numpy.int64)
+    steps = numpy.zeros((trajectories, count))
+    for trajectory in range(0, trajectories):
+        # start low enough (or high enough) that the step stays inside the range
+        start = generator.integers(0, levels // 2, size=count) / (levels - 1)
+        direction = generator.choice([-1, 1], size=count)
+        start = numpy.where(direction < 0, start + delta, start)
+        orders[trajectory] = generator.permutation(count)
+        steps[trajectory] = direction * delta
+        points[trajectory, 0] = start
+        for step, field in enumerate(orders[trajectory]):
+            points[trajectory, step + 1] = points[trajectory, step]
+            points[trajectory, step + 1, field] += steps[trajectory, field]
+    results = evaluate(base_options, fields, ranges, points.reshape(-1, count), output, seed, chunk_size,
+                       disease_model).reshape(trajectories, count + 1)
+
+    effects = numpy.zeros((trajectories, count))
+    for trajectory in range(0, trajectories):
+        for step, field in enumerate(orders[trajectory]):
+            effects[trajectory, field] = (results[trajectory, step + 1] - results[trajectory, step]) / \
+                steps[trajectory, field]
+    return MorrisResult({field: float(effects[:, i].mean()) for i, field in enumerate(fields)},
+                        {field: float(numpy.abs(effects[:, i]).mean()) for i, field in enumerate(fields)},
+                        {field: float(effects[:, i].std(ddof=1)) if trajectories > 1 else 0.0
+                         for i, field in enumerate(fields)})
+
+
+class SobolResult(object):
+    # first_order and total map each field to its Sobol index, variance is the variance of the output
+    def __init__(self, first_order: {}, total: {}, variance: float):
+        self.first_order = first_order
+        self.total = total
+        self.variance = variance
+
+
+def sobol(base_options: ModelRunOptions, ranges: {}, samples: int = 1000, output: str = "total",
+          seed: int = None, chunk_size: int = 10000, disease_model=None):
+    # Saltelli's scheme: two random sets of points A and B, and for each field a set AB that's A with that field's
+    # column taken from B - samples * (fields + 2) runs in all, done together by evaluate
+    fields = check_ranges(ranges)
+    count = len(fields)
+    generator = numpy.random.default_rng(seed)
+    a = generator.random((samples, count))
+    b = generator.random((samples, count))
+    ab = numpy.repeat(a[numpy.newaxis], count, axis=0)
+    for i in range(0, count):
+        ab[i, :, i] = b[:, i]
+    points = numpy.concatenate([a, b, ab.reshape(-1, count)])
+    results = evaluate(base_options, fields, ranges, points, output, seed, chunk_size, disease_model)
+    f_a = results[:samples]
+    f_b = results[samples:2 * samples]
+    f_ab = results[2 * samples:].reshape(count, samples)
+    variance = float(numpy.var(numpy.concatenate([f_a, f_b]), ddof=1))
+    first_order = {}
+    total = {}
+    for i, field in enumerate(fields):
+        if variance == 0:
+            first_order[field] = total[field] = 0.0
+            continue
+        # Jansen's estimators
+        first_order[field] = float((variance - numpy.mean((f_b - f_ab[i]) ** 2) / 2) / variance)
+        total[field] = float(numpy.mean((f_a - f_ab[i]) ** 2) / 2 / variance)
+    return SobolResult(first_order, total, variance)
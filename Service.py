@@ -0,0 +1,306 @@
+import Headless
+import Model
+from Cache import ModelRunCache
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+# A job server, so other programs can run models without the menu - they connect over a socket, send the options
+# they want run and get the generations back as they're calculated.
+#
+# It's built with asyncio: rather than a thread per connection, a single thread juggles all the connections,
+# switching between them whenever one is waiting (for data to arrive, to be sent, or for a model to finish). The
+# models themselves are run in a pool of worker processes, so the server stays responsive while they work.
+#
+# The protocol is lines of JSON (the same as Headless.py). A client sends one line per request:
+# {"id": 1, "options": {"starting_juveniles": 10, ...}, "seed": 42}
+# (id is anything the client likes - it's sent back on every reply, seed is optional) and gets back:
+# {"id": 1, "first_index": 0, "generations": [[10, 10, 10, 0], ...]}    - one or more chunks of generations
+# {"id": 1, "done": true, "seed": 42}                                 - once every generation has been sent
+# {"id": 1, "errors": {...}} or {"id": 1, "error": "..."}             - if the request or options are invalid, or
+#                                                                       the run fails
+#
+# A few things keep the server efficient:
+# - identical requests (same options and seed) that arrive before a run has sent anything share that run rather
+#   than starting another one. Once the first chunk has gone out a new request starts a run of its own - we don't
+#   keep the chunks already sent, so memory doesn't grow with the length of the run
+# - runs are split into chunks of generations. Each chunk runs in a worker process and hands back the state of the
+#   model (see Model.PopulationModel.get_state), which the next chunk carries on from - so chunks are sent as
+#   soon as they're ready
+# - only a limited number of chunks are given to the pool at once (a "semaphore" counts them) so a flood of
+#   requests waits its turn rather than piling up in memory
+# - each request only holds a few chunks waiting to be sent (a bounded queue). If a client reads slowly its queue
+#   fills up and the run waits for it, rather than running ahead and holding more and more chunks ("backpressure")
+#
+# Example:
+# python Service.py --port 8765 --processes 4
+
+
+def run_job_chunk(options, seed: int, state: {}, chunk_size: int):
+    # runs the next chunk of generations of a model (in a worker process). state is the model's state after the
+    # previous chunk (None for the first chunk). Returns the new state, the index of the first generation in the
+    # chunk, the generations as [juveniles, adults, seniles, disease rate] and whether the run is finished
+    if state is None:
+        model = Model.PopulationModel(options, seed)
+        first = model.get_generation(0)
+        rows = [[first.juveniles, first.adults, first.seniles, first.disease_rate]]
+        first_index = 0
+    else:
+        model = Model.PopulationModel.from_state(state)
+        rows = []
+        first_index = model.get_generations_count()
+    # a window of 0 - we don't need the model to keep the generations, we're sending them back
+    for generation in islice(model.iterate_generations(0), chunk_size):
+        rows.append([generation.juveniles, generation.adults, generation.seniles, generation.disease_rate])
+    finished = model.get_generations_count() > options.generations
+    return model.get_state(), first_index, rows, finished
+
+
+class Job(object):
+    # one model run - shared by every request for the same options and seed that arrives before it sends anything
+
+    # the most messages waiting to be sent to each subscriber - once a queue is full the run waits
+    QUEUE_SIZE = 4
+
+    def __init__(self, key: str, options, seed: int):
+        self.key = key
+        self.options = options
+        self.seed = seed
+        # True once the first message has been published - too late for anyone else to subscribe
+        self.started = False
+        self.__queues = []
+
+    def subscribe(self):
+        # returns a queue the job's messages will be put on. None is put on the queue after the last message
+        if self.started:
+            raise RuntimeError("Can't subscribe to a job that has already started sending")
+        queue = asyncio.Queue(self.QUEUE_SIZE)
+        self.__queues.append(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        # stops putting messages on a queue (e.g. its client has gone away) - anything waiting on it is thrown away,
+        # so a publish waiting for room in it can carry on
+        if queue in self.__queues:
+            self.__queues.remove(queue)
+        while not queue.empty():
+            queue.get_nowait()
+
+    async def publish(self, message: {}):
+        # waits until every subscriber has room for the message
+        self.started = True
+        for queue in list(self.__queues):
+            if queue in self.__queues:
+                await queue.put(message)
+
+    async def finish(self, message: {}):
+        await self.publish(message)
+        for queue in list(self.__queues):
+            if queue in self.__queues:
+                await queue.put(None)
+        self.__queues = []
+
+
+class ModelService(object):
+    def __init__(self, processes: int = None, chunk_size: int = 1000, max_in_flight: int = None,
+                 min_generations: int = 5, max_generations: int = 25, executor=None):
+        # processes - the number of worker processes (None for one per CPU)
+        # chunk_size - the number of generations run (and sent back) at a time
+        # max_in_flight - the most chunks given to the worker processes at once (two per process if None)
+        # executor - the pool to run models in, if we want to provide our own
+        workers = processes if processes is not None else (os.cpu_count() or 1)
+        self.chunk_size = chunk_size
+        self.max_in_flight = max_in_flight if max_in_flight is not None else 2 * workers
+        self.validation = Model.ModelRunOptionsValidation(min_generations, max_generations)
+        self.runs = 0
+        self.shared_runs = 0
+        self.__executor = executor if executor is not None else ProcessPoolExecutor(workers)
+        self.__owns_executor = executor is None
+        self.__jobs = {}
+        # the writer of each open connection, along with a future that's done once the connection is finished with
+        self.__connections = {}
+        self.__semaphore = None
+        self.__server = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        # starts listening for connections - port 0 picks any free port (see get_port)
+        self.__semaphore = asyncio.Semaphore(self.max_in_flight)
+        self.__server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.__server
+
+    def get_port(self):
+        return self.__server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        # stops listening, closes any connections still open and waits for them to finish
+        self.__server.close()
+        await self.__server.wait_closed()
+        for writer in list(self.__connections):
+            writer.close()
+        if len(self.__connections) > 0:
+            await asyncio.wait(list(self.__connections.values()))
+        if self.__owns_executor:
+            self.__executor.shutdown()
+
+    def submit(self, options, seed: int = None):
+        # returns the Job for the options and seed - the one waiting to start if there is one, otherwise a new one.
+        # Requests without a seed get a seed of their own, so they're never shared
+        if seed is None:
+            seed = Model.PopulationModel.new_seed()
+        key = ModelRunCache.key(options, seed)
+        job = self.__jobs.get(key)
+        if job is not None and not job.started:
+            self.shared_runs += 1
+            return job
+        self.runs += 1
+        job = Job(key, options, seed)
+        self.__jobs[key] = job
+        asyncio.ensure_future(self.__run_job(job))
+        return job
+
+    async def __run_job(self, job: Job):
+        loop = asyncio.get_event_loop()
+        state = None
+        try:
+            finished = False
+            while not finished:
+                async with self.__semaphore:
+                    state, first_index, rows, finished = await loop.run_in_executor(
+                        self.__executor, run_job_chunk, job.options, job.seed, state, self.chunk_size)
+                await job.publish({"first_index": first_index, "generations": rows})
+            await job.finish({"done": True, "seed": job.seed})
+        except Exception as e:
+            await job.finish({"error": str(e)})
+        finally:
+            # the run is over (unless a newer run for the same options has already taken its place)
+            if self.__jobs.get(job.key) is job:
+                del self.__jobs[job.key]
+
+    async def handle_connection(self, reader, writer):
+        # reads requests from a connection until the client closes it - each request is handled separately, so
+        # replies to different requests can be mixed together (they're told apart by their id)
+        lock = asyncio.Lock()
+        requests = []
+        self.__connections[writer] = asyncio.Future()
+        try:
+            while True:
+                line = await reader.readline()
+                if line == b"":
+                    break
+                if line.strip() == b"":
+                    continue
+                requests.append(asyncio.ensure_future(self.__handle_request(line, writer, lock)))
+            if len(requests) > 0:
+                await asyncio.wait(requests)
+        finally:
+            writer.close()
+            self.__connections.pop(writer).set_result(None)
+
+    async def __handle_request(self, line: bytes, writer, lock: asyncio.Lock):
+        # every request gets a reply - if anything unexpected goes wrong it's sent back as an error
+        request_id = None
+        try:
+            try:
+                request = json.loads(line.decode("utf-8"))
+            except ValueError:
+                await self.__send(writer, lock, {"id": None, "error": "Request is not valid JSON"})
+                return
+            if not isinstance(request, dict):
+                await self.__send(writer, lock, {"id": None, "error": "Request is not a JSON object"})
+                return
+            request_id = request.get("id")
+            await self.__run_request(request, request_id, writer, lock)
+        except ConnectionError:
+            # the client has gone away - the run carries on for anyone else waiting for it
+            pass
+        except Exception as e:
+            try:
+                await self.__send(writer, lock, {"id": request_id, "error": str(e)})
+            except ConnectionError:
+                pass
+
+    async def __run_request(self, request: {}, request_id, writer, lock: asyncio.Lock):
+        # validates the options (and seed) of a request, then sends back the messages of its run
+        options = request.get("options") or {}
+        if not isinstance(options, dict):
+            await self.__send(writer, lock, {"id": request_id, "error": "options is not a JSON object"})
+            return
+        options, errors = Headless.parse_options(options, self.validation)
+        seed, seed_error = Headless.parse_seed(request, None, 0)
+        if seed_error is not None:
+            errors["seed"] = seed_error
+        if len(errors) > 0:
+            await self.__send(writer, lock, {"id": request_id, "errors": errors})
+            return
+        job = self.submit(options, seed)
+        queue = job.subscribe()
+        try:
+            while True:
+                message = await queue.get()
+                if message is None:
+                    break
+                reply = {"id": request_id}
+                reply.update(message)
+                await self.__send(writer, lock, reply)
+        finally:
+            job.unsubscribe(queue)
+
+    async def __send(self, writer, lock: asyncio.Lock, message: {}):
+        # writes a line and waits until it's been sent (or at least buffered) - so a client that reads slowly
+        # slows us down, rather than us holding more and more unsent data
+        async with lock:
+            writer.write((json.dumps(message) + "\n").encode("utf-8"))
+            await writer.drain()
+
+
+async def request_runs(host: str, port: int, requests: []):
+    # a simple client - sends the requests (dictionaries in the format described above) and collects the replies.
+    # Returns a dictionary of request id to a list of its replies, in the order they arrived
+    reader, writer = await asyncio.open_connection(host, port)
+    for request in requests:
+        writer.write((json.dumps(request) + "\n").encode("utf-8"))
+    await writer.drain()
+    replies = {request.get("id"): [] for request in requests}
+    outstanding = len(requests)
+    while outstanding > 0:
+        line = await reader.readline()
+        if line == b"":
+            break
+        reply = json.loads(line.decode("utf-8"))
+        replies.setdefault(reply.get("id"), []).append(reply)
+        if "generations" not in reply:
+            outstanding -= 1
+    writer.close()
+    return replies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs Greenfly Population Models for other programs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--processes", type=int, default=None, help="number of worker processes (default: CPUs)")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="generations sent back at a time")
+    parser.add_argument("--min-generations", type=int, default=5)
+    parser.add_argument("--max-generations", type=int, default=25)
+    arguments = parser.parse_args()
+
+    service = ModelService(arguments.processes, arguments.chunk_size, None, arguments.min_generations,
+                           arguments.max_generations)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(service.start(arguments.host, arguments.port))
+    print("Listening on {}:{}".format(arguments.host, service.get_port()))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    loop.run_until_complete(service.close())
+    return 0
+
+
+# points the interpreter at our entry point main()
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,172 @@
+from Data import ModelRunOptions
+from Batch import BatchPopulationModel
+from concurrent.futures import ProcessPoolExecutor
+import numpy
+import os
+
+# A parameter sweep runs the model for every combination of a set of values for some of the ModelRunOptions fields
+# (the "Cartesian product" of the values, sometimes called a grid search). For example:
+# sweep = ParameterSweep(base_options, adult_birth_rate=[1, 1.5, 2], disease_trigger=range(1000, 10000, 1000))
+# is 3 x 9 = 27 scenarios - every other field is taken from base_options.
+#
+# We never build the whole list of scenarios: each scenario has a number (its index), and we work out the options
+# for an index only when we need them - like reading the digits of a number where each field is one digit.
+# Scenarios are run in chunks (each chunk is a single Batch.BatchPopulationModel) spread over worker processes,
+# and each scenario only adds a few numbers to the result table, so even millions of scenarios fit in memory.
+
+# the fields of Data.ModelRunOptions, in the order its __init__ takes them
+OPTION_FIELDS = [field for field, field_type in ModelRunOptions.FIELDS]
+
+
+def linear_range(start: float, stop: float, count: int):
+    # count evenly spaced values from start to stop (including both ends) - handy for sweeping rates
+    return numpy.linspace(start, stop, count).tolist()
+
+
+class ParameterSweep(object):
+    def __init__(self, base_options: ModelRunOptions, **values):
+        # values maps field names to a list (or range, or any other sequence) of values to sweep
+        for field in values:
+            if field not in OPTION_FIELDS:
+                raise ValueError("{} is not a ModelRunOptions field".format(field))
+        self.__base = vars(base_options).copy()
+        self.__fields = [field for field in OPTION_FIELDS if field in values]
+        self.__values = [list(values[field]) for field in self.__fields]
+        self.__shape = tuple(len(v) for v in self.__values)
+
+    def get_fields(self):
+        # the names of the swept fields
+        return list(self.__fields)
+
+    def get_values(self, field: str):
+        # the values swept for a field
+        return list(self.__values[self.__fields.index(field)])
+
+    def get_shape(self):
+        # the number of values for each swept field
+        return self.__shape
+
+    def __len__(self):
+        count = 1
+        for size in self.__shape:
+            count *= size
+        return count
+
+    def options_at(self, index: int):
+        # works out the ModelRunOptions for the scenario with the specified index
+        fields = self.__base.copy()
+        positions = numpy.unravel_index(index, self.__shape) if len(self.__shape) > 0 else ()
+        for field, values, position in zip(self.__fields, self.__values, positions):
+            fields[field] = values[int(position)]
+        return ModelRunOptions(**fields)
+
+    def __iter__(self):
+        # iterates over the options of every scenario - one at a time, never all at once
+        for index in range(0, len(self)):
+            yield self.options_at(index)
+
+    def chunk(self, start: int, end: int):
+        # the options for scenarios start up to (but not including) end
+        return [self.options_at(index) for index in range(start, min(end, len(self)))]
+
+    def run(self, processes: int = None, chunk_size: int = 10000, seed: int = None):
+        # runs every scenario and returns a SweepResult. processes is the number of worker processes (None for one
+        # per CPU, 1 to run in this process). Each chunk has its own random stream made from the seed and the
+        # chunk's number, so the same seed always gives the same results however the chunks are scheduled.
+        seed_sequence = numpy.random.SeedSequence(seed)
+        result = SweepResult(self.__fields, self.__values, self.__shape)
+        starts = range(0, len(self), chunk_size)
+        seeds = (numpy.random.SeedSequence(seed_sequence.entropy, spawn_key=(chunk,))
+                 for chunk in range(0, len(starts)))
+
+        if processes == 1:
+            for start, chunk_seed in zip(starts, seeds):
+                result.add(start, *run_sweep_chunk(self, start, start + chunk_size, chunk_seed))
+        else:
+            workers = processes if processes is not None else (os.cpu_count() or 1)
+            with ProcessPoolExecutor(workers) as executor:
+                # only keep a couple of chunks per worker in flight
+                pending = []
+                for start, chunk_seed in zip(starts, seeds):
+                    pending.append((start, executor.submit(run_sweep_chunk, self, start, start + chunk_size,
+                                                           chunk_seed)))
+                    if len(pending) >= 2 * workers:
+                        chunk_start, future = pending.pop(0)
+                        result.add(chunk_start, *future.result())
+                for chunk_start, future in pending:
+                    result.add(chunk_start, *future.result())
+        return result
+
+
+def run_sweep_chunk(sweep: ParameterSweep, start: int, end: int, seed_sequence):
+    # runs one chunk of a sweep (in a worker process) and returns the summary arrays for its scenarios
+    options = sweep.chunk(start, end)
+    model = BatchPopulationModel(options, numpy.random.default_rng(seed_sequence))
+    # scenarios that die out or settle down early don't need every generation run
+    model.run_all_generations(detect_convergence=True)
+    juveniles, adults, seniles, disease_rates = model.get_history()
+    # each scenario only counts up to its own number of generations
+    generations = numpy.array([o.generations for o in options], dtype=numpy.int64)
+    rows = numpy.arange(juveniles.shape[0])[:, numpy.newaxis]
+    in_run = rows <= generations
+    columns = numpy.arange(len(options))
+    totals = numpy.where(in_run, juveniles + adults + seniles, 0)
+    diseased = in_run & (disease_rates > 0)
+    first_disease = numpy.where(diseased.any(axis=0), diseased.argmax(axis=0), -1)
+    return (juveniles[generations, columns], adults[generations, columns], seniles[generations, columns],
+            totals.max(axis=0), first_disease)
+
+
+class SweepResult(object):
+    # The result table of a sweep - one row per scenario, in scenario index order. The results are numpy arrays:
+    # - final_juveniles, final_adults, final_seniles: the population in the scenario's last generation
+    # - peak_population: the largest total population in any generation
+    # - first_disease_generation: the first generation that had disease (-1 if none did)
+    def __init__(self, fields: [], values: [], shape: ()):
+        self.__fields = fields
+        self.__values = values
+        self.__shape = shape
+        count = int(numpy.prod(shape)) if len(shape) > 0 else 1
+        self.final_juveniles = numpy.zeros(count, dtype=numpy.int64)
+        self.final_adults = numpy.zeros(count, dtype=numpy.int64)
+        self.final_seniles = numpy.zeros(count, dtype=numpy.int64)
+        self.peak_population = numpy.zeros(count, dtype=numpy.int64)
+        self.first_disease_generation = numpy.zeros(count, dtype=numpy.int64)
+
+    def add(self, start: int, final_juveniles, final_adults, final_seniles, peak_population, first_disease):
+        end = start + len(final_juveniles)
+        self.final_juveniles[start:end] = final_juveniles
+        self.final_adults[start:end] = final_adults
+        self.final_seniles[start:end] = final_seniles
+        self.peak_population[start:end] = peak_population
+        self.first_disease_generation[start:end] = first_disease
+
+    def __len__(self):
+        return len(self.final_juveniles)
+
+    def index_of(self, **parameters):
+        # the row index of the scenario with the specified value for every swept field
+        positions = [self.__values[self.__fields.index(field)].index(parameters[field]) for field in self.__fields]
+        return int(numpy.ravel_multi_index(positions, self.__shape)) if len(positions) > 0 else 0
+
+    def parameter_column(self, field: str):
+        # the value of a swept field for every row - worked out from the row indexes, so it isn't stored
+        positions = numpy.unravel_index(numpy.arange(len(self)), self.__shape)[self.__fields.index(field)]
+        return numpy.array(self.__values[self.__fields.index(field)])[positions]
+
+    def get_row(self, index: int):
+        # a dictionary of the swept parameter values and results for a row
+        row = {}
+        positions = numpy.unravel_index(index, self.__shape) if len(self.__shape) > 0 else ()
+        for field, values, position in zip(self.__fields, self.__values, positions):
+            row[field] = values[int(position)]
+        row["final_juveniles"] = int(self.final_juveniles[index])
+        row["final_adults"] = int(self.final_adults[index])
+        row["final_seniles"] = int(self.final_seniles[index])
+        row["peak_population"] = int(self.peak_population[index])
+        row["first_disease_generation"] = int(self.first_disease_generation[index])
+        return row
+
+    def lookup(self, **parameters):
+        # the row for the scenario with the specified parameter values
+        return self.get_row(self.index_of(**parameters))
@@ -1,12 +1,47 @@
 from unittest import TestCase
+from unittest import mock
+from pathlib import Path
+import gc
+import inspect
+import io
+import tempfile
 import unittest
+import warnings
 from Data import ModelRunOptions
 from Model import ModelRunOptionsValidation
 from Model import PopulationModel
 from Model import Population
 from Model import LifecycleStage
 from Model import Generation
+from Data import GenerationHistory
+from Data import Convergence
 from IO import CsvGenerator
+from IO import BinaryGenerator
+from Batch import BatchPopulationModel
+from MonteCarlo import MonteCarloRunner
+from RandomStreams import CounterRandom
+from Cache import ModelRunCache
+import Headless
+import Service
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from Sweep import ParameterSweep
+import Benchmarks
+import Instrumentation
+import Numerics
+import Sensitivity
+import Calibration
+import Disease
+from Metapopulation import MigrationMatrix
+from Metapopulation import MetapopulationModel
+from Lifecycle import LifecycleOptions
+from Lifecycle import StageDefinition
+from Lifecycle import StagedPopulationModel
+from Checkpoint import Checkpointer
+import json
+import subprocess
+import sys
+import numpy
 
 
 class CsvGeneratorTests(TestCase):
@@ -18,6 +53,87 @@ class CsvGeneratorTests(TestCase):
         self.assertEqual(lines[2], "1,0.002,0.003,0.004")
         self.assertEqual(lines[3], "2,0.003,0.004,0.005")
 
+    def test_write_generations_matches_generated_lines(self):
+        generations = [Generation(1, 2, 3, 4), Generation(2, 3, 4, 5), Generation(1234, 5678, 91011, 6)]
+        history = GenerationHistory()
+        for g in generations:
+            history.append_generation(g)
+        expected = "\n".join(CsvGenerator.generate_csv_for_generations(generations)) + "\n"
+        for source in (generations, history, iter(generations)):
+            file = io.StringIO()
+            CsvGenerator.write_generations(source, file, chunk_size=2)
+            self.assertEqual(file.getvalue(), expected)
+
+    def test_write_generations_numbers_windowed_history_from_its_first_index(self):
+        history = GenerationHistory(2)
+        for count in range(0, 10):
+            history.append(count, count, count, 0)
+        file = io.StringIO()
+        CsvGenerator.write_generations(history, file)
+        lines = file.getvalue().splitlines()
+        self.assertEqual(lines[1], "{0},{1},{1},{1}".format(history.get_first_index(),
+                                                            history.get_first_index() / 1000))
+        self.assertEqual(lines[-1], "9,0.009,0.009,0.009")
+
+    def test_stream_model_file_writes_every_generation(self):
+        model = PopulationModel(ModelRunOptions(10, 10, 10, 5, 1, 1, 0, 2, 10000))
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = Path(directory) / "model.csv"
+            CsvGenerator.stream_model_file(model, file_path)
+            lines = file_path.read_text().splitlines()
+        self.assertEqual(len(lines), 7)
+        self.assertEqual(lines[1], "0,0.01,0.01,0.01")
+        self.assertEqual(lines[6], "5,0.08,0.04,0.04")
+
+
+class ImportTests(TestCase):
+    def test_library_modules_do_not_import_curses(self):
+        output = subprocess.check_output([sys.executable, "-c",
+                                          "import Data, Model, IO, sys; print('IO' in sys.modules, "
+                                          "'_curses' in sys.modules)"])
+        self.assertEqual(output.strip(), b"True False")
+
+    def test_curses_is_imported_when_first_used(self):
+        output = subprocess.check_output([sys.executable, "-c",
+                                          "import IO, sys; IO._curses.COLOR_RED; print('_curses' in sys.modules)"])
+        self.assertEqual(output.strip(), b"True")
+
+
+class BinaryGeneratorTests(TestCase):
+    def test_round_trip(self):
+        options = ModelRunOptions(10, 10, 10, 5, 1, 1, 0, 2, 10000)
+        model = PopulationModel(options)
+        model.run_all_generations()
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = Path(directory) / "model.bin"
+            BinaryGenerator.write_generations_file(model, file_path)
+            with BinaryGenerator.open_generations_file(file_path) as generations:
+                self.assertEqual(vars(generations.get_options()), vars(options))
+                self.assertEqual(len(generations), 6)
+                self.assertEqual(list(generations.get_column("juveniles")), [10, 20, 20, 40, 40, 80])
+                self.assertEqual(generations[5].adults, 40)
+                self.assertEqual([g.seniles for g in generations], [g.seniles for g in model.get_generations()])
+
+    def test_rejects_other_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = Path(directory) / "model.csv"
+            file_path.write_text("Generation,Juveniles,Adults,Seniles\n")
+            with self.assertRaises(ValueError):
+                BinaryGenerator.open_generations_file(file_path)
+
+    def test_closes_the_file_when_it_cant_be_read(self):
+        # an empty file (which can't be memory mapped) and one with a cut off header
+        with tempfile.TemporaryDirectory() as directory:
+            for contents in (b"", BinaryGenerator.MAGIC + b"\x01"):
+                file_path = Path(directory) / "model.bin"
+                file_path.write_bytes(contents)
+                with warnings.catch_warnings(record=True) as caught:
+                    warnings.simplefilter("always")
+                    with self.assertRaises(Exception):
+                        BinaryGenerator.open_generations_file(file_path)
+                    gc.collect()
+                self.assertEqual([w for w in caught if issubclass(w.category, ResourceWarning)], [])
+
 
 class GenerationTests(TestCase):
     def test_initialisation_values(self):
@@ -30,6 +146,49 @@ class GenerationTests(TestCase):
         self.assertEqual(generation.adults_in_thousands, 0.002)
         self.assertEqual(generation.seniles_in_thousands, 0.003)
 
+    def test_total_population_in_thousands(self):
+        self.assertEqual(Generation(1000, 2000, 3000, 0).total_population_in_thousands, 6)
+
+
+class GenerationHistoryTests(TestCase):
+    def test_generations_are_built_on_access(self):
+        history = GenerationHistory()
+        history.append(1, 2, 3, 0)
+        history.append(4, 5, 6, 25)
+        self.assertEqual(len(history), 2)
+        self.assertEqual(history[1].juveniles, 4)
+        self.assertEqual(history[-1].disease_rate, 25)
+        self.assertEqual(history[0].seniles_in_thousands, 0.003)
+        self.assertEqual([g.adults for g in history], [2, 5])
+        self.assertEqual([g.adults for g in history[0:1]], [2])
+
+    def test_values_larger_than_64_bits_are_kept(self):
+        history = GenerationHistory()
+        history.append(1, 2, 3, 0)
+        history.append(2 ** 70, 2, 3, 0)
+        self.assertEqual(history[0].juveniles, 1)
+        self.assertEqual(history[1].juveniles, 2 ** 70)
+        self.assertEqual(len(history), 2)
+
+    def test_window_keeps_most_recent_generations(self):
+        history = GenerationHistory(3)
+        for i in range(0, 100):
+            history.append(i, i, i, 0)
+        self.assertEqual(len(history), 100)
+        self.assertEqual(history[99].juveniles, 99)
+        self.assertEqual(history[-3].juveniles, 97)
+        self.assertLessEqual(len(history.get_columns()[0]), 7)
+        with self.assertRaises(IndexError):
+            history[0]
+
+    def test_copy_is_independent(self):
+        history = GenerationHistory()
+        history.append(1, 2, 3, 0)
+        copy = history.copy()
+        copy.append(4, 5, 6, 0)
+        self.assertEqual(len(history), 1)
+        self.assertEqual(len(copy), 2)
+
 
 class ModelRunOptionsTests(TestCase):
     def test_initialisation_values(self):
@@ -44,6 +203,11 @@ class ModelRunOptionsTests(TestCase):
         self.assertEqual(options.adult_birth_rate, 3.5)
         self.assertEqual(options.disease_trigger, 1000)
 
+    def test_fields_match_initialisation(self):
+        parameters = list(inspect.signature(ModelRunOptions.__init__).parameters)[1:]
+        self.assertEqual([field for field, field_type in ModelRunOptions.FIELDS], parameters)
+        self.assertEqual(Headless.FIELDS, ModelRunOptions.FIELDS)
+
 
 class ModelRunOptionsValidationTests(TestCase):
 
@@ -180,6 +344,31 @@ class ModelRunOptionsValidationTests(TestCase):
         validation = ModelRunOptionsValidation(1, 100)
         self.assertEqual("Must be 1 or less", validation.validate_senile_survival_rate(2))
 
+    def test_validate_columns_matches_scalar_validation(self):
+        validation = ModelRunOptionsValidation(5, 25)
+        values = [-1, -0.5, 0, 0.5, 1, 1.5, 4, 5, 25, 26, float("nan")]
+        fields = ["starting_juveniles", "starting_adults", "starting_seniles", "generations", "disease_trigger",
+                  "adult_birth_rate", "juvenile_survival_rate", "adult_survival_rate", "senile_survival_rate"]
+        result = validation.validate_columns({field: numpy.array(values) for field in fields})
+        for row, value in enumerate(values):
+            expected = {}
+            for field in fields:
+                message = getattr(validation, "validate_" + field)(value)
+                if message is not None:
+                    expected[field] = message
+            self.assertEqual(result.get_messages(row), expected)
+            self.assertEqual(bool(result.get_invalid_mask()[row]), len(expected) > 0)
+
+    def test_validate_columns_of_valid_rows(self):
+        validation = ModelRunOptionsValidation(5, 25)
+        result = validation.validate_columns({"generations": [5, 10, 25], "juvenile_survival_rate": [0, 0.5, 1]})
+        self.assertTrue(result.is_valid())
+        self.assertEqual(len(result.get_invalid_rows()), 0)
+
+    def test_validate_columns_rejects_unknown_fields(self):
+        with self.assertRaises(ValueError):
+            ModelRunOptionsValidation(5, 25).validate_columns({"wings": [1]})
+
 
 class PopulationModelTests(TestCase):
     def test_new_model_has_one_generation(self):
@@ -221,12 +410,447 @@ class PopulationModelTests(TestCase):
         self.assert_generation(model.get_generation(4), 40, 40, 20, 0)
         self.assert_generation(model.get_generation(5), 80, 40, 40, 0)
 
+    def test_iterate_generations_yields_each_generation(self):
+        model = PopulationModel(ModelRunOptions(10, 10, 10, 5, 1, 1, 0, 2, 10000))
+        generations = list(model.iterate_generations())
+        self.assertEqual(len(generations), 5)
+        self.assert_generation(generations[0], 20, 10, 10, 0)
+        self.assert_generation(generations[4], 80, 40, 40, 0)
+        self.assertEqual(model.get_generations_count(), 6)
+
+    def test_iterate_generations_with_no_window_keeps_nothing(self):
+        model = PopulationModel(ModelRunOptions(10, 10, 10, 1000, 1, 1, 0, 1, 10 ** 9))
+        count = 0
+        for generation in model.iterate_generations(0):
+            count += 1
+        self.assertEqual(count, 1000)
+        self.assertEqual(model.get_generations_count(), 1001)
+        self.assertLessEqual(len(model.get_generations().get_columns()[0]), 1)
+
+    def test_run_all_generations_only_runs_remaining_generations(self):
+        model = PopulationModel(ModelRunOptions(10, 10, 10, 5, 1, 1, 0, 2, 10000))
+        iterator = model.iterate_generations()
+        next(iterator)
+        next(iterator)
+        model.run_all_generations()
+        self.assertEqual(model.get_generations_count(), 6)
+        self.assert_generation(model.get_generation(5), 80, 40, 40, 0)
+
     def assert_generation(self, generation, juvenile, adult, senile, disease_rate):
         self.assertEqual(generation.juveniles, juvenile)
         self.assertEqual(generation.adults, adult)
         self.assertEqual(generation.seniles, senile)
         self.assertEqual(generation.disease_rate, disease_rate)
 
+    def test_same_seed_reproduces_run(self):
+        options = ModelRunOptions(1000, 1000, 1000, 20, 0.9, 0.9, 0.5, 1.5, 4000)
+        first = PopulationModel(options, seed=42)
+        first.run_all_generations()
+        second = PopulationModel(options, seed=first.get_seed())
+        second.run_all_generations()
+        self.assertEqual([g.disease_rate for g in first.get_generations()],
+                         [g.disease_rate for g in second.get_generations()])
+        self.assertGreater(sum(g.disease_rate for g in first.get_generations()), 0)
+
+    def test_unseeded_model_records_a_seed(self):
+        model = PopulationModel(ModelRunOptions(1, 2, 3, 100, 0, 0, 0, 0, 0))
+        self.assertIsNotNone(model.get_seed())
+
+    def test_uses_injected_random_source(self):
+        source = CounterRandom(7)
+        model = PopulationModel(ModelRunOptions(10, 10, 10, 3, 0.5, 0.5, 0.5, 2, 1), random_source=source)
+        model.run_all_generations()
+        self.assertIs(model.get_random_source(), source)
+        self.assertEqual(source.get_counter(), 3)
+
+    def test_detects_extinction(self):
+        model = PopulationModel(ModelRunOptions(10, 10, 10, 1000, 0, 0, 0, 0, 5))
+        model.run_all_generations(detect_convergence=True)
+        self.assertEqual(model.get_convergence().kind, Convergence.EXTINCT)
+        self.assertEqual(model.get_convergence().generation, 2)
+        self.assertEqual(model.get_generations_count(), 1001)
+        self.assert_generation(model.get_generation(1000), 0, 0, 0, 0)
+
+    def test_detects_fixed_point(self):
+        model = PopulationModel(ModelRunOptions(0, 0, 10, 50, 1, 1, 1, 0, 1000))
+        model.run_all_generations(detect_convergence=True)
+        self.assertEqual(model.get_convergence().kind, Convergence.FIXED_POINT)
+        self.assertEqual(model.get_convergence().period, 1)
+
+    def test_filled_cycle_matches_full_run(self):
+        options = ModelRunOptions(1, 2, 0, 101, 1, 0, 0, 1, 1000)
+        expected = PopulationModel(options, 3)
+        expected.run_all_generations()
+        model = PopulationModel(options, 3)
+        model.run_all_generations(detect_convergence=True)
+        self.assertEqual(model.get_convergence().kind, Convergence.CYCLE)
+        self.assertEqual(model.get_convergence().period, 2)
+        self.assertEqual([vars_of(g) for g in expected.get_generations()],
+                         [vars_of(g) for g in model.get_generations()])
+        # the model carries on from where the full run would have been
+        self.assertEqual(model.get_state()["counts"], expected.get_state()["counts"])
+
+    def test_convergence_can_stop_early(self):
+        model = PopulationModel(ModelRunOptions(10, 10, 10, 1000, 0, 0, 0, 0, 5))
+        model.run_all_generations(detect_convergence=True, fill_remaining=False)
+        self.assertEqual(model.get_generations_count(), 3)
+
+    def assert_same_as_new_model(self, model, options, seed):
+        expected = PopulationModel(options, seed)
+        expected.run_all_generations()
+        self.assertEqual([vars_of(g) for g in expected.get_generations()],
+                         [vars_of(g) for g in model.get_generations()])
+        # and the random numbers carry on from the same place
+        self.assertEqual(model.get_random_source().random(), expected.get_random_source().random())
+
+    def test_rerun_with_more_generations_only_runs_new_ones(self):
+        options = ModelRunOptions(1000, 1000, 1000, 25, 0.9, 0.9, 0.5, 1.5, 4000)
+        model = PopulationModel(options, 3)
+        model.run_all_generations()
+        longer = ModelRunOptions(1000, 1000, 1000, 100, 0.9, 0.9, 0.5, 1.5, 4000)
+        self.assertEqual(model.rerun(longer), 26)
+        self.assert_same_as_new_model(model, longer, 3)
+
+    def test_rerun_with_fewer_generations_replays_random_numbers(self):
+        options = ModelRunOptions(1000, 1000, 1000, 25, 0.9, 0.9, 0.5, 1.5, 4000)
+        model = PopulationModel(options, 3)
+        model.run_all_generations()
+        shorter = ModelRunOptions(1000, 1000, 1000, 10, 0.9, 0.9, 0.5, 1.5, 4000)
+        self.assertEqual(model.rerun(shorter), 11)
+        self.assert_same_as_new_model(model, shorter, 3)
+
+    def test_rerun_with_trigger_above_peak_keeps_everything(self):
+        options = ModelRunOptions(10, 10, 10, 20, 0.9, 0.9, 0.5, 1.5, 10 ** 6)
+        model = PopulationModel(options, 3)
+        model.run_all_generations()
+        raised = ModelRunOptions(10, 10, 10, 20, 0.9, 0.9, 0.5, 1.5, 10 ** 7)
+        self.assertEqual(model.update_options(raised), 21)
+        self.assertIs(model.get_options(), raised)
+
+    def test_rerun_with_new_trigger_keeps_generations_before_it_matters(self):
+        options = ModelRunOptions(1000, 1000, 1000, 25, 0.9, 0.9, 0.5, 1.5, 4000)
+        model = PopulationModel(options, 3)
+        model.run_all_generations()
+        totals = [sum(vars_of(g)[:3]) for g in model.get_generations()]
+        lowered = ModelRunOptions(1000, 1000, 1000, 25, 0.9, 0.9, 0.5, 1.5, 3500)
+        first_change = [i for i, total in enumerate(totals) if 3500 <= total < 4000][0]
+        self.assertEqual(model.rerun(lowered), first_change + 1)
+        self.assert_same_as_new_model(model, lowered, 3)
+
+    def test_rerun_with_new_rate_starts_again(self):
+        options = ModelRunOptions(1000, 1000, 1000, 25, 0.9, 0.9, 0.5, 1.5, 4000)
+        model = PopulationModel(options, 3)
+        model.run_all_generations()
+        changed = ModelRunOptions(1000, 1000, 1000, 25, 0.8, 0.9, 0.5, 1.5, 4000)
+        self.assertEqual(model.rerun(changed), 1)
+        self.assert_same_as_new_model(model, changed, 3)
+
+    def test_rerun_with_other_disease_model_only_keeps_generations_changes(self):
+        options = ModelRunOptions(1000, 1000, 1000, 10, 0.9, 0.9, 0.5, 1.5, 10 ** 6)
+        model = PopulationModel(options, 3, disease_model=Disease.LogisticDisease())
+        model.run_all_generations()
+        self.assertEqual(model.update_options(ModelRunOptions(1000, 1000, 1000, 20, 0.9, 0.9, 0.5, 1.5, 10 ** 6)), 11)
+        self.assertEqual(model.update_options(ModelRunOptions(1000, 1000, 1000, 20, 0.9, 0.9, 0.5, 1.5, 10 ** 7)), 1)
+
+    def test_no_convergence_while_disease_is_random(self):
+        model = PopulationModel(ModelRunOptions(10, 10, 10, 50, 0, 0, 0, 0, 0))
+        model.run_all_generations(detect_convergence=True)
+        self.assertIsNone(model.get_convergence())
+        self.assertEqual(model.get_generations_count(), 51)
+
+
+class InstrumentationTests(TestCase):
+    def test_model_records_every_phase(self):
+        instrumentation = Instrumentation.Instrumentation(FakeClock())
+        model = PopulationModel(ModelRunOptions(10, 10, 10, 5, 1, 1, 0, 2, 10000), instrumentation=instrumentation)
+        list(model.iterate_generations())
+        stats = instrumentation.get_stats()
+        for phase in (Instrumentation.CALCULATE_DISEASE_RATE, Instrumentation.UPDATE_TO_NEXT_GENERATION,
+                      Instrumentation.HISTORY_APPEND, Instrumentation.CREATE_GENERATION):
+            self.assertEqual(stats[phase]["count"], 5)
+            self.assertEqual(stats[phase]["seconds"], 5)
+        self.assertEqual(model.get_generation(5).juveniles, 80)
+
+    def test_population_records_update_phases(self):
+        instrumentation = Instrumentation.Instrumentation(FakeClock())
+        population = Population(10, 10, 10, instrumentation)
+        generation = population.update_to_next_generation(ModelRunOptions(10, 10, 10, 100, 0.5, 0.5, 0.5, 2, 1000), 0)
+        self.assertEqual(generation.juveniles, 20)
+        self.assertEqual(instrumentation.get_count(Instrumentation.UPDATE_TO_NEXT_GENERATION), 1)
+        self.assertEqual(instrumentation.get_count(Instrumentation.CREATE_GENERATION), 1)
+
+    def test_model_without_instrumentation_records_nothing(self):
+        model = PopulationModel(ModelRunOptions(10, 10, 10, 5, 1, 1, 0, 2, 10000))
+        model.run_all_generations()
+        self.assertIsNone(model.get_instrumentation())
+
+
+class CheckpointerTests(TestCase):
+    def test_resume_continues_identically(self):
+        options = ModelRunOptions(1000, 1000, 1000, 20, 0.9, 0.9, 0.5, 1.5, 4000)
+        expected = PopulationModel(options, 8)
+        expected.run_all_generations()
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = Path(directory) / "run.checkpoint"
+            checkpointer = Checkpointer(file_path, every_generations=3)
+            interrupted = PopulationModel(options, 8)
+            for generation in interrupted.iterate_generations(checkpointer=checkpointer):
+                if interrupted.get_generations_count() == 8:
+                    break
+            resumed = Checkpointer.resume(file_path)
+            self.assertEqual(resumed.get_generations_count(), 7)
+            resumed.run_all_generations(checkpointer)
+            finished = Checkpointer.resume(file_path)
+        self.assertEqual([vars_of(g) for g in expected.get_generations()],
+                         [vars_of(g) for g in resumed.get_generations()])
+        self.assertEqual(expected.get_random_source().getstate(), resumed.get_random_source().getstate())
+        self.assertEqual(finished.get_generations_count(), 21)
+
+    def test_resume_with_counter_random_source(self):
+        options = ModelRunOptions(1000, 1000, 1000, 10, 0.9, 0.9, 0.5, 1.5, 4000)
+        expected = PopulationModel(options, random_source=CounterRandom(4))
+        expected.run_all_generations()
+        model = PopulationModel(options, random_source=CounterRandom(4))
+        iterator = model.iterate_generations()
+        for i in range(0, 4):
+            next(iterator)
+        resumed = PopulationModel.from_state(model.get_state())
+        resumed.run_all_generations()
+        self.assertEqual([vars_of(g) for g in expected.get_generations()],
+                         [vars_of(g) for g in resumed.get_generations()])
+
+    def test_saves_on_a_timer(self):
+        with tempfile.TemporaryDirectory() as directory:
+            checkpointer = Checkpointer(Path(directory) / "run.checkpoint", every_seconds=2, clock=FakeClock())
+            model = PopulationModel(ModelRunOptions(10, 10, 10, 6, 1, 1, 0, 2, 10000))
+            model.run_all_generations(checkpointer)
+        self.assertEqual(checkpointer.saves, 4)
+
+
+class FakeClock(object):
+    # a clock that moves on by one second every time it's read
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        self.now += 1
+        return self.now
+
+
+class ModelRunCacheTests(TestCase):
+    def test_seeded_run_is_cached(self):
+        cache = ModelRunCache()
+        options = ModelRunOptions(1000, 1000, 1000, 20, 0.9, 0.9, 0.5, 1.5, 4000)
+        first = cache.run(options, 3)
+        second = cache.run(options, 3)
+        self.assertEqual(cache.get_statistics()["hits"], 1)
+        self.assertEqual(cache.get_statistics()["misses"], 1)
+        self.assertEqual([vars_of(g) for g in first.get_generations()], [vars_of(g) for g in second.get_generations()])
+
+    def test_disease_free_run_is_cached_for_any_seed(self):
+        cache = ModelRunCache()
+        options = ModelRunOptions(10, 10, 10, 5, 1, 1, 0, 2, 10000)
+        cache.run(options)
+        model = cache.run(options, 99)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(model.get_generation(5).juveniles, 80)
+
+    def test_unseeded_run_with_disease_is_not_cached(self):
+        cache = ModelRunCache()
+        options = ModelRunOptions(10, 10, 10, 5, 0.5, 0.5, 0.5, 2, 1)
+        cache.run(options)
+        cache.run(options)
+        self.assertEqual(cache.misses, 2)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = ModelRunCache(max_bytes=2 * 4 * 8 * 6)
+        first = ModelRunOptions(10, 10, 10, 5, 1, 1, 0, 2, 10000)
+        second = ModelRunOptions(20, 10, 10, 5, 1, 1, 0, 2, 10000)
+        third = ModelRunOptions(30, 10, 10, 5, 1, 1, 0, 2, 10000)
+        cache.run(first)
+        cache.run(second)
+        cache.run(first)
+        cache.run(third)
+        self.assertEqual(cache.evictions, 1)
+        cache.run(first)
+        self.assertEqual(cache.hits, 2)
+        cache.run(second)
+        self.assertEqual(cache.misses, 4)
+
+    def test_key_ignores_whole_number_floats(self):
+        self.assertEqual(ModelRunCache.key(ModelRunOptions(10, 10, 10, 5, 1, 1, 0, 2, 10000), 3),
+                         ModelRunCache.key(ModelRunOptions(10.0, 10, 10, 5.0, 1.0, 1, 0.0, 2, 10000.0), 3))
+        self.assertNotEqual(ModelRunCache.key(ModelRunOptions(10, 10, 10, 5, 1, 1, 0, 2, 10000), 3),
+                            ModelRunCache.key(ModelRunOptions(10.5, 10, 10, 5, 1, 1, 0, 2, 10000), 3))
+
+    def test_disk_tier_survives_new_cache(self):
+        options = ModelRunOptions(1000, 1000, 1000, 20, 0.9, 0.9, 0.5, 1.5, 4000)
+        with tempfile.TemporaryDirectory() as directory:
+            expected = ModelRunCache(directory=Path(directory)).run(options, 5)
+            cache = ModelRunCache(directory=Path(directory))
+            actual = cache.run(options, 5)
+            self.assertEqual(cache.disk_hits, 1)
+        self.assertEqual([vars_of(g) for g in expected.get_generations()],
+                         [vars_of(g) for g in actual.get_generations()])
+
+
+class ParameterSweepTests(TestCase):
+    def test_expands_every_combination_lazily(self):
+        sweep = ParameterSweep(ModelRunOptions(10, 10, 10, 5, 1, 1, 0, 2, 10000),
+                               adult_birth_rate=[1, 2, 3], juvenile_survival_rate=[0.5, 1])
+        self.assertEqual(len(sweep), 6)
+        self.assertEqual(sweep.get_shape(), (2, 3))
+        options = list(sweep)
+        self.assertEqual([(o.juvenile_survival_rate, o.adult_birth_rate) for o in options],
+                         [(0.5, 1), (0.5, 2), (0.5, 3), (1, 1), (1, 2), (1, 3)])
+        self.assertEqual(options[0].starting_juveniles, 10)
+
+    def test_rejects_unknown_fields(self):
+        with self.assertRaises(ValueError):
+            ParameterSweep(ModelRunOptions(10, 10, 10, 5, 1, 1, 0, 2, 10000), birth_rate=[1])
+
+    def test_results_match_scalar_model(self):
+        sweep = ParameterSweep(ModelRunOptions(10, 10, 10, 5, 1, 1, 0, 2, 10000),
+                               adult_birth_rate=[1, 1.5, 2], generations=[3, 5], disease_trigger=[50, 10000])
+        result = sweep.run(processes=1, chunk_size=5, seed=1)
+        self.assertEqual(len(result), 12)
+        for index in range(0, len(sweep)):
+            options = sweep.options_at(index)
+            if options.disease_trigger == 50:
+                continue
+            model = PopulationModel(options)
+            model.run_all_generations()
+            last = model.get_generation(options.generations)
+            row = result.get_row(index)
+            self.assertEqual((row["final_juveniles"], row["final_adults"], row["final_seniles"]),
+                             (last.juveniles, last.adults, last.seniles))
+            self.assertEqual(row["first_disease_generation"], -1)
+        row = result.lookup(adult_birth_rate=2, generations=5, disease_trigger=10000)
+        self.assertEqual(row["final_juveniles"], 80)
+        self.assertEqual(row["peak_population"], 160)
+        self.assertEqual(result.lookup(adult_birth_rate=2, generations=5, disease_trigger=50)
+                         ["first_disease_generation"], 3)
+        self.assertEqual(list(result.parameter_column("generations")), [3] * 6 + [5] * 6)
+
+    def test_processes_give_same_result_as_inline(self):
+        sweep = ParameterSweep(ModelRunOptions(1000, 1000, 1000, 20, 0.9, 0.9, 0.5, 1.5, 4000),
+                               adult_birth_rate=[1.2, 1.5, 1.8], senile_survival_rate=[0.2, 0.5])
+        inline = sweep.run(processes=1, chunk_size=2, seed=3)
+        pooled = sweep.run(processes=2, chunk_size=2, seed=3)
+        self.assertEqual(list(inline.peak_population), list(pooled.peak_population))
+        self.assertEqual(list(inline.final_adults), list(pooled.final_adults))
+
+
+class BenchmarksTests(TestCase):
+    def test_quick_run_times_every_benchmark(self):
+        results = Benchmarks.run_benchmarks(scale=0.001, repeats=1)
+        self.assertEqual(len(results), len(Benchmarks.get_benchmarks(0.001)))
+        for seconds in results.values():
+            self.assertGreaterEqual(seconds, 0)
+
+    def test_compare_reports_regressions(self):
+        regressions = Benchmarks.compare({"a": 1.0, "b": 2.0, "c": 1.0}, {"a": 1.0, "b": 1.0}, 0.25)
+        self.assertEqual(regressions, [("b", 1.0, 2.0)])
+
+
+class HeadlessTests(TestCase):
+    def test_runs_json_lines(self):
+        input_file = io.StringIO(json.dumps(headless_row(10)) + "\n" + json.dumps(headless_row(20)) + "\n")
+        output_file = io.StringIO()
+        self.assertEqual(Headless.run(["--processes", "1"], input_file, output_file), 0)
+        results = sorted((json.loads(line) for line in output_file.getvalue().splitlines()),
+                         key=lambda r: r["index"])
+        self.assertEqual(len(results), 2)
+        self.assertEqual(results[0]["generations"][5], [80, 40, 40, 0])
+        self.assertEqual(results[1]["generations"][0], [20, 10, 10, 0])
+
+    def test_runs_csv_and_reports_invalid_rows(self):
+        input_file = io.StringIO("starting_juveniles,starting_adults,starting_seniles,generations,"
+                                 "juvenile_survival_rate,adult_survival_rate,senile_survival_rate,"
+                                 "adult_birth_rate,disease_trigger,seed\n"
+                                 "10,10,10,5,1,1,0,2,10000,\n"
+                                 "10,10,10,50,2,1,0,2,10000,\n"
+                                 "10,10,10,5,0.5,0.5,0.5,2,1,7\n")
+        output_file = io.StringIO()
+        self.assertEqual(Headless.run(["--format", "csv", "--processes", "1"], input_file, output_file), 1)
+        results = {r["index"]: r for r in (json.loads(line) for line in output_file.getvalue().splitlines())}
+        self.assertEqual(results[1]["errors"], {"generations": "Must be equal to or less than 25",
+                                                "juvenile_survival_rate": "Must be 1 or less"})
+        self.assertEqual(results[2]["seed"], 7)
+        self.assertEqual(len(results[0]["generations"]), 6)
+
+    def test_bad_lines_are_rejected_one_at_a_time(self):
+        bad_seed = headless_row(10)
+        bad_seed["seed"] = "abc"
+        fractional = headless_row(10)
+        fractional["generations"] = 10.9
+        input_file = io.StringIO("\n".join([json.dumps(bad_seed), "{not json", "[1, 2]", json.dumps(fractional),
+                                            json.dumps(headless_row(20))]) + "\n")
+        output_file = io.StringIO()
+        self.assertEqual(Headless.run(["--processes", "1"], input_file, output_file), 1)
+        results = {r["index"]: r for r in (json.loads(line) for line in output_file.getvalue().splitlines())}
+        self.assertEqual(results[0]["errors"], {"seed": "Please enter a valid integer"})
+        self.assertEqual(results[1]["errors"], {"row": "Line is not valid JSON"})
+        self.assertEqual(results[2]["errors"], {"row": "Line is not a JSON object"})
+        self.assertEqual(results[3]["errors"], {"generations": "Please enter a valid integer"})
+        self.assertEqual(results[4]["generations"][0], [20, 10, 10, 0])
+
+    def test_whole_number_floats_are_accepted_for_integer_fields(self):
+        row = headless_row(10)
+        row["generations"] = 5.0
+        options, errors = Headless.parse_options(row, ModelRunOptionsValidation(5, 25))
+        self.assertEqual(errors, {})
+        self.assertEqual(options.generations, 5)
+
+    def test_does_not_import_curses(self):
+        output = subprocess.check_output([sys.executable, "-c",
+                                          "import Headless, sys; print('_curses' in sys.modules)"])
+        self.assertEqual(output.strip(), b"False")
+
+
+def headless_row(starting_juveniles):
+    return {"starting_juveniles": starting_juveniles, "starting_adults": 10, "starting_seniles": 10,
+            "generations": 5, "juvenile_survival_rate": 1, "adult_survival_rate": 1, "senile_survival_rate": 0,
+            "adult_birth_rate": 2, "disease_trigger": 10000}
+
+
+def vars_of(generation):
+    return generation.juveniles, generation.adults, generation.seniles, generation.disease_rate
+
+
+class CounterRandomTests(TestCase):
+    def test_same_seed_and_stream_repeat(self):
+        self.assertEqual([CounterRandom(1, 2).random() for i in range(0, 3)],
+                         [CounterRandom(1, 2).random() for i in range(0, 3)])
+
+    def test_streams_differ(self):
+        first = CounterRandom(1, 0)
+        second = first.substream(1)
+        self.assertNotEqual([first.getrandbits(64) for i in range(0, 5)],
+                            [second.getrandbits(64) for i in range(0, 5)])
+
+    def test_jump_matches_generating(self):
+        generated = CounterRandom(3)
+        for i in range(0, 1000):
+            generated.getrandbits(64)
+        jumped = CounterRandom(3)
+        jumped.jump(1000)
+        self.assertEqual(generated.getrandbits(64), jumped.getrandbits(64))
+
+    def test_state_round_trip(self):
+        source = CounterRandom("seed")
+        source.randrange(20, 50)
+        restored = CounterRandom()
+        restored.setstate(source.getstate())
+        self.assertEqual(source.randrange(20, 50), restored.randrange(20, 50))
+
+    def test_randrange_in_range(self):
+        source = CounterRandom(11)
+        for i in range(0, 10000):
+            value = source.randrange(20, 50)
+            self.assertGreater(value, 19)
+            self.assertLess(value, 50)
+
 
 class PopulationTests(TestCase):
 
@@ -326,6 +950,63 @@ class PopulationTests(TestCase):
         self.assertEqual(next_generation.seniles, 7)
         self.assertEqual(next_generation.disease_rate, 50)
 
+    def test_fast_forward_matches_stepping_for_specification_example(self):
+        self.assert_fast_forward_matches_stepping(Population(10, 10, 10),
+                                                  ModelRunOptions(10, 10, 10, 0, 1, 1, 1, 2, 10 ** 9), 1000)
+
+    def test_fast_forward_matches_stepping_with_truncation(self):
+        self.assert_fast_forward_matches_stepping(Population(1000, 777, 333),
+                                                  ModelRunOptions(0, 0, 0, 0, 0.26, 0.73, 0.5, 1.26, 10 ** 9), 50)
+
+    def test_fast_forward_matches_stepping_without_births(self):
+        self.assert_fast_forward_matches_stepping(Population(10, 10, 10),
+                                                  ModelRunOptions(0, 0, 0, 0, 1, 1, 1, 0, 10 ** 9), 100)
+
+    def test_fast_forward_stops_when_disease_would_trigger(self):
+        population = Population(10, 10, 10)
+        steps = population.fast_forward(ModelRunOptions(0, 0, 0, 0, 1, 1, 1, 2, 100), 1000)
+        self.assertEqual(steps, 3)
+        self.assertEqual(population.get_counts(), (40, 20, 50))
+
+    def test_fast_forward_does_nothing_when_already_diseased(self):
+        population = Population(10, 10, 10)
+        self.assertEqual(population.fast_forward(ModelRunOptions(0, 0, 0, 0, 1, 1, 1, 2, 30), 10), 0)
+
+    def test_model_fast_forwards_when_history_is_not_kept(self):
+        options = ModelRunOptions(10, 10, 10, 1000, 1, 1, 1, 1, 10 ** 9)
+        model = PopulationModel(options, 1)
+        model.get_generations().set_window(0)
+        with mock.patch.object(Population, "advance", autospec=True, side_effect=Population.advance) as advance:
+            model.run_all_generations()
+        self.assertLess(advance.call_count, 20)
+        self.assertEqual(model.get_generations_count(), 1001)
+        self.assert_same_last_generation(model, options)
+
+    def test_model_fast_forward_steps_once_disease_triggers(self):
+        options = ModelRunOptions(10, 10, 10, 1000, 1, 1, 1, 1, 3000)
+        model = PopulationModel(options, 1)
+        model.get_generations().set_window(0)
+        model.run_all_generations()
+        self.assert_same_last_generation(model, options)
+
+    def assert_same_last_generation(self, model, options):
+        expected = PopulationModel(options, 1)
+        expected.run_all_generations()
+        self.assertEqual(vars_of(model.get_generation(options.generations)),
+                         vars_of(expected.get_generation(options.generations)))
+        self.assertEqual(model.get_random_source().random(), expected.get_random_source().random())
+
+    def assert_fast_forward_matches_stepping(self, population, options, generations):
+        juveniles, adults, seniles = population.get_counts()
+        stepped = Population(juveniles, adults, seniles)
+        steps = population.fast_forward(options, generations)
+        for step in range(0, steps):
+            self.assertLess(stepped.get_total_population(), options.disease_trigger)
+            stepped.advance(options, 0)
+        self.assertEqual(population.get_counts(), stepped.get_counts())
+        if steps < generations:
+            self.assertGreaterEqual(stepped.get_total_population(), options.disease_trigger)
+
     def calculate_born_juveniles(self, adults: int, birth_rate: float, expected_juveniles):
         population = Population(0, adults, 0)
         born_juveniles = population.calculate_born_juveniles(birth_rate)
@@ -346,5 +1027,582 @@ class PopulationTests(TestCase):
         surviving_seniles = population.calculate_surviving_seniles(survival_rate, disease_rate)
         self.assertEqual(surviving_seniles, expected_seniles)
 
+class BatchPopulationModelTests(TestCase):
+    def test_matches_scalar_model_without_disease(self):
+        options = [ModelRunOptions(10, 10, 10, 5, 1, 1, 0, 2, 10000),
+                   ModelRunOptions(1000, 777, 333, 20, 0.26, 0.73, 0.5, 1.26, 10 ** 12),
+                   ModelRunOptions(5, 0, 9, 3, 0.5, 0.5, 0.5, 2, 10 ** 12)]
+        batch = BatchPopulationModel(options)
+        batch.run_all_generations()
+        for scenario in range(0, len(options)):
+            model = PopulationModel(options[scenario])
+            model.run_all_generations()
+            self.assert_same_generations(model.get_generations(), batch.get_generations(scenario))
+
+    def test_matches_scalar_update_with_disease(self):
+        batch = BatchPopulationModel([ModelRunOptions(10, 10, 10, 1, 0.5, 0.5, 0.5, 2, 1)],
+                                     numpy.random.default_rng(1))
+        batch.run_all_generations()
+        second_generation = batch.get_generations(0)[1]
+        population = Population(10, 10, 10)
+        expected = population.update_to_next_generation(ModelRunOptions(10, 10, 10, 1, 0.5, 0.5, 0.5, 2, 1),
+                                                        second_generation.disease_rate)
+        self.assertGreater(second_generation.disease_rate, 19)
+        self.assertLess(second_generation.disease_rate, 50)
+        self.assert_same_generations([expected], [second_generation])
+
+    def test_scenarios_are_trimmed_to_their_own_generations(self):
+        batch = BatchPopulationModel([ModelRunOptions(1, 1, 1, 2, 1, 1, 1, 1, 1000),
+                                      ModelRunOptions(1, 1, 1, 4, 1, 1, 1, 1, 1000)])
+        batch.run_all_generations()
+        self.assertEqual(batch.get_generations_count(), 5)
+        self.assertEqual(len(batch.get_generations(0)), 3)
+        self.assertEqual(len(batch.get_generations(1)), 5)
+
+    def test_convergence_detection_gives_same_history(self):
+        options = [ModelRunOptions(10, 10, 10, 200, 0, 0, 0, 0, 5),
+                   ModelRunOptions(0, 0, 10, 300, 1, 1, 1, 0, 1000),
+                   ModelRunOptions(1000, 1000, 1000, 3, 0.9, 0.9, 0.5, 1.1, 10000)]
+        expected = BatchPopulationModel(options, numpy.random.default_rng(1))
+        expected.run_all_generations()
+        batch = BatchPopulationModel(options, numpy.random.default_rng(1))
+        batch.run_all_generations(detect_convergence=True)
+        self.assertEqual(batch.get_generations_count(), 301)
+        for scenario in range(0, len(options)):
+            self.assert_same_generations(expected.get_generations(scenario), batch.get_generations(scenario))
+
+    def assert_same_generations(self, expected, actual):
+        self.assertEqual(len(expected), len(actual))
+        for e, a in zip(expected, actual):
+            self.assertEqual((e.juveniles, e.adults, e.seniles, e.disease_rate),
+                             (a.juveniles, a.adults, a.seniles, a.disease_rate))
+
+    def test_common_random_numbers_share_disease_rates(self):
+        options = [ModelRunOptions(1000, 1000, 1000, 20, 0.9, 0.9, 0.5, 1.5, 4000)] * 5
+        model = BatchPopulationModel(options, numpy.random.default_rng(4), common_random_numbers=True)
+        model.run_all_generations()
+        disease_rates = model.get_history()[3]
+        self.assertGreater(disease_rates.max(), 0)
+        self.assertTrue((disease_rates == disease_rates[:, :1]).all())
+
+    def test_overflow_raises_by_default(self):
+        batch = BatchPopulationModel([ModelRunOptions(10, 10, 10, 100, 1, 1, 1, 10, 10 ** 30)])
+        with self.assertRaises(OverflowError):
+            batch.run_all_generations()
+
+    def test_overflow_can_saturate(self):
+        batch = BatchPopulationModel([ModelRunOptions(10, 10, 10, 100, 1, 1, 1, 10, 10 ** 30),
+                                      ModelRunOptions(10, 10, 10, 100, 1, 1, 0, 1, 10 ** 30)], overflow="saturate")
+        batch.run_all_generations()
+        last = batch.get_generations(0)[-1]
+        self.assertEqual(last.juveniles, 2 ** 63 - 1)
+        self.assertEqual(last.seniles, 2 ** 63 - 1)
+        self.assertEqual(batch.get_generations(1)[-1].juveniles, 10)
+
+
+class NumericsTests(TestCase):
+    def test_float_arithmetic_matches_default(self):
+        options = ModelRunOptions(1000, 777, 333, 30, 0.26, 0.73, 0.5, 1.26, 10 ** 5)
+        expected = PopulationModel(options, 4)
+        expected.run_all_generations()
+        model = PopulationModel(options, 4, arithmetic=Numerics.FloatArithmetic())
+        model.run_all_generations()
+        self.assertEqual([vars_of(g) for g in expected.get_generations()],
+                         [vars_of(g) for g in model.get_generations()])
+
+    def test_int64_arithmetic_saturates(self):
+        arithmetic = Numerics.CheckedInt64Arithmetic()
+        model = PopulationModel(ModelRunOptions(10, 10, 10, 100, 1, 1, 1, 10, 10 ** 100), arithmetic=arithmetic)
+        model.run_all_generations()
+        self.assertEqual(model.get_generation(100).juveniles, Numerics.INT64_MAX)
+        self.assertGreater(arithmetic.saturations, 0)
+
+    def test_int64_arithmetic_can_raise(self):
+        model = PopulationModel(ModelRunOptions(10, 10, 10, 100, 1, 1, 1, 10, 10 ** 100),
+                                arithmetic=Numerics.CheckedInt64Arithmetic(saturate=False))
+        with self.assertRaises(OverflowError):
+            model.run_all_generations()
+
+    def test_exact_arithmetic_keeps_precision(self):
+        population = Population(0, 10 ** 17 + 1, 0, arithmetic=Numerics.ExactArithmetic())
+        self.assertEqual(population.calculate_born_juveniles(1.1), 110000000000000001)
+        self.assertNotEqual(Population(0, 10 ** 17 + 1, 0).calculate_born_juveniles(1.1), 110000000000000001)
+
+    def test_exact_arithmetic_uses_decimal_rates(self):
+        population = Population(10, 0, 10, arithmetic=Numerics.ExactArithmetic())
+        self.assertEqual(population.calculate_surviving_juveniles(0.26, 0), 2)
+        self.assertEqual(population.calculate_surviving_seniles(0.3, 50), 1)
+
+
+class StagedPopulationModelTests(TestCase):
+    def test_three_stages_match_population_model(self):
+        for options in (ModelRunOptions(10, 10, 10, 5, 1, 1, 0, 2, 10000),
+                        ModelRunOptions(1000, 777, 333, 25, 0.26, 0.73, 0.5, 1.26, 4000)):
+            expected = PopulationModel(options, 12)
+            expected.run_all_generations()
+            model = StagedPopulationModel(LifecycleOptions.from_model_run_options(options), 12)
+            model.run_all_generations()
+            counts, disease_rates = model.get_history()
+            self.assertEqual([vars_of(g) for g in expected.get_generations()],
+                             [(int(c[0]), int(c[1]), int(c[2]), int(d)) for c, d in zip(counts, disease_rates)])
+
+    def test_four_stages(self):
+        options = LifecycleOptions([StageDefinition("Egg", 1), StageDefinition("Nymph", 1),
+                                    StageDefinition("Winged"), StageDefinition("Senile", 0.5)],
+                                   [[0, 0, 3, 0], [0.5, 0, 0, 0], [0, 1, 0, 0], [0, 0, 1, 0]],
+                                   [0, 0, 10, 0], 3, 10 ** 6)
+        model = StagedPopulationModel(options, 1)
+        model.run_all_generations()
+        self.assertEqual(list(model.get_stage_counts("Egg")), [0, 30, 0, 0])
+        self.assertEqual(list(model.get_stage_counts("Nymph")), [0, 0, 15, 0])
+        self.assertEqual(list(model.get_stage_counts("Winged")), [10, 0, 0, 15])
+        self.assertEqual(list(model.get_stage_counts("Senile")), [0, 10, 0, 0])
+
+    def test_rejects_wrong_sized_matrix(self):
+        with self.assertRaises(ValueError):
+            StagedPopulationModel(LifecycleOptions([StageDefinition("Only")], [[1, 0]], [1], 3, 10))
+
+    def test_overflowing_stage_totals_raise(self):
+        options = LifecycleOptions([StageDefinition("First"), StageDefinition("Second")], [[1, 1], [0, 0]],
+                                   [2 ** 62, 2 ** 62], 1, 10 ** 30)
+        with self.assertRaises(OverflowError):
+            StagedPopulationModel(options, 1).run_all_generations()
+        # just under the limit is fine
+        options.starting_counts = [2 ** 62, 2 ** 61]
+        model = StagedPopulationModel(options, 1)
+        model.run_all_generations()
+        self.assertEqual(list(model.get_stage_counts("First")), [2 ** 62, 2 ** 62 + 2 ** 61])
+
+    def test_uses_disease_model(self):
+        options = ModelRunOptions(1000, 1000, 1000, 20, 0.9, 0.9, 0.5, 1.5, 4000)
+        expected = PopulationModel(options, 12, disease_model=Disease.DensityDependentDisease())
+        expected.run_all_generations()
+        model = StagedPopulationModel(LifecycleOptions.from_model_run_options(options), 12,
+                                      disease_model=Disease.DensityDependentDisease())
+        model.run_all_generations()
+        counts, disease_rates = model.get_history()
+        self.assertEqual([vars_of(g) for g in expected.get_generations()],
+                         [(int(c[0]), int(c[1]), int(c[2]), int(d)) for c, d in zip(counts, disease_rates)])
+
+
+class MetapopulationModelTests(TestCase):
+    def test_without_migration_patches_match_scalar_model(self):
+        options = [ModelRunOptions(10, 10, 10, 5, 1, 1, 0, 2, 10000),
+                   ModelRunOptions(1000, 777, 333, 5, 0.26, 0.73, 0.5, 1.26, 10 ** 9)]
+        model = MetapopulationModel(options, MigrationMatrix(2, [], [], []))
+        model.run_all_generations()
+        for patch in range(0, 2):
+            expected = PopulationModel(options[patch])
+            expected.run_all_generations()
+            self.assertEqual([vars_of(g) for g in expected.get_generations()],
+                             [(int(j[patch]), int(a[patch]), int(s[patch]), int(d[patch]))
+                              for j, a, s, d in model.get_history()])
+
+    def test_migration_moves_population_between_neighbours(self):
+        options = [ModelRunOptions(0, 100, 0, 1, 1, 1, 1, 0, 10 ** 9), ModelRunOptions(0, 0, 0, 1, 1, 1, 1, 0, 10 ** 9)]
+        model = MetapopulationModel(options, MigrationMatrix.from_neighbours(2, [(0, 1)], 0.25))
+        model.run_all_generations()
+        juveniles, adults, seniles = model.get_counts()
+        self.assertEqual(list(seniles), [75, 25])
+        self.assertEqual(int(seniles.sum()), 100)
+
+    def test_disease_triggers_per_patch(self):
+        options = [ModelRunOptions(10, 10, 10, 1, 1, 1, 1, 1, 30), ModelRunOptions(10, 10, 10, 1, 1, 1, 1, 1, 31)]
+        model = MetapopulationModel(options, MigrationMatrix(2, [], [], []), numpy.random.default_rng(2))
+        model.run_all_generations()
+        disease_rates = model.get_history()[1][3]
+        self.assertGreater(disease_rates[0], 19)
+        self.assertEqual(disease_rates[1], 0)
+
+    def test_grid_conserves_population(self):
+        options = [ModelRunOptions(5, 5, 5, 10, 1, 1, 1, 0, 10 ** 9)] * 12
+        model = MetapopulationModel(options, MigrationMatrix.grid(4, 3, 0.2), record_history=False)
+        model.run_all_generations()
+        juveniles, adults, seniles = model.get_counts()
+        self.assertEqual(int(juveniles.sum() + adults.sum() + seniles.sum()), 12 * 15)
+        self.assertEqual(model.get_history(), [])
+
+    def test_rejects_rates_adding_up_to_more_than_one(self):
+        with self.assertRaises(ValueError):
+            MigrationMatrix(2, [0, 0], [1, 1], [0.6, 0.6])
+
+    def test_migration_overflow_raises_by_default(self):
+        options = [ModelRunOptions(0, 0, 2 ** 62, 1, 1, 0, 1, 0, 10 ** 30)] * 3
+        model = MetapopulationModel(options, MigrationMatrix(3, [0, 1, 2], [2, 2, 0], [0.9, 0.9, 0.1]))
+        with self.assertRaises(OverflowError):
+            model.run_all_generations()
+
+    def test_migration_overflow_can_saturate(self):
+        options = [ModelRunOptions(0, 0, 2 ** 62, 1, 1, 0, 1, 0, 10 ** 30)] * 3
+        migration = MigrationMatrix(3, [0, 1, 2], [2, 2, 0], [0.9, 0.9, 0.1])
+        model = MetapopulationModel(options, migration, overflow="saturate")
+        model.run_all_generations()
+        juveniles, adults, seniles = model.get_counts()
+        self.assertEqual(int(seniles[2]), Numerics.INT64_MAX)
+        self.assertTrue((seniles > 0).all())
+
+    def test_uses_disease_model(self):
+        options = [ModelRunOptions(1000, 1000, 1000, 20, 0.9, 0.9, 0.5, 1.5, 4000),
+                   ModelRunOptions(10, 10, 10, 20, 1, 1, 0, 2, 100)]
+        model = MetapopulationModel(options, MigrationMatrix(2, [], [], []),
+                                    disease_model=Disease.DensityDependentDisease())
+        model.run_all_generations()
+        for patch in range(0, 2):
+            expected = PopulationModel(options[patch], disease_model=Disease.DensityDependentDisease())
+            expected.run_all_generations()
+            self.assertEqual([vars_of(g) for g in expected.get_generations()],
+                             [(int(j[patch]), int(a[patch]), int(s[patch]), int(d[patch]))
+                              for j, a, s, d in model.get_history()])
+
+
+class MonteCarloRunnerTests(TestCase):
+    def test_no_disease_gives_deterministic_statistics(self):
+        result = MonteCarloRunner(processes=1, chunk_size=7).run(
+            ModelRunOptions(10, 10, 10, 5, 1, 1, 0, 2, 10000), 20, seed=1)
+        self.assertEqual(result.replicates, 20)
+        self.assertEqual(result.mean_total_population, [30, 40, 50, 80, 100, 160])
+        self.assertEqual(result.total_population_percentiles[50], [30, 40, 50, 80, 100, 160])
+        self.assertEqual(result.disease_probability, [0, 0, 0, 0, 0, 0])
+
+    def test_disease_probability_when_always_triggered(self):
+        result = MonteCarloRunner(processes=1, chunk_size=10).run(
+            ModelRunOptions(10, 10, 10, 3, 0.5, 0.5, 0.5, 2, 1), 25, seed=1)
+        self.assertEqual(result.disease_probability, [0, 1, 1, 1])
+
+    def test_same_seed_gives_same_result_in_processes(self):
+        options = ModelRunOptions(1000, 1000, 1000, 10, 0.9, 0.9, 0.5, 1.5, 4000)
+        inline = MonteCarloRunner(processes=1, chunk_size=50, sample_size=30).run(options, 200, seed=5)
+        pooled = MonteCarloRunner(processes=2, chunk_size=50, sample_size=30).run(options, 200, seed=5)
+        self.assertEqual(inline.mean_total_population, pooled.mean_total_population)
+        self.assertEqual(inline.total_population_percentiles, pooled.total_population_percentiles)
+
+    def test_rejects_no_replicates_or_sample(self):
+        options = ModelRunOptions(10, 10, 10, 5, 1, 1, 0, 2, 10000)
+        with self.assertRaises(ValueError):
+            MonteCarloRunner(processes=1).run(options, 0)
+        with self.assertRaises(ValueError):
+            MonteCarloRunner(processes=1, sample_size=0)
+
+    def test_results_are_plain_floats(self):
+        result = MonteCarloRunner(processes=1).run(ModelRunOptions(10, 10, 10, 5, 1, 1, 0, 2, 10000), 3, seed=1)
+        for values in [result.mean_total_population, result.disease_probability] + \
+                list(result.total_population_percentiles.values()):
+            self.assertTrue(all(type(value) is float for value in values))
+
+    def test_uses_disease_model(self):
+        options = ModelRunOptions(1000, 1000, 1000, 20, 0.9, 0.9, 0.5, 1.5, 4000)
+        expected = PopulationModel(options, disease_model=Disease.DensityDependentDisease())
+        expected.run_all_generations()
+        for processes in (1, 2):
+            result = MonteCarloRunner(processes=processes, chunk_size=4,
+                                      disease_model=Disease.DensityDependentDisease()).run(options, 10, seed=1)
+            self.assertEqual(result.mean_total_population,
+                             [g.juveniles + g.adults + g.seniles for g in expected.get_generations()])
+
+
+class DiseaseModelTests(TestCase):
+    def test_threshold_is_the_default(self):
+        options = ModelRunOptions(1000, 1000, 1000, 30, 0.9, 0.9, 0.5, 1.5, 4000)
+        expected = PopulationModel(options, 8)
+        expected.run_all_generations()
+        model = PopulationModel(options, 8, disease_model=Disease.ThresholdDisease())
+        model.run_all_generations()
+        self.assertEqual([vars_of(g) for g in expected.get_generations()],
+                         [vars_of(g) for g in model.get_generations()])
+        self.assertGreater(sum(g.disease_rate for g in model.get_generations()), 0)
+
+    def test_batched_rates_match_scalar_rates(self):
+        totals = numpy.array([0, 10, 999, 1000, 1001, 5000, 10 ** 9])
+        triggers = numpy.array([1000] * 6 + [0])
+        for disease_model in (Disease.DensityDependentDisease(), Disease.LogisticDisease(),
+                              Disease.SeasonalDisease(Disease.LogisticDisease(), 4)):
+            expected = [disease_model.rate(int(t), int(trigger), 3, None) for t, trigger in zip(totals, triggers)]
+            self.assertEqual(disease_model.rates(totals, triggers, 3, None).tolist(), expected)
+
+    def test_seasonal_rates_for_many_generations(self):
+        disease_model = Disease.SeasonalDisease(Disease.DensityDependentDisease(), period=4, amplitude=1)
+        rates = disease_model.rates(2000, 1000, numpy.arange(0, 4), None)
+        self.assertEqual(rates.tolist(), [70, 100, 70, 0])
+
+    def test_batch_matches_scalar_model(self):
+        options = [ModelRunOptions(1000, 1000, 1000, 20, 0.9, 0.9, 0.5, 1.5, 4000),
+                   ModelRunOptions(10, 10, 10, 20, 1, 1, 0, 2, 100)]
+        for disease_model in (Disease.DensityDependentDisease(), Disease.LogisticDisease(),
+                              Disease.SeasonalDisease(Disease.LogisticDisease())):
+            batch = BatchPopulationModel(options, disease_model=disease_model)
+            batch.run_all_generations()
+            for scenario in range(0, len(options)):
+                model = PopulationModel(options[scenario], disease_model=disease_model)
+                model.run_all_generations()
+                self.assertEqual([vars_of(g) for g in model.get_generations()],
+                                 [vars_of(g) for g in batch.get_generations(scenario)])
+
+    def test_convergence_with_deterministic_disease(self):
+        options = ModelRunOptions(1000, 1000, 1000, 300, 0.9, 0.9, 0.5, 1.5, 4000)
+        expected = PopulationModel(options, disease_model=Disease.DensityDependentDisease())
+        expected.run_all_generations()
+        model = PopulationModel(options, disease_model=Disease.DensityDependentDisease())
+        model.run_all_generations(detect_convergence=True)
+        self.assertIsNotNone(model.get_convergence())
+        self.assertEqual([vars_of(g) for g in expected.get_generations()],
+                         [vars_of(g) for g in model.get_generations()])
+
+
+class ModelServiceTests(TestCase):
+    def run_service(self, test, **arguments):
+        # starts a service on a free localhost port, runs the test coroutine against it and closes it again
+        async def run():
+            service = Service.ModelService(processes=1, max_generations=100, **arguments)
+            await service.start("127.0.0.1", 0)
+            try:
+                return await test(service)
+            finally:
+                await service.close()
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(run())
+        finally:
+            loop.close()
+
+    def test_streams_generations_in_chunks(self):
+        row = headless_row(10)
+        row["generations"] = 10
+
+        async def test(service):
+            return await Service.request_runs("127.0.0.1", service.get_port(),
+                                              [{"id": "a", "options": row, "seed": 3}])
+        replies = self.run_service(test, chunk_size=3)["a"]
+        self.assertEqual([r["first_index"] for r in replies[:-1]], [0, 4, 7, 10])
+        self.assertEqual(replies[-1], {"id": "a", "done": True, "seed": 3})
+        model = PopulationModel(Headless.parse_options(row, ModelRunOptionsValidation(5, 100))[0], 3)
+        model.run_all_generations()
+        self.assertEqual([g for r in replies[:-1] for g in r["generations"]],
+                         [list(vars_of(g)) for g in model.get_generations()])
+
+    def test_reports_invalid_options(self):
+        row = headless_row(10)
+        row["adult_survival_rate"] = 2
+
+        async def test(service):
+            return await Service.request_runs("127.0.0.1", service.get_port(), [{"id": 1, "options": row}])
+        self.assertEqual(self.run_service(test)[1], [{"id": 1, "errors": {"adult_survival_rate": "Must be 1 or less"}}])
+
+    def test_identical_requests_in_flight_share_a_run(self):
+        options = ModelRunOptions(1000, 1000, 1000, 50, 0.9, 0.9, 0.5, 1.5, 4000)
+
+        async def test(service):
+            first = service.submit(options, 5).subscribe()
+            second = service.submit(options, 5).subscribe()
+            other = service.submit(options, 6).subscribe()
+            # the queues are read together - a subscriber that isn't read holds up the run for everyone sharing it
+            results = await asyncio.gather(*[read_messages(queue) for queue in (first, second, other)])
+            return service.runs, service.shared_runs, results
+        runs, shared_runs, results = self.run_service(test, chunk_size=20)
+        self.assertEqual((runs, shared_runs), (2, 1))
+        self.assertEqual(results[0], results[1])
+        self.assertNotEqual(results[0], results[2])
+        self.assertEqual(len(results[0]), 4)
+
+    def test_requests_after_the_first_chunk_start_a_new_run(self):
+        options = ModelRunOptions(1000, 1000, 1000, 50, 0.9, 0.9, 0.5, 1.5, 4000)
+
+        async def test(service):
+            first = service.submit(options, 5).subscribe()
+            first_message = await first.get()
+            second = service.submit(options, 5).subscribe()
+            results = await asyncio.gather(read_messages(first), read_messages(second))
+            return service.runs, service.shared_runs, [first_message] + results[0], results[1]
+        runs, shared_runs, first, second = self.run_service(test, chunk_size=20)
+        self.assertEqual((runs, shared_runs), (2, 0))
+        self.assertEqual(first, second)
+
+    def test_slow_subscriber_pauses_the_run(self):
+        options = ModelRunOptions(10, 10, 10, 50, 1, 1, 0, 2, 10 ** 9)
+        executor = ThreadPoolExecutor(1)
+
+        async def test(service):
+            with mock.patch("Service.run_job_chunk", wraps=Service.run_job_chunk) as run_job_chunk:
+                queue = service.submit(options, 1).subscribe()
+                # nothing reads the queue for a while - the run should stop once it's full
+                await asyncio.sleep(0.5)
+                paused_chunks = run_job_chunk.call_count
+                messages = await read_messages(queue)
+                return paused_chunks, run_job_chunk.call_count, messages
+        try:
+            paused_chunks, chunks, messages = self.run_service(test, chunk_size=1, executor=executor)
+        finally:
+            executor.shutdown()
+        self.assertLessEqual(paused_chunks, Service.Job.QUEUE_SIZE + 2)
+        self.assertEqual(chunks, 50)
+        self.assertEqual(len(messages), 51)
+        self.assertEqual(messages[-1], {"done": True, "seed": 1})
+
+    def test_rejects_requests_that_are_not_objects(self):
+        async def test(service):
+            reader, writer = await asyncio.open_connection("127.0.0.1", service.get_port())
+            writer.write(b'[1, 2]\n{"id": 7, "options": [1, 2]}\n{"id": 8, "options": {}, "seed": "x"}\n')
+            await writer.drain()
+            replies = [json.loads((await reader.readline()).decode("utf-8")) for i in range(0, 3)]
+            writer.close()
+            return replies
+        replies = sorted(self.run_service(test), key=lambda reply: str(reply["id"]))
+        self.assertEqual(replies[0], {"id": 7, "error": "options is not a JSON object"})
+        self.assertEqual(replies[1]["id"], 8)
+        self.assertEqual(replies[1]["errors"]["seed"], "Please enter a valid integer")
+        self.assertEqual(replies[2], {"id": None, "error": "Request is not a JSON object"})
+
+    def test_unexpected_errors_are_sent_back(self):
+        async def test(service):
+            with mock.patch.object(service, "submit", side_effect=RuntimeError("Something went wrong")):
+                return await Service.request_runs("127.0.0.1", service.get_port(),
+                                                  [{"id": 1, "options": headless_row(10)}])
+        self.assertEqual(self.run_service(test)[1], [{"id": 1, "error": "Something went wrong"}])
+
+
+async def read_messages(queue: asyncio.Queue):
+    # reads the messages a Service.Job puts on a queue, up to the None that marks the end
+    messages = []
+    message = await queue.get()
+    while message is not None:
+        messages.append(message)
+        message = await queue.get()
+    return messages
+
+
+class SensitivityTests(TestCase):
+    def test_derivatives_after_one_generation(self):
+        result = Sensitivity.SensitivityModel(ModelRunOptions(10, 20, 30, 1, 0.5, 0.5, 0.5, 2, 10000), 1).run()
+        self.assertEqual(result.counts, (40, 5, 25))
+        self.assertEqual(result.derivatives["adult_birth_rate"], (20, 0, 0))
+        self.assertEqual(result.derivatives["juvenile_survival_rate"], (0, 10, 0))
+        self.assertEqual(result.derivatives["adult_survival_rate"], (0, 0, 20))
+        self.assertEqual(result.derivatives["senile_survival_rate"], (0, 0, 30))
+        self.assertEqual(result.derivatives["disease_trigger"], (0, 0, 0))
+
+    def test_derivatives_hold_disease_rates_fixed(self):
+        sensitivity = Sensitivity.SensitivityModel(ModelRunOptions(10, 20, 30, 1, 0.5, 0.5, 0.5, 2, 1), 1)
+        result = sensitivity.run()
+        survival = (100 - sensitivity.get_model().get_generation(1).disease_rate) / 100
+        self.assertAlmostEqual(result.derivatives["juvenile_survival_rate"][1], 10 * survival)
+        self.assertAlmostEqual(result.derivatives["senile_survival_rate"][2], 30 * survival)
+
+    def test_derivatives_match_finite_differences(self):
+        # with large counts truncation hardly matters, so the derivatives are close to nudging each rate
+        options = ModelRunOptions(10 ** 9, 10 ** 9, 10 ** 9, 15, 0.9, 0.8, 0.5, 1.5, 10 ** 15)
+        result = Sensitivity.SensitivityModel(options, 1).run()
+        for field in ("juvenile_survival_rate", "adult_survival_rate", "senile_survival_rate", "adult_birth_rate"):
+            totals = []
+            for change in (-0.001, 0.001):
+                changed = ModelRunOptions(**vars(options))
+                setattr(changed, field, getattr(options, field) + change)
+                model = PopulationModel(changed)
+                model.run_all_generations()
+                totals.append(sum(vars_of(model.get_generation(15))[:3]))
+            expected = (totals[1] - totals[0]) / 0.002
+            self.assertAlmostEqual(result.get_total_derivative(field) / expected, 1, places=3)
+            self.assertEqual(result.total_derivatives[field][-1], result.get_total_derivative(field))
+
+    def test_morris_finds_fields_with_no_effect(self):
+        # with no seniles and no adults surviving the senile survival rate can't matter
+        options = ModelRunOptions(1000, 1000, 0, 10, 0.9, 0, 0.5, 1.5, 10 ** 9)
+        result = Sensitivity.morris(options, {"adult_birth_rate": (1, 2), "senile_survival_rate": (0, 1)},
+                                    trajectories=8, seed=3)
+        self.assertEqual(result.mu_star["senile_survival_rate"], 0)
+        self.assertGreater(result.mu_star["adult_birth_rate"], 0)
+        self.assertGreater(result.mu["adult_birth_rate"], 0)
+
+    def test_fields_with_no_effect_when_disease_triggers(self):
+        # every run shares the same disease rates (even across chunks), so the senile survival rate still can't
+        # make a difference once disease starts
+        options = ModelRunOptions(1000, 1000, 0, 10, 0.9, 0, 0.5, 1.5, 3000)
+        ranges = {"adult_birth_rate": (1, 2), "senile_survival_rate": (0, 1)}
+        model = PopulationModel(options, 3)
+        model.run_all_generations()
+        self.assertGreater(max(g.disease_rate for g in model.get_generations()), 0)
+        morris = Sensitivity.morris(options, ranges, trajectories=8, seed=3, chunk_size=5)
+        self.assertEqual(morris.mu_star["senile_survival_rate"], 0)
+        self.assertGreater(morris.mu_star["adult_birth_rate"], 0)
+        sobol = Sensitivity.sobol(options, ranges, samples=200, seed=3, chunk_size=150)
+        self.assertEqual(sobol.total["senile_survival_rate"], 0)
+        self.assertGreater(sobol.first_order["adult_birth_rate"], 0.5)
+
+    def test_sobol_indices(self):
+        options = ModelRunOptions(1000, 1000, 0, 10, 0.9, 0, 0.5, 1.5, 10 ** 9)
+        result = Sensitivity.sobol(options, {"adult_birth_rate": (1, 2), "juvenile_survival_rate": (0.5, 1),
+                                             "senile_survival_rate": (0, 1)}, samples=2000, seed=3)
+        self.assertEqual(result.total["senile_survival_rate"], 0)
+        self.assertLess(abs(result.first_order["senile_survival_rate"]), 0.1)
+        for field in ("adult_birth_rate", "juvenile_survival_rate"):
+            self.assertGreater(result.first_order[field], 0.1)
+            self.assertGreaterEqual(result.total[field], result.first_order[field] - 0.05)
+
+    def test_rejects_unknown_fields(self):
+        with self.assertRaises(ValueError):
+            Sensitivity.morris(ModelRunOptions(1, 1, 1, 5, 1, 1, 1, 1, 10), {"generations": (5, 10)})
+
+
+class CalibrationTests(TestCase):
+    def observed_file(self, directory, options):
+        model = PopulationModel(options, 1)
+        model.run_all_generations()
+        file_path = Path(directory) / "observed.csv"
+        CsvGenerator.write_generations_file(model, file_path)
+        return file_path
+
+    def test_reads_csv_generator_layout(self):
+        with tempfile.TemporaryDirectory() as directory:
+            observed = Calibration.ObservedSeries.read_csv(
+                self.observed_file(directory, ModelRunOptions(10, 10, 10, 5, 1, 1, 0, 2, 10000)))
+        self.assertEqual(observed.generations.tolist(), [0, 1, 2, 3, 4, 5])
+        self.assertEqual(observed.juveniles.tolist(), [10, 20, 20, 40, 40, 80])
+        self.assertEqual(observed.get_starting_counts(), (10, 10, 10))
+
+    def test_fit_recovers_rates(self):
+        truth = ModelRunOptions(1000, 1000, 1000, 20, 0.6, 0.8, 0.4, 1.8, 10 ** 12)
+        with tempfile.TemporaryDirectory() as directory:
+            observed = Calibration.ObservedSeries.read_csv(self.observed_file(directory, truth))
+        calibrator = Calibration.Calibrator(observed, ModelRunOptions(0, 0, 0, 0, 0.5, 0.5, 0.5, 1, 10 ** 12),
+                                            {"juvenile_survival_rate": (0, 1), "adult_survival_rate": (0, 1),
+                                             "senile_survival_rate": (0, 1), "adult_birth_rate": (0, 4)}, seed=1)
+        result = calibrator.fit()
+        for field in ("juvenile_survival_rate", "adult_survival_rate", "senile_survival_rate", "adult_birth_rate"):
+            self.assertAlmostEqual(getattr(result.options, field), getattr(truth, field), delta=0.05)
+        self.assertEqual(result.options.generations, 20)
+        self.assertLess(result.error, 0.001)
+        self.assertEqual(result.best_errors, sorted(result.best_errors, reverse=True))
+
+    def test_processes_give_same_fit(self):
+        observed = Calibration.ObservedSeries([0, 3, 6], [100, 150, 250], [100, 80, 120], [100, 90, 95])
+        ranges = {"adult_birth_rate": (0, 4), "juvenile_survival_rate": (0, 1)}
+        base = ModelRunOptions(0, 0, 0, 0, 0.5, 0.5, 0.5, 1, 300)
+        inline = Calibration.Calibrator(observed, base, ranges, seed=2, chunk_size=50).fit(5, 200)
+        pooled = Calibration.Calibrator(observed, base, ranges, seed=2, chunk_size=50, processes=2).fit(5, 200)
+        self.assertEqual(vars(inline.options), vars(pooled.options))
+        self.assertEqual(inline.best_errors, pooled.best_errors)
+
+    def test_fit_rejects_no_iterations_or_no_finite_errors(self):
+        observed = Calibration.ObservedSeries([0, 3, 6], [100, 150, 250], [100, 80, 120], [100, 90, 95])
+        calibrator = Calibration.Calibrator(observed, ModelRunOptions(0, 0, 0, 0, 0.5, 0.5, 0.5, 1, 300),
+                                            {"adult_birth_rate": (0, 4)}, seed=2)
+        with self.assertRaises(ValueError):
+            calibrator.fit(iterations=0)
+
+        def nan_errors(points, executor):
+            return numpy.full(len(points), numpy.nan)
+        with mock.patch.object(calibrator, "errors", side_effect=nan_errors):
+            with self.assertRaises(ValueError):
+                calibrator.fit(iterations=2, candidates=10)
+
+    def test_identical_candidates_get_identical_errors(self):
+        # the disease triggers, but every candidate (in every chunk) gets the same disease rates
+        observed = Calibration.ObservedSeries([0, 3, 6], [100, 150, 250], [100, 80, 120], [100, 90, 95])
+        calibrator = Calibration.Calibrator(observed, ModelRunOptions(0, 0, 0, 0, 0.5, 0.5, 0.5, 1, 300),
+                                            {"adult_birth_rate": (0, 4)}, seed=2, chunk_size=7)
+        points = numpy.repeat(numpy.random.default_rng(1).random((4, 1)), 5, axis=0)
+        errors = calibrator.errors(points).reshape(4, 5)
+        self.assertTrue((errors == errors[:, :1]).all())
+        self.assertEqual(len(set(errors[:, 0].tolist())), 4)
+
+
 if __name__ == '__main__':
     unittest.main()